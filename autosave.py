@@ -0,0 +1,227 @@
+# Autosave
+# Every couple of seconds, the canvas tiles that changed since the last
+# autosave are added to the end of a journal file. When Bunny Pyx starts
+# again (after closing the window, a crash or a flat battery) the journal
+# is played back to get the drawing back.
+#
+# Now and then the journal is compacted: it is replaced by a new journal
+# holding a single checkpoint record with the whole drawing. The new
+# journal is written next to the old one and renamed over it, so there is
+# always one complete journal on disk.
+#
+# Each record is
+#   "BPYJ", kind (1 byte), payload length and CRC-32 (4 bytes each), payload
+# Playback stops at a record that was cut short by a crash or whose CRC is
+# wrong, keeping everything before it.
+#
+# The disk writing happens on a worker thread, so update() and draw()
+# never wait for it. They only copy the changed tiles, so an autosave costs
+# about as much as what was drawn, however big the canvas is. A checkpoint
+# hands the worker a TileStore copy, which shares the tiles with the canvas
+# instead of copying their pixels.
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from dirty import TILE_SIZE
+from storage import drawing_bytes, drawing_from_bytes, pack_nibbles, unpack_nibbles
+
+JOURNAL_FILE = "autosave.journal"
+
+# Frames between autosaves (2 seconds at pyxel's usual 30 frames a second)
+AUTOSAVE_FRAMES = 60
+
+# The journal is compacted once about this many bytes of tiles were added
+CHECKPOINT_BYTES = 1 << 20
+
+RECORD = struct.Struct("<4sBII")
+RECORD_MAGIC = b"BPYJ"
+
+# Record kinds: some changed tiles, or the whole drawing
+RECORD_TILES = 0
+RECORD_CHECKPOINT = 1
+
+
+def tiles_payload(store, tiles):
+    # Tile record payload: the number of tiles, their (row, column) numbers
+    # and their pixels at 4 bits each. tiles is a (count, 2) array of tile
+    # rows and columns of a TileStore.
+    count = len(tiles)
+    data = store.get_tiles(tiles[:, 0], tiles[:, 1])
+    packed = pack_nibbles(data.reshape(count, -1))
+    return struct.pack("<I", count) + tiles.astype(np.uint16).tobytes() + packed.tobytes()
+
+
+def apply_tiles(store, payload):
+    # Copy the tiles of a tile record payload into a TileStore (leaving
+    # out any that don't fit, from a journal of a bigger canvas)
+    (count,) = struct.unpack_from("<I", payload)
+    coords = np.frombuffer(payload, dtype=np.uint16, count=count * 2, offset=4)
+    coords = coords.reshape(count, 2).astype(np.int64)
+    packed = np.frombuffer(payload, dtype=np.uint8, offset=4 + count * 4)
+    data = unpack_nibbles(packed.reshape(count, -1)).reshape(count, TILE_SIZE, TILE_SIZE)
+    inside = (coords[:, 0] < store.rows) & (coords[:, 1] < store.cols)
+    store.set_tiles(coords[inside, 0], coords[inside, 1], data[inside])
+
+
+def write_record(f, kind, payload):
+    f.write(RECORD.pack(RECORD_MAGIC, kind, len(payload), zlib.crc32(payload)))
+    f.write(payload)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def recover(filename, store):
+    # Play a journal back onto a TileStore. Returns how many records were
+    # played back, and the palette of the last checkpoint (or None).
+    try:
+        with open(filename, "rb") as f:
+            data = f.read()
+    except OSError:
+        return 0, None
+
+    offset = 0
+    played = 0
+    colors = None
+    while offset + RECORD.size <= len(data):
+        magic, kind, length, crc = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        payload = data[start:start + length]
+        if magic != RECORD_MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+            break
+
+        try:
+            if kind == RECORD_CHECKPOINT:
+                drawing, colors = drawing_from_bytes(payload)
+                height = min(drawing.shape[0], store.height)
+                width = min(drawing.shape[1], store.width)
+                store.clear()
+                store.write(drawing[:height, :width])
+            else:
+                apply_tiles(store, zlib.decompress(payload))
+        except (ValueError, zlib.error):
+            break
+
+        offset = start + length
+        played += 1
+    return played, colors
+
+
+class Autosave:
+    def __init__(self, store, dirty, colors, filename=JOURNAL_FILE):
+        # store is the live canvas TileStore, dirty its DirtyTracker and
+        # colors a function that returns the current palette
+        self.store = store
+        self.dirty = dirty
+        self.colors = colors
+        self.filename = filename
+        self.frames = 0
+        self.saved_colors = list(colors())
+
+        # The canvas starts out saved (it was just played back)
+        self.dirty.grid("autosave")
+        self.dirty.take("autosave")
+        try:
+            self.journal_bytes = os.path.getsize(filename)
+        except OSError:
+            self.journal_bytes = 0
+
+        # The last thing that went wrong writing to the disk, if anything.
+        # A record that failed may be missing from the journal, so then the
+        # next save writes the whole drawing again.
+        self.error = None
+        self.failed = False
+        self.closed = False
+
+        self.tasks = queue.Queue()
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+    def update(self):
+        # Call once a frame
+        self.frames += 1
+        if self.frames >= AUTOSAVE_FRAMES:
+            self.save()
+
+    def save(self):
+        # Hand the tiles that changed since the last save to the worker
+        self.frames = 0
+
+        # Tile records don't hold the palette, so a new palette (from
+        # loading a drawing) needs the whole drawing saved
+        if (
+            self.failed
+            or self.journal_bytes >= CHECKPOINT_BYTES
+            or self.colors() != self.saved_colors
+        ):
+            self.checkpoint()
+            return
+
+        tiles = self.dirty.take("autosave")
+        if not tiles.any():
+            return
+
+        # After a filter or clearing a layer, copying the whole canvas is
+        # quicker than picking out that many of its tiles
+        if tiles.mean() > 0.125:
+            self.checkpoint()
+            return
+        payload = tiles_payload(self.store, np.argwhere(tiles))
+        self.journal_bytes += len(payload)
+        self.tasks.put((RECORD_TILES, payload))
+
+    def checkpoint(self):
+        # Have the worker replace the journal with the whole drawing
+        self.failed = False
+        self.dirty.take("autosave")
+        self.journal_bytes = 0
+        self.saved_colors = list(self.colors())
+        self.tasks.put((RECORD_CHECKPOINT, (self.store.copy(), self.saved_colors)))
+
+    def close(self):
+        # Save what is left and wait until it is on the disk. Closing
+        # again does nothing.
+        if self.closed:
+            return
+        self.closed = True
+        self.save()
+        self.tasks.put(None)
+        self.worker.join()
+
+    def work(self):
+        # Runs on the worker thread
+        journal = None
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            kind, data = task
+            try:
+                if kind == RECORD_CHECKPOINT:
+                    if journal is not None:
+                        journal.close()
+                        journal = None
+                    new_file = self.filename + ".tmp"
+                    with open(new_file, "wb") as f:
+                        store, colors = data
+                        write_record(f, RECORD_CHECKPOINT, drawing_bytes(store.read(), colors))
+                    os.replace(new_file, self.filename)
+                else:
+                    if journal is None:
+                        journal = open(self.filename, "ab")
+                    write_record(journal, RECORD_TILES, zlib.compress(data, 1))
+            except OSError as error:
+                self.error = error
+                self.failed = True
+                if journal is not None:
+                    try:
+                        journal.close()
+                    except OSError:
+                        pass
+                    journal = None
+        if journal is not None:
+            journal.close()
@@ -0,0 +1,478 @@
+# Backends
+# Bunny Pyx talks to the screen, images, sound and input through a backend.
+# PyxelBackend is the real window. HeadlessBackend keeps everything in
+# memory, so the tools, filters and brushes can run in tests and batch
+# jobs on a machine without a display.
+import ctypes
+import math
+import random
+import zipfile
+
+try:
+    import tomllib
+except ImportError:  # Python older than 3.11
+    tomllib = None
+
+import numpy as np
+import pyxel
+
+from canvas_buffer import line_points
+
+
+class PyxelBackend:
+    def init(self, width, height, title):
+        pyxel.init(width, height, title=title)
+
+    def load(self, filename):
+        pyxel.load(filename)
+
+    def run(self, update, draw):
+        pyxel.run(update, draw)
+
+    def quit(self):
+        pyxel.quit()
+
+    def mouse(self, visible):
+        pyxel.mouse(visible)
+
+    # Images
+    def image(self, img):
+        return pyxel.image(img)
+
+    def new_image(self, width, height):
+        return pyxel.Image(width, height)
+
+    # Drawing on the screen
+    def cls(self, col):
+        pyxel.cls(col)
+
+    def pset(self, x, y, col):
+        pyxel.pset(x, y, col)
+
+    def pget(self, x, y):
+        return pyxel.pget(x, y)
+
+    def line(self, x1, y1, x2, y2, col):
+        pyxel.line(x1, y1, x2, y2, col)
+
+    def rect(self, x, y, w, h, col):
+        pyxel.rect(x, y, w, h, col)
+
+    def rectb(self, x, y, w, h, col):
+        pyxel.rectb(x, y, w, h, col)
+
+    def circ(self, x, y, r, col):
+        pyxel.circ(x, y, r, col)
+
+    def circb(self, x, y, r, col):
+        pyxel.circb(x, y, r, col)
+
+    def blt(self, x, y, img, u, v, w, h, colkey=None):
+        pyxel.blt(x, y, img, u, v, w, h, colkey)
+
+    def text(self, x, y, s, col):
+        pyxel.text(x, y, s, col)
+
+    # Palette (16 colors as 0xRRGGBB numbers)
+    def colors(self):
+        return pyxel.colors.to_list()
+
+    def set_colors(self, colors):
+        pyxel.colors[:] = colors
+
+    # Sound
+    def play(self, ch, snd):
+        pyxel.play(ch, snd)
+
+    # Input state
+    def btn(self, key):
+        return pyxel.btn(key)
+
+    def btnp(self, key, hold=0, repeat=0):
+        # With hold and repeat, a held key counts as pressed again every
+        # repeat frames once it has been down for hold frames
+        return pyxel.btnp(key, hold=hold, repeat=repeat)
+
+    def btnr(self, key):
+        return pyxel.btnr(key)
+
+    @property
+    def mouse_x(self):
+        return pyxel.mouse_x
+
+    @property
+    def mouse_y(self):
+        return pyxel.mouse_y
+
+    @property
+    def mouse_wheel(self):
+        return pyxel.mouse_wheel
+
+    @property
+    def frame_count(self):
+        return pyxel.frame_count
+
+    # Math helpers (angles are in degrees, like pyxel)
+    def rndi(self, a, b):
+        return pyxel.rndi(a, b)
+
+    def sin(self, deg):
+        return pyxel.sin(deg)
+
+    def cos(self, deg):
+        return pyxel.cos(deg)
+
+    # Background jobs get a few milliseconds of each frame
+    def run_jobs(self, jobs):
+        return jobs.run()
+
+
+def round_half_away(value):
+    # Pyxel rounds drawing coordinates half away from zero
+    if value >= 0:
+        return int(math.floor(value + 0.5))
+    return -int(math.floor(-value + 0.5))
+
+
+class HeadlessImage:
+    # An in-memory image that draws the same pixels as a pyxel.Image
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.data = np.zeros((height, width), dtype=np.uint8)
+        self.clip()
+        self.camera()
+
+    def data_ptr(self):
+        # Same kind of object pyxel returns, so CanvasBuffer works on both
+        return (ctypes.c_uint8 * self.data.size).from_buffer(self.data)
+
+    def clip(self, x=None, y=None, w=None, h=None):
+        # Only draw inside this box (the whole image without arguments).
+        # Like pyxel, the box is in image coordinates, not moved by camera.
+        if x is None:
+            x, y, w, h = 0, 0, self.width, self.height
+        x = round_half_away(x)
+        y = round_half_away(y)
+        self.clip_x1 = max(x, 0)
+        self.clip_y1 = max(y, 0)
+        self.clip_x2 = min(x + max(round_half_away(w), 0), self.width)
+        self.clip_y2 = min(y + max(round_half_away(h), 0), self.height)
+
+    def camera(self, x=None, y=None):
+        # Drawing at (x, y) lands at (x - camera x, y - camera y) in the image
+        self.camera_x = round_half_away(x) if x is not None else 0
+        self.camera_y = round_half_away(y) if y is not None else 0
+
+    def inside(self, x, y):
+        return self.clip_x1 <= x < self.clip_x2 and self.clip_y1 <= y < self.clip_y2
+
+    def cls(self, col):
+        # Like pyxel, cls fills the whole image, whatever the clip box is
+        self.data[:, :] = col
+
+    def pset(self, x, y, col):
+        x = round_half_away(x) - self.camera_x
+        y = round_half_away(y) - self.camera_y
+        self.plot(x, y, col)
+
+    def plot(self, x, y, col):
+        # Set one pixel at image coordinates, if it is inside the clip box
+        if self.inside(x, y):
+            self.data[y, x] = col
+
+    def pget(self, x, y):
+        x = round_half_away(x)
+        y = round_half_away(y)
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return int(self.data[y, x])
+        return 0
+
+    def fill_span(self, y, x1, x2, col):
+        # Draw a horizontal run of pixels at image coordinates, clipped to
+        # the clip box
+        if self.clip_y1 <= y < self.clip_y2:
+            x1 = max(x1, self.clip_x1)
+            x2 = min(x2, self.clip_x2 - 1)
+            if x1 <= x2:
+                self.data[y, x1:x2 + 1] = col
+
+    def line(self, x1, y1, x2, y2, col):
+        x1 = round_half_away(x1) - self.camera_x
+        y1 = round_half_away(y1) - self.camera_y
+        x2 = round_half_away(x2) - self.camera_x
+        y2 = round_half_away(y2) - self.camera_y
+
+        if x1 == x2 and y1 == y2:
+            self.plot(x1, y1, col)
+            return
+
+        xs, ys = line_points(x1, y1, x2, y2)
+        inside = (
+            (xs >= self.clip_x1) & (xs < self.clip_x2)
+            & (ys >= self.clip_y1) & (ys < self.clip_y2)
+        )
+        self.data[ys[inside], xs[inside]] = col
+
+    def rect(self, x, y, w, h, col):
+        x = round_half_away(x) - self.camera_x
+        y = round_half_away(y) - self.camera_y
+        w = round_half_away(w)
+        h = round_half_away(h)
+        if w <= 0 or h <= 0:
+            return
+        x1 = max(x, self.clip_x1)
+        y1 = max(y, self.clip_y1)
+        x2 = min(x + w, self.clip_x2)
+        y2 = min(y + h, self.clip_y2)
+        if x1 < x2 and y1 < y2:
+            self.data[y1:y2, x1:x2] = col
+
+    def rectb(self, x, y, w, h, col):
+        x = round_half_away(x) - self.camera_x
+        y = round_half_away(y) - self.camera_y
+        w = round_half_away(w)
+        h = round_half_away(h)
+        if w <= 0 or h <= 0:
+            return
+        self.fill_span(y, x, x + w - 1, col)
+        self.fill_span(y + h - 1, x, x + w - 1, col)
+        for row in range(y + 1, y + h - 1):
+            self.plot(x, row, col)
+            self.plot(x + w - 1, row, col)
+
+    def circle_extents(self, r):
+        # Half-width of the circle at each distance from its center
+        return [int(math.sqrt(r * r - d * d) + 0.5) for d in range(r + 1)]
+
+    def circ(self, x, y, r, col):
+        x = round_half_away(x) - self.camera_x
+        y = round_half_away(y) - self.camera_y
+        r = round_half_away(r)
+        if r < 0:
+            return
+
+        # A pixel is inside if it is inside either the row or the column
+        # extent, which is exactly what pyxel draws
+        extents = self.circle_extents(r)
+        reach = r
+        for dy in range(r + 1):
+            # Widest column that still reaches down to this row
+            while extents[reach] < dy:
+                reach -= 1
+            half = max(extents[dy], reach)
+            self.fill_span(y - dy, x - half, x + half, col)
+            self.fill_span(y + dy, x - half, x + half, col)
+
+    def circb(self, x, y, r, col):
+        x = round_half_away(x) - self.camera_x
+        y = round_half_away(y) - self.camera_y
+        r = round_half_away(r)
+        if r < 0:
+            return
+
+        for d, e in enumerate(self.circle_extents(r)):
+            for dx, dy in ((d, e), (e, d)):
+                self.plot(x - dx, y - dy, col)
+                self.plot(x + dx, y - dy, col)
+                self.plot(x - dx, y + dy, col)
+                self.plot(x + dx, y + dy, col)
+
+    def blt(self, x, y, img, u, v, w, h, colkey=None):
+        x = round_half_away(x) - self.camera_x
+        y = round_half_away(y) - self.camera_y
+        u = round_half_away(u)
+        v = round_half_away(v)
+        w = round_half_away(w)
+        h = round_half_away(h)
+
+        # Negative sizes flip the copied area
+        cols = np.arange(abs(w))
+        rows = np.arange(abs(h))
+        source_cols = u + (cols[::-1] if w < 0 else cols)
+        source_rows = v + (rows[::-1] if h < 0 else rows)
+
+        # Keep only pixels that are inside the clip box and the other image
+        keep_cols = (
+            (x + cols >= self.clip_x1) & (x + cols < self.clip_x2)
+            & (source_cols >= 0) & (source_cols < img.width)
+        )
+        keep_rows = (
+            (y + rows >= self.clip_y1) & (y + rows < self.clip_y2)
+            & (source_rows >= 0) & (source_rows < img.height)
+        )
+        if not keep_cols.any() or not keep_rows.any():
+            return
+
+        source = img.data[np.ix_(source_rows[keep_rows], source_cols[keep_cols])]
+        cols = x + cols[keep_cols]
+        rows = y + rows[keep_rows]
+        dest = self.data[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        if colkey is None:
+            dest[:, :] = source
+        else:
+            dest[:, :] = np.where(source == colkey, dest, source)
+
+    def text(self, x, y, s, col):
+        # There is no font in memory, so text is left out of headless frames
+        pass
+
+
+class HeadlessBackend:
+    # Keeps the screen, image banks and input state in memory.
+    # Tests and batch jobs set the input with set_mouse / press / release
+    # and advance time with step. The image banks can be made bigger than
+    # pyxel's 256x256 to try out larger canvases.
+    def __init__(self, seed=0, image_width=256, image_height=256):
+        self.screen = None
+        self.images = [HeadlessImage(image_width, image_height) for _ in range(3)]
+        self.random = random.Random(seed)
+        self.sounds = []
+        self.held = set()
+        self.pressed = set()
+        self.released = set()
+        self.mouse_x = 0
+        self.mouse_y = 0
+        self.mouse_wheel = 0
+        self.palette = list(pyxel.DEFAULT_COLORS)
+        self.frame_count = 0
+        self.running = True
+
+    def init(self, width, height, title):
+        self.screen = HeadlessImage(width, height)
+
+    def load(self, filename):
+        # Read the image banks out of a pyxel resource file
+        # (a zip holding a TOML file, where each row of pixels leaves out
+        # its repeated last value and repeated last rows are left out)
+        if tomllib is None:
+            raise RuntimeError(
+                "HeadlessBackend needs Python 3.11 or newer to read %s "
+                "(it uses tomllib)" % filename
+            )
+        with zipfile.ZipFile(filename) as archive:
+            resource = tomllib.loads(archive.read("pyxel_resource.toml").decode())
+
+        for image, bank in zip(self.images, resource.get("images", [])):
+            rows = bank["data"]
+            width = min(image.width, bank["width"])
+            height = min(image.height, bank["height"])
+            for y in range(height):
+                row = rows[min(y, len(rows) - 1)][:width]
+                image.data[y, :len(row)] = row
+                image.data[y, len(row):width] = row[-1]
+
+    def run(self, update, draw):
+        # Nothing drives frames on its own; call step() instead
+        self.update = update
+        self.draw = draw
+
+    def quit(self):
+        self.running = False
+
+    def mouse(self, visible):
+        pass
+
+    # Images
+    def image(self, img):
+        return self.images[img]
+
+    def new_image(self, width, height):
+        return HeadlessImage(width, height)
+
+    # Drawing on the screen
+    def cls(self, col):
+        self.screen.cls(col)
+
+    def pset(self, x, y, col):
+        self.screen.pset(x, y, col)
+
+    def pget(self, x, y):
+        return self.screen.pget(x, y)
+
+    def line(self, x1, y1, x2, y2, col):
+        self.screen.line(x1, y1, x2, y2, col)
+
+    def rect(self, x, y, w, h, col):
+        self.screen.rect(x, y, w, h, col)
+
+    def rectb(self, x, y, w, h, col):
+        self.screen.rectb(x, y, w, h, col)
+
+    def circ(self, x, y, r, col):
+        self.screen.circ(x, y, r, col)
+
+    def circb(self, x, y, r, col):
+        self.screen.circb(x, y, r, col)
+
+    def blt(self, x, y, img, u, v, w, h, colkey=None):
+        if isinstance(img, int):
+            img = self.images[img]
+        self.screen.blt(x, y, img, u, v, w, h, colkey)
+
+    def text(self, x, y, s, col):
+        self.screen.text(x, y, s, col)
+
+    # Palette (16 colors as 0xRRGGBB numbers)
+    def colors(self):
+        return list(self.palette)
+
+    def set_colors(self, colors):
+        self.palette = list(colors)
+
+    # Sound (remembered instead of played)
+    def play(self, ch, snd):
+        self.sounds.append((ch, snd))
+
+    # Input state
+    def set_mouse(self, x, y):
+        self.mouse_x = x
+        self.mouse_y = y
+
+    def scroll(self, amount):
+        # Turn the mouse wheel for the next frame
+        self.mouse_wheel = amount
+
+    def press(self, key):
+        if key not in self.held:
+            self.pressed.add(key)
+        self.held.add(key)
+
+    def release(self, key):
+        if key in self.held:
+            self.released.add(key)
+        self.held.discard(key)
+
+    def btn(self, key):
+        return key in self.held
+
+    def btnp(self, key, hold=0, repeat=0):
+        # Keys are only ever pressed once here, so repeats never happen
+        return key in self.pressed
+
+    def btnr(self, key):
+        return key in self.released
+
+    def step(self, draw=True):
+        # Run one frame, then forget which buttons were just pressed
+        self.update()
+        if draw:
+            self.draw()
+        self.pressed.clear()
+        self.released.clear()
+        self.mouse_wheel = 0
+        self.frame_count += 1
+
+    # Math helpers (angles are in degrees, like pyxel)
+    def rndi(self, a, b):
+        return self.random.randint(min(a, b), max(a, b))
+
+    def sin(self, deg):
+        return math.sin(math.radians(deg))
+
+    def cos(self, deg):
+        return math.cos(math.radians(deg))
+
+    # Background jobs get a few milliseconds of each frame
+    def run_jobs(self, jobs):
+        return jobs.run()
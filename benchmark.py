@@ -0,0 +1,396 @@
+# Bunny Pyx benchmarks
+# Times every filter, every algorithmic brush, brush strokes at every size,
+# stamping and whole frames, using the headless backend so no window opens.
+#
+#   python benchmark.py                          # 256x128 canvas
+#   python benchmark.py --sizes 256x128 1024x512 --output bench.json
+#   python benchmark.py --compare baseline.json  # flag regressions
+import argparse
+import importlib.util
+import inspect
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pyxel
+
+from autosave import Autosave
+from backend import HeadlessBackend
+from canvas_buffer import flood_fill
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# A case counts as a regression when its median gets this much slower
+DEFAULT_THRESHOLD = 0.10
+
+
+def load_bunny_pyx():
+    # bunny-pyx.py has a dash in its name, so it is loaded by path.
+    # Each canvas size gets a fresh copy of the module because the
+    # canvas size lives in module constants.
+    spec = importlib.util.spec_from_file_location(
+        "bunny_pyx", os.path.join(HERE, "bunny-pyx.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_app(width, height):
+    bunny_pyx = load_bunny_pyx()
+    bunny_pyx.CANVAS_WIDTH = width
+    bunny_pyx.CANVAS_HEIGHT = height
+
+    backend = HeadlessBackend(
+        seed=0, image_width=max(256, width), image_height=max(256, height)
+    )
+    app = bunny_pyx.BunnyPyx(backend)
+
+    # Start from a busy drawing so filters have real work to do
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(1, 16, size=(height, width), dtype=np.uint8)
+    pixels[rng.random((height, width)) < 0.3] = 0
+    app.canvas.write(pixels)
+    app.history.commit()
+    return bunny_pyx, backend, app
+
+
+def drag(backend, app, tool, size, x1, y1, x2, y2):
+    # Put the app in the middle of a drag from (x1, y1) to (x2, y2)
+    app.current_tool = tool
+    app.current_size = size
+    app.drawing = True
+    app.old_x = x1
+    app.old_y = y1
+    app.stroke.start(x1, y1, app.dab_spacing.get(tool))
+    backend.held.add(pyxel.MOUSE_BUTTON_LEFT)
+    backend.pressed.clear()
+    backend.released.clear()
+    backend.set_mouse(x2, y2)
+
+
+def collect_cases(bunny_pyx, backend, app, width, height, folder, autosave):
+    # Each case is (name, setup, run). setup runs before every timed run.
+    # Files are written to folder, and autosave is an Autosave of the app.
+    cases = []
+    mid_x = min(width, 256) // 2
+    mid_y = min(height, 128) // 2
+
+    def nothing():
+        pass
+
+    def busy():
+        # Filters run on the busy drawing every time, not on what the
+        # previous runs left behind (it is on the first layer, which is
+        # the top rows of all the layers)
+        app.canvas.write(app.history.last.read((0, 0, width, height)))
+
+    # Filters (the filter_ methods that take no arguments; the others
+    # are helpers that run chains of them)
+    for name in sorted(dir(app)):
+        method = getattr(app, name)
+        if (
+            name.startswith("filter_")
+            and callable(method)
+            and not inspect.signature(method).parameters
+        ):
+            cases.append((name, busy, method))
+
+    # A chain of filters that fuses into one pass
+    chain = [bunny_pyx.FILTER_FLIP_X, bunny_pyx.FILTER_WAVE, bunny_pyx.FILTER_INVERT]
+    cases.append(("filter_chain", busy, lambda: app.run_filters(chain)))
+
+    # Blur at a few radii
+    for radius in (4, 8):
+        def setup(radius=radius):
+            busy()
+            app.blur_radius = radius
+
+        cases.append(("filter_blur_r%d" % radius, setup, app.filter_blur))
+
+    # Pixelate with small, big and non-square blocks
+    for block in ((2, 2), (32, 32), (8, 3)):
+        def setup(block=block):
+            busy()
+            app.pixelate_block = block
+
+        cases.append(("filter_pixelate_%dx%d" % block, setup, app.filter_pixelate))
+
+    # Algorithmic brushes
+    algo_names = sorted(
+        (value, name)
+        for name, value in vars(bunny_pyx).items()
+        if name.startswith("ALGO_") and isinstance(value, int)
+    )
+    for value, name in algo_names:
+        def setup(value=value):
+            app.current_algo_brush = value
+            app.old_x = mid_x - 12
+            app.old_y = mid_y - 6
+
+        cases.append(
+            ("algo_" + name[5:].lower(), setup, lambda: app.apply_algo_brush(mid_x, mid_y))
+        )
+
+    # Brush, pencil and eraser strokes at every size (one 40 pixel drag step)
+    for tool_name in ("PENCIL", "BRUSH", "ERASER"):
+        tool = getattr(bunny_pyx, "TOOL_" + tool_name)
+        for size in bunny_pyx.SIZES:
+            def setup(tool=tool, size=size):
+                drag(backend, app, tool, size, mid_x - 20, mid_y - 5, mid_x + 20, mid_y + 5)
+
+            cases.append(("stroke_%s_%d" % (tool_name.lower(), size), setup, app.update))
+
+    # Stamping, and stamp and type strokes (one 40 pixel drag step)
+    cases.append(("stamp", nothing, lambda: app.stamp_image(mid_x, mid_y)))
+    for tool_name in ("STAMP", "TYPE"):
+        tool = getattr(bunny_pyx, "TOOL_" + tool_name)
+
+        def setup(tool=tool):
+            drag(backend, app, tool, 1, mid_x - 20, mid_y - 5, mid_x + 20, mid_y + 5)
+
+        cases.append(("stroke_%s" % tool_name.lower(), setup, app.update))
+
+    # Painting a line of typed text
+    def typed_text():
+        app.current_tool = bunny_pyx.TOOL_TYPE
+        app.start_text(8, mid_y)
+        app.typed_text = "The quick brown fox jumps"
+
+    cases.append(("text_commit", typed_text, app.commit_text))
+
+    # Fill bucket on the busy drawing and on an empty canvas
+    def empty_fill():
+        app.canvas.cls(0)
+
+    fill = lambda: flood_fill(app.canvas.read(), 0, 0, 7, app.fill_connectivity)
+    cases.append(("fill_busy", busy, fill))
+    cases.append(("fill_empty", empty_fill, fill))
+
+    # Saving, loading and exporting the busy drawing
+    drawing_file = os.path.join(folder, "drawing.bpx")
+    png_file = os.path.join(folder, "drawing.png")
+
+    def saved():
+        busy()
+        app.save_canvas(drawing_file)
+
+    cases.append(("file_save", busy, lambda: app.save_canvas(drawing_file)))
+    cases.append(("file_load", saved, lambda: app.load_canvas(drawing_file)))
+    cases.append(("file_export_png", busy, lambda: app.export_canvas(png_file)))
+
+    # Autosaving after one brush dab and after a change to a whole layer
+    # (only the part update() waits for; the worker thread writes the file)
+    def dab_changed():
+        autosave.save()
+        autosave.journal_bytes = 0
+        app.canvas.mark(mid_x - 7, mid_y - 7, 14, 14)
+
+    def all_changed():
+        autosave.save()
+        autosave.journal_bytes = 0
+        app.canvas.mark_all()
+
+    cases.append(("autosave_dab", dab_changed, autosave.save))
+    cases.append(("autosave_all", all_changed, autosave.save))
+
+    # Putting the layers together again after one brush dab on one layer,
+    # and after every layer changed everywhere
+    def layers_dab():
+        app.layers.flatten()
+        app.canvas.mark(mid_x - 7, mid_y - 7, 14, 14)
+
+    def layers_all():
+        app.layers.flatten()
+        app.layers.dirty.mark_all()
+
+    cases.append(("layers_flatten_dab", layers_dab, app.layers.flatten))
+    cases.append(("layers_flatten_all", layers_all, app.layers.flatten))
+
+    # Whole frames: idle, and in the middle of a brush drag
+    def idle():
+        app.drawing = False
+        backend.held.clear()
+        backend.pressed.clear()
+        backend.released.clear()
+        backend.set_mouse(mid_x, mid_y)
+
+    def brush_drag():
+        drag(backend, app, bunny_pyx.TOOL_BRUSH, bunny_pyx.SIZES[-1],
+             mid_x - 20, mid_y, mid_x + 20, mid_y)
+
+    def frame():
+        app.update()
+        app.draw()
+
+    def blur_job():
+        # A frame while a big blur is running in the background
+        idle()
+        app.jobs.cancel()
+        app.blur_radius = 8
+        app.current_filter = bunny_pyx.FILTER_BLUR
+        app.apply_filter(mid_x, mid_y)
+
+    def filter_preview():
+        # Frames with the filter tool over the canvas (preview is cached)
+        idle()
+        app.jobs.cancel()
+        app.current_tool = bunny_pyx.TOOL_FILTER
+        app.current_filter = bunny_pyx.FILTER_BLUR
+
+    def typing():
+        # Frames while text is being typed (the preview is cached)
+        idle()
+        app.jobs.cancel()
+        typed_text()
+
+    def zoomed_redraw():
+        # A frame that draws the whole view again at 4x zoom (like right
+        # after scrolling)
+        idle()
+        app.viewport.zoom_at(mid_x, mid_y, 4)
+        app.view_key = None
+
+    cases.append(("frame_idle", idle, frame))
+    cases.append(("frame_filter_preview", filter_preview, frame))
+    cases.append(("frame_brush_drag", brush_drag, frame))
+    cases.append(("frame_blur_job", blur_job, frame))
+    cases.append(("frame_typing", typing, frame))
+    cases.append(("frame_zoomed_redraw", zoomed_redraw, frame))
+    return cases
+
+
+def percentile(sorted_times, fraction):
+    # Nearest-rank percentile of an already sorted list
+    index = max(0, int(np.ceil(fraction * len(sorted_times))) - 1)
+    return sorted_times[index]
+
+
+def time_case(setup, run, repeat, warmup):
+    times = []
+    for i in range(warmup + repeat):
+        setup()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed * 1000)
+    times.sort()
+    return {
+        "min_ms": times[0],
+        "median_ms": float(np.median(times)),
+        "p95_ms": percentile(times, 0.95),
+        "runs": repeat,
+    }
+
+
+def run_benchmarks(sizes, repeat, warmup, only=None):
+    results = {}
+    for width, height in sizes:
+        bunny_pyx, backend, app = make_app(width, height)
+        size_name = "%dx%d" % (width, height)
+        results[size_name] = {}
+
+        # The saved files and the autosave journal go in a folder that is
+        # deleted afterwards, and the autosave worker thread is stopped
+        # even when a case fails
+        with tempfile.TemporaryDirectory() as folder:
+            autosave = Autosave(
+                app.layers.store,
+                app.layers.dirty,
+                backend.colors,
+                os.path.join(folder, "autosave.journal"),
+            )
+            try:
+                cases = collect_cases(bunny_pyx, backend, app, width, height, folder, autosave)
+                for name, setup, run in cases:
+                    if only and not any(part in name for part in only):
+                        continue
+                    stats = time_case(setup, run, repeat, warmup)
+                    results[size_name][name] = stats
+                    print(
+                        "%-10s %-28s min %9.3f  median %9.3f  p95 %9.3f ms"
+                        % (size_name, name, stats["min_ms"], stats["median_ms"], stats["p95_ms"])
+                    )
+            finally:
+                autosave.close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Compare medians with a stored run and list the cases that got slower
+    regressions = []
+    for size_name, cases in results.items():
+        for name, stats in cases.items():
+            old = baseline.get("results", {}).get(size_name, {}).get(name)
+            if old is None or old["median_ms"] <= 0:
+                continue
+            ratio = stats["median_ms"] / old["median_ms"]
+            if ratio > 1 + threshold:
+                status = "SLOWER"
+                regressions.append((size_name, name, ratio))
+            elif ratio < 1 - threshold:
+                status = "faster"
+            else:
+                status = ""
+            print(
+                "%-10s %-28s %9.3f -> %9.3f ms  x%.2f %s"
+                % (size_name, name, old["median_ms"], stats["median_ms"], ratio, status)
+            )
+    return regressions
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Bunny Pyx")
+    parser.add_argument("--sizes", nargs="+", default=[(256, 128)], type=parse_size,
+                        help="canvas sizes to test, like 256x128 1024x512")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per case")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed runs per case")
+    parser.add_argument("--only", nargs="+", help="only run cases containing these words")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown of the median before flagging (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    # The app loads its resources relative to the repository
+    os.chdir(HERE)
+
+    results = run_benchmarks(args.sizes, args.repeat, args.warmup, args.only)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n%d case(s) got slower than the baseline" % len(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
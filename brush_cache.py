@@ -0,0 +1,83 @@
+# Brush sprite cache
+# Some algorithmic brushes always draw the same picture for the same
+# brush state (angle and step). Each picture is drawn once into a slot
+# of an offscreen image and then copied onto the canvas with a single
+# blt.
+#
+# Every brush gets its own page of slots, big enough for all of its
+# states (36 angles times 14 steps for the built-in ones), so going back
+# and forth between brushes doesn't push the other brush's pictures out.
+# The pictures also depend on the palette, so changing it drops them
+# all. If a page does fill up, the slot that was used least recently is
+# drawn over.
+from collections import OrderedDict
+
+# Size of one sprite; the brush is drawn around its center
+SPRITE_SIZE = 32
+
+
+class SpritePage:
+    def __init__(self, backend, columns, rows):
+        self.image = backend.new_image(SPRITE_SIZE * columns, SPRITE_SIZE * rows)
+        self.slots = [
+            (column * SPRITE_SIZE, row * SPRITE_SIZE)
+            for row in range(rows)
+            for column in range(columns)
+        ]
+        self.clear()
+
+    def clear(self):
+        # key -> (u, v, colkey), least recently used first
+        self.entries = OrderedDict()
+        self.free = list(reversed(self.slots))
+
+
+class SpriteCache:
+    def __init__(self, backend, columns=32, rows=16):
+        self.backend = backend
+        self.columns = columns
+        self.rows = rows
+
+        # Sprites are drawn here first and then copied into their slot, so
+        # a brush always gets the same (rounded) coordinates whichever slot
+        # it ends up in
+        self.scratch = backend.new_image(SPRITE_SIZE, SPRITE_SIZE)
+
+        # Brush name -> its page, made the first time the brush is used
+        self.pages = {}
+        self.palette = None
+
+    def set_palette(self, palette):
+        # Sprites drawn with another palette are no use any more
+        if palette != self.palette:
+            self.palette = palette
+            for page in self.pages.values():
+                page.clear()
+
+    def get(self, brush, key, colors, render):
+        # Return the image and where the sprite for key is on it, drawing
+        # it first if needed. colors are the colors render can use; the
+        # sprite's transparent color is one that isn't among them.
+        page = self.pages.get(brush)
+        if page is None:
+            page = SpritePage(self.backend, self.columns, self.rows)
+            self.pages[brush] = page
+
+        entry = page.entries.get(key)
+        if entry is not None:
+            page.entries.move_to_end(key)
+            return (page.image,) + entry
+
+        if page.free:
+            u, v = page.free.pop()
+        else:
+            _, (u, v, _) = page.entries.popitem(last=False)
+
+        colkey = min(set(range(16)) - set(colors))
+        self.scratch.rect(0, 0, SPRITE_SIZE, SPRITE_SIZE, colkey)
+        render(self.scratch, SPRITE_SIZE // 2, SPRITE_SIZE // 2)
+        page.image.blt(u, v, self.scratch, 0, 0, SPRITE_SIZE, SPRITE_SIZE)
+
+        entry = (u, v, colkey)
+        page.entries[key] = entry
+        return (page.image,) + entry
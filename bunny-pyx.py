@@ -2,11 +2,43 @@
 # (\(\
 # ( -.-)
 # o_(")(")
+import atexit
+import os
+import sys
+
+import numpy as np
 import pyxel
 
+from autosave import Autosave, recover
+from backend import PyxelBackend
+from brush_cache import SPRITE_SIZE, SpriteCache
+from canvas_buffer import (
+    CanvasBuffer,
+    dominant_colors,
+    flood_fill_steps,
+    mode_filter_bands,
+)
+from dirty import DirtyTracker
+from gather import FusedChain, GatherMaps
+from glyphs import GlyphAtlas
+from history import History
+from jobs import JobRunner, run_to_end, scaled
+from layers import LAYER_COUNT, Layers
+from palette import get_remap
+from profiler import Profiler
+from registry import BRUSHES, FILTERS, load_plugins, register_brush, register_filter
+from replay import RecordingBackend
+from storage import export_png, load_drawing, save_drawing
+from stroke import Stroke
+from viewport import Viewport
+
 # Woskspace widths & heights
-CANVAS_WIDTH = 256
-CANVAS_HEIGHT = 128
+# The canvas can be bigger than the part of the window that shows it
+# (the view); scroll and zoom to get around
+CANVAS_WIDTH = 1024
+CANVAS_HEIGHT = 512
+VIEW_WIDTH = 256
+VIEW_HEIGHT = 128
 TOOLBAR_HEIGHT = 32
 
 # Tool numbers
@@ -62,7 +94,8 @@ STAMPS = [
     (96, 240),
 ]
 
-# Algorithmic brush types
+# Algorithmic brush types (their number in the registry, see the bottom
+# of this file)
 ALGO_RANDOM_CIRCLES = 0
 ALGO_ROTATING_LINES = 1
 ALGO_LOOPS = 2
@@ -72,83 +105,16 @@ ALGO_STARS = 5
 ALGO_CONFETTI = 6
 ALGO_WAVES = 7
 
-# Algorithmic brush icons (x, y) coordinates in resource file
-# For now they are placeholders until proper icons are added
-ALGO_BRUSH_ICONS = [
-    (0, 16),  # Random Circles
-    (0, 16),  # Rotating Lines
-    (0, 16),  # Loops
-    (0, 16),  # Spirals
-    (0, 16),  # Squares
-    (0, 16),  # Stars
-    (0, 16),  # Confetti
-    (0, 16),   # Waves
-]
-
-# Character icons for the type tool
-# These are placeholder coordinates for now
-# Will be replaced with actual character graphics
+# Character icons for the type tool: the 16x16 cells of the sprite sheet
+# that have a character drawn in them. Add a cell here when a new
+# character is drawn (tests/test_chars.py checks every cell has pixels).
 CHARS = [
-    # Latin uppercase alphabet
     (0, 48),  # A
     (16, 48),  # B
-    (32, 48),  # C
-    (48, 48),  # D
-    (64, 48),  # E
-    (80, 32),  # F
-    (96, 32),  # G
-    (112, 32),  # H
-    (128, 32),  # I
-    (144, 32),  # J
-    (160, 32),  # K
-    (176, 32),  # L
-    (192, 32),  # M
-    (208, 32),  # N
-    (224, 32),  # O
-    (240, 32),  # P
-    (0, 48),  # Q
-    (16, 48),  # R
-    (32, 48),  # S
-    (48, 48),  # T
-    (64, 48),  # U
-    (80, 48),  # V
-    (96, 48),  # W
-    (112, 48),  # X
-    (128, 48),  # Y
-    (144, 48),  # Z
-    
-    # Numbers
-    (160, 48),  # 0
-    (176, 48),  # 1
-    (192, 48),  # 2
-    (208, 48),  # 3
-    (224, 48),  # 4
-    (240, 48),  # 5
-    (0, 64),  # 6
-    (16, 64),  # 7
-    (32, 64),  # 8
-    (48, 64),  # 9
-    
-    # Symbols
-    (64, 64),  # .
-    (80, 64),  # ,
-    (96, 64),  # !
-    (112, 64),  # ?
-    (128, 64),  # :
-    (144, 64),  # ;
-    (160, 64),  # (
-    (176, 64),  # )
-    (192, 64),  # [
-    (208, 64),  # ]
-    (224, 64),  # {
-    (240, 64),  # }
-    (0, 80),  # +
-    (16, 80),  # -
-    (32, 80),  # *
-    (48, 80),  # /
+    (160, 32),  # T
 ]
 
-# Filter types
+# Filter types (their number in the registry, see the bottom of this file)
 FILTER_INVERT = 0
 FILTER_GRAYSCALE = 1
 FILTER_FLIP_X = 2
@@ -158,25 +124,72 @@ FILTER_WAVE = 5
 FILTER_PIXELATE = 6
 FILTER_BLUR = 7
 
-# Filter icons (x, y) coordinates in resource file
-# For now they are placeholders until proper icons are added
-FILTER_ICONS = [
-    (0, 16),  # Invert
-    (0, 16),  # Grayscale
-    (0, 16),  # Flip X
-    (0, 16),  # Flip Y
-    (0, 16),  # Rotate 90
-    (0, 16),  # Wave
-    (0, 16),  # Pixelate
-    (0, 16),  # Blur
-]
+# Filters work through the canvas in bands of rows of about this many
+# pixels, so a big filter can be spread over several frames
+FILTER_BAND_PIXELS = 4096
+
+# Width of the filter preview (a small copy of the canvas)
+PREVIEW_WIDTH = 64
+
+# Wave filter shape
+WAVE_AMPLITUDE = 4
+WAVE_FREQUENCY = 0.05
+
+# Smallest and largest blur radius ([ and ] change it)
+MIN_BLUR_RADIUS = 1
+MAX_BLUR_RADIUS = 8
+
+# Pixelate block sizes to choose from ([ and ] change both sides,
+# with Shift only the width, for blocks that are not square)
+PIXELATE_SIZES = [2, 3, 4, 6, 8, 12, 16, 24, 32]
+
+# Where Ctrl+S saves the drawing (and Ctrl+O loads it from), and where
+# Ctrl+E exports it as a PNG picture
+DRAWING_FILE = "drawing.bpx"
+PNG_FILE = "drawing.png"
+
+# Python files in here can add filters and algorithmic brushes
+PLUGIN_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugins")
+
+# Journal the canvas is autosaved to while Bunny Pyx runs
+AUTOSAVE_FILE = "autosave.journal"
+
+# Keys that type a character with the type tool: (key, character,
+# character with Shift held), for a US keyboard layout
+TEXT_KEYS = (
+    [(pyxel.KEY_A + i, chr(ord("a") + i), chr(ord("A") + i)) for i in range(26)]
+    + [(pyxel.KEY_0 + i, str(i), ")!@#$%^&*("[i]) for i in range(10)]
+    + [
+        (pyxel.KEY_SPACE, " ", " "),
+        (pyxel.KEY_PERIOD, ".", ">"),
+        (pyxel.KEY_COMMA, ",", "<"),
+        (pyxel.KEY_MINUS, "-", "_"),
+        (pyxel.KEY_EQUALS, "=", "+"),
+        (pyxel.KEY_SLASH, "/", "?"),
+        (pyxel.KEY_SEMICOLON, ";", ":"),
+        (pyxel.KEY_QUOTE, "'", '"'),
+        (pyxel.KEY_LEFTBRACKET, "[", "{"),
+        (pyxel.KEY_RIGHTBRACKET, "]", "}"),
+        (pyxel.KEY_BACKSLASH, "\\", "|"),
+        (pyxel.KEY_BACKQUOTE, "`", "~"),
+    ]
+)
+
+# Holding a key while typing repeats it after this many frames,
+# then every few frames
+TEXT_KEY_HOLD = 15
+TEXT_KEY_REPEAT = 2
 
 
 class BunnyPyx:
-    def __init__(self):
-        pyxel.init(256, 160, title="Bunny Pyx")
-        pyxel.load("assets/bunny-pyx.pyxres")
-        pyxel.mouse(False)  # Hide the system mouse cursor
+    def __init__(self, backend=None, autosave_file=None):
+        # The real pyxel window unless another backend (like
+        # HeadlessBackend for tests) is passed in. With autosave_file, the
+        # drawing is autosaved there and got back from it on the next start.
+        self.backend = backend if backend is not None else PyxelBackend()
+        self.backend.init(256, 160, title="Bunny Pyx")
+        self.backend.load("assets/bunny-pyx.pyxres")
+        self.backend.mouse(False)  # Hide the system mouse cursor
 
         # Initialize canvas
         self.current_tool = TOOL_PENCIL
@@ -192,172 +205,350 @@ class BunnyPyx:
         self.current_palette = 0
         self.num_palettes = len(COLOR_PALETTES)
 
+        # Initialize fill bucket
+        # 4 fills only through edges, 8 also fills through diagonal corners
+        # (C or clicking the fill tool again switches between them)
+        self.fill_connectivity = 4
+
         # Initialize stamp
         self.current_stamp = 0
         self.num_stamps = len(STAMPS)
         
         # Initialize algorithmic brush
         self.current_algo_brush = 0
-        self.num_algo_brushes = len(ALGO_BRUSH_ICONS)
+        self.brushes = list(BRUSHES.values())
+        self.num_algo_brushes = len(self.brushes)
         self.algo_brush_angle = 0  # For rotating brushes
         self.algo_brush_step = 0   # For incremental patterns
-        
+
+        # Brushes that look the same for the same angle, step and palette
+        # are drawn once and then copied from here
+        self.algo_sprites = SpriteCache(self.backend)
+
         # Initialize type tool
         self.current_char = 0
         self.num_chars = len(CHARS)
-        
+
+        # Text typed with the keyboard after clicking with the type tool.
+        # It is only shown as a preview (and can still be edited) until
+        # Enter or a click somewhere else paints it onto the canvas.
+        self.glyphs = GlyphAtlas()
+        self.typing = False
+        self.typed_text = ""
+        self.text_cursor = 0
+        self.text_x = 0
+        self.text_y = 0
+        self.text_preview = CanvasBuffer(
+            self.backend.new_image(VIEW_WIDTH, VIEW_HEIGHT),
+            VIEW_WIDTH,
+            VIEW_HEIGHT,
+        )
+        self.text_preview_key = None
+
         # Initialize filter tool
         self.current_filter = 0
-        self.num_filters = len(FILTER_ICONS)
+        self.filters = list(FILTERS.values())
+        self.num_filters = len(self.filters)
+        self.blur_radius = 1
+        self.pixelate_block = (4, 4)  # Width and height
+
+        # Filters picked with Shift+click wait here and run together
+        # (in one pass where possible) with the next filter applied
+        self.queued_filters = []
+        self.gather_maps = GatherMaps()
+        self.wave_offsets = {}  # Canvas width -> wave offset of each column
+
+        # Tools that show something other than the colors in the palette
+        # row: the attribute holding the selected item, the items' icons
+        # and anything else to draw on the row
+        self.palette_rows = {
+            TOOL_STAMP: ("current_stamp", STAMPS, None),
+            TOOL_ALGO_BRUSH: (
+                "current_algo_brush", [brush.icon for brush in self.brushes], None
+            ),
+            TOOL_TYPE: ("current_char", CHARS, None),
+            TOOL_FILTER: (
+                "current_filter",
+                [filter_entry.icon for filter_entry in self.filters],
+                self.draw_filter_labels,
+            ),
+        }
+
+        # Small filtered copy of the canvas shown next to the cursor,
+        # taking every preview_step-th pixel
+        self.preview_step = max(1, -(-CANVAS_WIDTH // PREVIEW_WIDTH))
+        preview_width = -(-CANVAS_WIDTH // self.preview_step)
+        preview_height = -(-CANVAS_HEIGHT // self.preview_step)
+        self.preview = CanvasBuffer(
+            self.backend.new_image(preview_width, preview_height),
+            preview_width,
+            preview_height,
+        )
+        self.preview_key = None
+
+        # Dragging with the stamp, type and algorithmic brush tools leaves
+        # one copy every this many pixels along the mouse path
+        self.dab_spacing = {
+            TOOL_STAMP: 8,
+            TOOL_ALGO_BRUSH: 4,
+            TOOL_TYPE: 12,
+        }
+        self.stroke = Stroke()
         
-        # Create a second image for the canvas
-        pyxel.image(1).cls(0)
+        # Brush size icons tinted with the current color
+        # They are only re-tinted when the color changes
+        sheet = CanvasBuffer(self.backend.image(0), 256, 256).pixels
+        self.brush_icon_pixels = np.hstack(
+            [sheet[sy:sy + 16, sx:sx + 16] for sx, sy in BRUSH_SIZE_ICONS]
+        )
+        self.brush_icons = self.backend.new_image(len(BRUSH_SIZE_ICONS) * 16, 16)
+        self.brush_icon_color = None
+        self.brush_icon_colkey = 0
+
+        # The toolbar is drawn into its own image, again only when what it
+        # shows changes, and copied to the screen every frame
+        self.icons = self.backend.image(0)
+        self.toolbar = self.backend.new_image(VIEW_WIDTH, TOOLBAR_HEIGHT)
+        self.toolbar_key = None
+
+        # Which parts of the flat picture (all the layers put together)
+        # changed, for redrawing the screen
+        self.dirty = DirtyTracker(CANVAS_WIDTH, CANVAS_HEIGHT)
+        self.dirty.grid("screen")
+
+        # Boxes on top of the canvas that the previews, cursor and
+        # overlays were drawn over last frame
+        self.overlay_rects = []
+
+        # The canvas is a few layers (kept as sparse tiles rather than in
+        # one of pyxel's 256x256 image banks, so they can be any size and
+        # only the painted parts take up memory). The tools draw on the
+        # current layer, self.canvas.
+        self.layers = Layers(
+            self.backend, CANVAS_WIDTH, CANVAS_HEIGHT, LAYER_COUNT, self.dirty
+        )
+        self.current_layer = 0
+        self.canvas = self.layers.buffers[0]
+
+        # The part of the canvas on screen. When zoomed in, the blown-up
+        # canvas pixels are put together in the view image.
+        self.viewport = Viewport(CANVAS_WIDTH, CANVAS_HEIGHT, VIEW_WIDTH, VIEW_HEIGHT)
+        self.view = CanvasBuffer(
+            self.backend.new_image(VIEW_WIDTH, VIEW_HEIGHT), VIEW_WIDTH, VIEW_HEIGHT
+        )
+        self.view_key = None
+        self.pan_anchor = None
+
+        # Mouse position on the canvas (the backend's is on the screen)
+        self.mouse_x = 0
+        self.mouse_y = 0
+
+        # Get back the drawing from the last time Bunny Pyx ran (before the
+        # undo history starts, so it can't be undone), then keep saving it
+        self.autosave = None
+        if autosave_file is not None:
+            played, colors = recover(autosave_file, self.layers.store)
+            if colors is not None:
+                self.backend.set_colors(colors)
+            self.autosave = Autosave(
+                self.layers.store, self.layers.dirty, self.backend.colors, autosave_file
+            )
+            # Closing the window doesn't go through Q, so also save what is
+            # left when Python exits (pyxel runs the exit hooks on closing)
+            atexit.register(self.autosave.close)
+
+        # Undo/redo history of changes to any layer
+        self.history = History(self.layers.store, dirty=self.layers.dirty)
+
+        # Frame profiler (F1 shows it, F2 saves a trace file)
+        self.profiler = Profiler(self)
+
+        # Filters and fills run a few milliseconds per frame (each slice
+        # timed by the profiler under the job's name)
+        self.jobs = JobRunner(timed=self.profiler.timed)
 
         # Run the application
-        pyxel.run(self.update, self.draw)
+        # update and draw are looked up every frame so the profiler can
+        # swap in timed versions while it is turned on
+        self.backend.run(lambda: self.update(), lambda: self.draw())
 
     def update(self):
-        if pyxel.btnp(pyxel.KEY_Q):
-            pyxel.quit()
+        # While typing, the keyboard edits the text instead
+        if self.typing:
+            self.update_text()
+        elif self.backend.btnp(pyxel.KEY_Q):
+            if self.autosave is not None:
+                self.autosave.close()
+            self.backend.quit()
+
+        # Profiler overlay on/off, and save what it recorded
+        if self.backend.btnp(pyxel.KEY_F1):
+            self.profiler.toggle()
+        if self.backend.btnp(pyxel.KEY_F2):
+            self.profiler.dump_trace()
+
+        # Getting around the canvas, then where the mouse is on it
+        self.update_viewport()
+        self.mouse_x, self.mouse_y = self.viewport.to_canvas(
+            self.backend.mouse_x, self.backend.mouse_y
+        )
+
+        # Backspace cancels a filter or fill that is still working
+        if self.backend.btnp(pyxel.KEY_BACKSPACE) and not self.typing:
+            self.jobs.cancel()
+
+        # Undo (Ctrl+Z), redo (Ctrl+Y or Ctrl+Shift+Z) and files
+        if (
+            self.backend.btn(pyxel.KEY_CTRL)
+            and not self.drawing
+            and not self.jobs.busy()
+            and not self.typing
+        ):
+            if self.backend.btnp(pyxel.KEY_Y) or (
+                self.backend.btnp(pyxel.KEY_Z) and self.backend.btn(pyxel.KEY_SHIFT)
+            ):
+                self.history.redo()
+            elif self.backend.btnp(pyxel.KEY_Z):
+                self.history.undo()
+
+            # Save (Ctrl+S), load (Ctrl+O) and export as PNG (Ctrl+E)
+            elif self.backend.btnp(pyxel.KEY_S):
+                self.save_canvas()
+            elif self.backend.btnp(pyxel.KEY_O):
+                self.load_canvas()
+            elif self.backend.btnp(pyxel.KEY_E):
+                self.export_canvas()
+
+        # Number keys pick the layer to draw on, V shows or hides it
+        if not self.typing and not self.drawing:
+            for i in range(self.layers.count):
+                if self.backend.btnp(pyxel.KEY_1 + i):
+                    self.select_layer(i)
+            if self.backend.btnp(pyxel.KEY_V):
+                self.layers.toggle(self.current_layer)
+
+        # [ and ] make the selected filter weaker or stronger. Not while a
+        # filter is running, as it reads the setting as it goes.
+        if self.current_tool == TOOL_FILTER and not self.jobs.busy():
+            if self.backend.btnp(pyxel.KEY_LEFTBRACKET):
+                self.change_filter_setting(-1)
+            if self.backend.btnp(pyxel.KEY_RIGHTBRACKET):
+                self.change_filter_setting(1)
+
+        # C switches the fill bucket between 4 and 8 neighbours
+        if self.current_tool == TOOL_FILL and self.backend.btnp(pyxel.KEY_C):
+            self.toggle_fill_connectivity()
             
         toolbar_y = 160 - TOOLBAR_HEIGHT  # Position at bottom of window
             
         # Toolbar interaction
-        if pyxel.btnp(pyxel.MOUSE_BUTTON_LEFT):
+        if self.backend.btnp(pyxel.MOUSE_BUTTON_LEFT):
             # Color/Stamp/Algo palette row interaction
-            if pyxel.mouse_y > toolbar_y + 16 and pyxel.mouse_y < toolbar_y + 32:
-                if self.current_tool == TOOL_STAMP:
-                    # Stamp selection mode
+            if self.backend.mouse_y > toolbar_y + 16 and self.backend.mouse_y < toolbar_y + 32:
+                row = self.palette_rows.get(self.current_tool)
+                if row is not None:
+                    # Stamp, brush, character or filter selection
+                    name, icons = row[:2]
+                    selected = getattr(self, name)
                     # Left arrow button (first position)
-                    if 0 <= pyxel.mouse_x < 16:
-                        self.current_stamp = (self.current_stamp - 1) % self.num_stamps
+                    if 0 <= self.backend.mouse_x < 16:
+                        selected = (selected - 1) % len(icons)
                     # Right arrow button (last position)
-                    elif 240 <= pyxel.mouse_x < 256:
-                        self.current_stamp = (self.current_stamp + 1) % self.num_stamps
-                    # Stamp selection (positions 1-14)
+                    elif 240 <= self.backend.mouse_x < 256:
+                        selected = (selected + 1) % len(icons)
+                    # Item selection (positions 1-14)
                     else:
-                        stamp_idx = (pyxel.mouse_x - 16) // 16
-                        if 0 <= stamp_idx < 14:  # Only 14 visible stamps at once
-                            self.current_stamp = stamp_idx
-                elif self.current_tool == TOOL_ALGO_BRUSH:
-                    # Algorithmic brush selection mode
-                    # Left arrow button (first position)
-                    if 0 <= pyxel.mouse_x < 16:
-                        self.current_algo_brush = (self.current_algo_brush - 1) % self.num_algo_brushes
-                    # Right arrow button (last position)
-                    elif 240 <= pyxel.mouse_x < 256:
-                        self.current_algo_brush = (self.current_algo_brush + 1) % self.num_algo_brushes
-                    # Brush selection (positions 1-14)
-                    else:
-                        brush_idx = (pyxel.mouse_x - 16) // 16
-                        if 0 <= brush_idx < self.num_algo_brushes:  # Only select valid brushes
-                            self.current_algo_brush = brush_idx
-                elif self.current_tool == TOOL_TYPE:
-                    # Character selection mode
-                    # Left arrow button (first position)
-                    if 0 <= pyxel.mouse_x < 16:
-                        self.current_char = (self.current_char - 1) % self.num_chars
-                    # Right arrow button (last position)
-                    elif 240 <= pyxel.mouse_x < 256:
-                        self.current_char = (self.current_char + 1) % self.num_chars
-                    # Character selection (positions 1-14)
-                    else:
-                        char_idx = (pyxel.mouse_x - 16) // 16
-                        if 0 <= char_idx < 14:  # Only 14 visible chars at once
-                            # Calculate the actual index based on potential multiple pages
-                            actual_idx = char_idx
-                            if actual_idx < self.num_chars:
-                                self.current_char = actual_idx
-                elif self.current_tool == TOOL_FILTER:
-                    # Filter selection mode
-                    # Left arrow button (first position)
-                    if 0 <= pyxel.mouse_x < 16:
-                        self.current_filter = (self.current_filter - 1) % self.num_filters
-                    # Right arrow button (last position)
-                    elif 240 <= pyxel.mouse_x < 256:
-                        self.current_filter = (self.current_filter + 1) % self.num_filters
-                    # Filter selection (positions 1-14)
-                    else:
-                        filter_idx = (pyxel.mouse_x - 16) // 16
-                        if 0 <= filter_idx < self.num_filters:
-                            self.current_filter = filter_idx
+                        index = (self.backend.mouse_x - 16) // 16
+                        if 0 <= index < min(14, len(icons)):
+                            selected = index
+                    setattr(self, name, selected)
                 else:
                     # Color selection mode
                     # Left arrow button (first position)
-                    if 0 <= pyxel.mouse_x < 16:
+                    if 0 <= self.backend.mouse_x < 16:
                         self.current_palette = (
                             self.current_palette - 1
                         ) % self.num_palettes
                     # Right arrow button (last position)
-                    elif 240 <= pyxel.mouse_x < 256:
+                    elif 240 <= self.backend.mouse_x < 256:
                         self.current_palette = (
                             self.current_palette + 1
                         ) % self.num_palettes
                     # Color selection (positions 1-14)
                     else:
-                        col_idx = (pyxel.mouse_x - 16) // 16
+                        col_idx = (self.backend.mouse_x - 16) // 16
                         if 0 <= col_idx < 14:
                             self.current_color = COLOR_PALETTES[self.current_palette][
                                 col_idx
                             ]
 
             # Tool selection (top row of toolbar)
-            elif pyxel.mouse_y > toolbar_y and pyxel.mouse_y < toolbar_y + 16:
-                col = pyxel.mouse_x // 16
+            elif self.backend.mouse_y > toolbar_y and self.backend.mouse_y < toolbar_y + 16:
+                col = self.backend.mouse_x // 16
                 if 0 <= col < NUM_TOOLS:
                     # Play sound when changing tools
                     if self.current_tool != col:
-                        pyxel.play(0, 4)  # Play sound 4 on channel 0
+                        self.backend.play(0, 4)  # Play sound 4 on channel 0
+                        self.commit_text()
+                    elif col == TOOL_FILL:
+                        # Clicking the fill tool again switches its mode
+                        self.toggle_fill_connectivity()
                     self.current_tool = col
 
                 # Size selection (right side)
-                size_idx = (pyxel.mouse_x - (256 - len(SIZES) * 16)) // 16
+                size_idx = (self.backend.mouse_x - (256 - len(SIZES) * 16)) // 16
                 if (
                     256 - len(SIZES) * 16
-                ) <= pyxel.mouse_x < 256 and 0 <= size_idx < len(SIZES):
+                ) <= self.backend.mouse_x < 256 and 0 <= size_idx < len(SIZES):
                     self.current_size = SIZES[size_idx]
 
-                # Clear canvas if clear tool selected
+                # Clear the current layer if clear tool selected
                 if self.current_tool == TOOL_CLEAR:
-                    pyxel.image(1).cls(0)
+                    self.jobs.cancel()
+                    self.canvas.cls(0)
 
         # Canvas drawing
-        if pyxel.mouse_y < CANVAS_HEIGHT:
-            # Start drawing
-            if pyxel.btnp(pyxel.MOUSE_BUTTON_LEFT):
+        if self.backend.mouse_y < VIEW_HEIGHT:
+            # Start drawing (not while a filter or fill is still working,
+            # since it would be drawn over when the job finishes)
+            if self.backend.btnp(pyxel.MOUSE_BUTTON_LEFT) and not self.jobs.busy():
                 self.drawing = True
-                self.start_x = pyxel.mouse_x
-                self.start_y = pyxel.mouse_y
+                self.start_x = self.mouse_x
+                self.start_y = self.mouse_y
                 
                 # For pencil and brush, draw immediately
                 if self.current_tool in (TOOL_PENCIL, TOOL_BRUSH, TOOL_ERASER):
-                    self.draw_point(pyxel.mouse_x, pyxel.mouse_y)
+                    self.draw_point(self.mouse_x, self.mouse_y)
                     if self.current_tool == TOOL_PENCIL:
-                        pyxel.play(0, 0)  # Play sound 1 on channel 0
+                        self.backend.play(0, 0)  # Play sound 1 on channel 0
                 
                 # Fill bucket tool
                 elif self.current_tool == TOOL_FILL:
-                    pyxel.image(1).cls(self.current_color)
-                    pyxel.play(0, 0)  # Play sound 1 on channel 0
-                
-                # Stamp tool - stamp immediately
-                elif self.current_tool == TOOL_STAMP:
-                    self.stamp_image(pyxel.mouse_x, pyxel.mouse_y)
+                    self.start_fill(self.mouse_x, self.mouse_y)
+                    self.backend.play(0, 0)  # Play sound 1 on channel 0
                 
-                # Algorithmic brush - apply immediately
-                elif self.current_tool == TOOL_ALGO_BRUSH:
-                    self.apply_algo_brush(pyxel.mouse_x, pyxel.mouse_y)
-                
-                # Type tool - place character immediately
-                elif self.current_tool == TOOL_TYPE:
-                    self.place_char(pyxel.mouse_x, pyxel.mouse_y)
+                # Type tool - start typing here (Shift+drag stamps the
+                # selected character instead)
+                elif self.current_tool == TOOL_TYPE and not self.backend.btn(pyxel.KEY_SHIFT):
+                    self.start_text(self.mouse_x, self.mouse_y)
+                    self.drawing = False
+
+                # Stamp, algorithmic brush and type tools - start a stroke,
+                # which puts the first copy down immediately
+                elif self.current_tool in self.dab_spacing:
+                    dabs = self.stroke.start(
+                        self.mouse_x,
+                        self.mouse_y,
+                        self.dab_spacing[self.current_tool],
+                    )
+                    self.apply_dabs(dabs, self.old_x, self.old_y)
                 
                 # Filter tool - apply filter immediately
                 elif self.current_tool == TOOL_FILTER:
-                    self.apply_filter(pyxel.mouse_x, pyxel.mouse_y)
+                    self.apply_filter(self.mouse_x, self.mouse_y)
             
             # Continue drawing
-            elif pyxel.btn(pyxel.MOUSE_BUTTON_LEFT) and self.drawing:
+            elif self.backend.btn(pyxel.MOUSE_BUTTON_LEFT) and self.drawing:
                 if self.current_tool in (TOOL_PENCIL, TOOL_BRUSH, TOOL_ERASER):
                     color = (
                         0 if self.current_tool == TOOL_ERASER else self.current_color
@@ -368,75 +559,145 @@ class BunnyPyx:
                         else self.current_size
                     )
 
-                    # Draw line between old position and new position
-                    pyxel.image(1).line(
-                        self.old_x, self.old_y, pyxel.mouse_x, pyxel.mouse_y, color
-                    )
-
-                    # For brush, make thicker line
                     if self.current_tool == TOOL_BRUSH:
-                        for dx in range(-size // 2, size // 2 + 1):
-                            for dy in range(-size // 2, size // 2 + 1):
-                                if dx * dx + dy * dy <= (size // 2) * (size // 2):
-                                    pyxel.image(1).line(
-                                        self.old_x + dx,
-                                        self.old_y + dy,
-                                        pyxel.mouse_x + dx,
-                                        pyxel.mouse_y + dy,
-                                        color,
-                                    )
-                    
+                        # Brush draws a thick line with round ends, one
+                        # span of pixels per row
+                        self.canvas.capsule(
+                            self.old_x,
+                            self.old_y,
+                            self.mouse_x,
+                            self.mouse_y,
+                            size // 2,
+                            color,
+                        )
+                    else:
+                        # Draw line between old position and new position
+                        self.canvas.line(
+                            self.old_x, self.old_y, self.mouse_x, self.mouse_y, color
+                        )
+
                     # Play sound for pencil tool, but not continuously - only every few frames
-                    if self.current_tool == TOOL_PENCIL and pyxel.frame_count % 6 == 0:
-                        pyxel.play(0, 1)  # Play sound 1 on channel 0
-                elif self.current_tool == TOOL_STAMP:
-                    # Allow continuous stamping while dragging, with minimal delay
-                    if pyxel.frame_count % 2 == 0:  # Reduced from 8 to 2 frames
-                        self.stamp_image(pyxel.mouse_x, pyxel.mouse_y)
-                elif self.current_tool == TOOL_ALGO_BRUSH:
-                    # Apply algorithmic brush with each movement
-                    self.apply_algo_brush(pyxel.mouse_x, pyxel.mouse_y)
-                elif self.current_tool == TOOL_TYPE:
-                    # Allow continuous character placement while dragging, with delay
-                    if pyxel.frame_count % 6 == 0:  # Slightly slower than stamps
-                        self.place_char(pyxel.mouse_x, pyxel.mouse_y)
+                    if self.current_tool == TOOL_PENCIL and self.backend.frame_count % 6 == 0:
+                        self.backend.play(0, 1)  # Play sound 1 on channel 0
+                elif self.current_tool in self.dab_spacing:
+                    # Stamp, algorithmic brush and type tools leave evenly
+                    # spaced copies along the path the mouse moved
+                    previous = (self.stroke.x, self.stroke.y)
+                    dabs = self.stroke.move(self.mouse_x, self.mouse_y)
+                    self.apply_dabs(dabs, *previous)
                 # Note: Filter tool only applies on initial click, not during drag
             
-            # End drawing
-            elif pyxel.btnr(pyxel.MOUSE_BUTTON_LEFT) and self.drawing:
-                self.drawing = False
-
-                # Line, rectangle and circle shapes finalize when mouse is released
-                if self.current_tool == TOOL_LINE:
-                    pyxel.image(1).line(
-                        self.start_x,
-                        self.start_y,
-                        pyxel.mouse_x,
-                        pyxel.mouse_y,
-                        self.current_color,
-                    )
-                elif self.current_tool == TOOL_RECT:
-                    x1, y1 = self.start_x, self.start_y
-                    x2, y2 = pyxel.mouse_x, pyxel.mouse_y
-
-                    # Make sure x1,y1 is top-left and x2,y2 is bottom-right
-                    if x1 > x2:
-                        x1, x2 = x2, x1
-                    if y1 > y2:
-                        y1, y2 = y2, y1
-
-                    pyxel.image(1).rect(
-                        x1, y1, x2 - x1 + 1, y2 - y1 + 1, self.current_color
-                    )
-                elif self.current_tool == TOOL_CIRCLE:
-                    x1, y1 = self.start_x, self.start_y
-                    x2, y2 = pyxel.mouse_x, pyxel.mouse_y
-                    radius = int(((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5)
-                    pyxel.image(1).circ(x1, y1, radius, self.current_color)
+        # End drawing, wherever the mouse is (a drag can end over the
+        # toolbar or outside the window)
+        if self.backend.btnr(pyxel.MOUSE_BUTTON_LEFT) and self.drawing:
+            self.drawing = False
+
+            # Line, rectangle and circle shapes finalize when mouse is released
+            if self.current_tool == TOOL_LINE:
+                self.canvas.line(
+                    self.start_x,
+                    self.start_y,
+                    self.mouse_x,
+                    self.mouse_y,
+                    self.current_color,
+                )
+            elif self.current_tool == TOOL_RECT:
+                x1, y1 = self.start_x, self.start_y
+                x2, y2 = self.mouse_x, self.mouse_y
+
+                # Make sure x1,y1 is top-left and x2,y2 is bottom-right
+                if x1 > x2:
+                    x1, x2 = x2, x1
+                if y1 > y2:
+                    y1, y2 = y2, y1
+
+                self.canvas.rect(
+                    x1, y1, x2 - x1 + 1, y2 - y1 + 1, self.current_color
+                )
+            elif self.current_tool == TOOL_CIRCLE:
+                x1, y1 = self.start_x, self.start_y
+                x2, y2 = self.mouse_x, self.mouse_y
+                radius = int(((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5)
+                self.canvas.circ(x1, y1, radius, self.current_color)
 
         # Update old position for next frame
-        self.old_x = pyxel.mouse_x
-        self.old_y = pyxel.mouse_y
+        self.old_x = self.mouse_x
+        self.old_y = self.mouse_y
+
+        # Work on filters and fills for a few milliseconds (the backend
+        # decides how much, so a replay can do the same work as the
+        # recording)
+        self.backend.run_jobs(self.jobs)
+
+        # Save finished changes as one undo step (a whole stroke at a time).
+        # Filters and fills save theirs as a job of their own.
+        if not self.drawing and not self.jobs.busy():
+            self.history.commit()
+
+        # Every couple of seconds, write the changed tiles to the journal
+        if self.autosave is not None:
+            self.autosave.update()
+
+    def select_layer(self, index):
+        # Draw on another layer from now on
+        self.current_layer = index
+        self.canvas = self.layers.buffers[index]
+
+    def save_canvas(self, filename=DRAWING_FILE):
+        # All the layers are saved, one under the other
+        save_drawing(filename, self.layers.read(), self.backend.colors())
+        self.backend.play(0, 4)  # Play sound 4 on channel 0
+
+    def load_canvas(self, filename=DRAWING_FILE):
+        # A missing or broken file leaves the canvas as it is
+        try:
+            pixels, colors = load_drawing(filename)
+        except (OSError, ValueError):
+            return False
+
+        # A drawing of another size goes in the top-left corner (so one
+        # saved without layers ends up on the first layer)
+        self.layers.write(pixels)
+        self.backend.set_colors(colors)
+        self.backend.play(0, 4)  # Play sound 4 on channel 0
+        return True
+
+    def export_canvas(self, filename=PNG_FILE):
+        # The picture as it is shown, with the visible layers put together
+        self.layers.flatten()
+        export_png(filename, self.layers.flat.read(), self.backend.colors())
+        self.backend.play(0, 4)  # Play sound 4 on channel 0
+
+    def update_viewport(self):
+        mouse_x = self.backend.mouse_x
+        mouse_y = self.backend.mouse_y
+
+        # The mouse wheel zooms in and out around the cursor
+        if self.backend.mouse_wheel != 0 and mouse_y < VIEW_HEIGHT:
+            self.viewport.step_zoom(mouse_x, mouse_y, self.backend.mouse_wheel)
+
+        # Dragging with the middle mouse button moves the canvas along
+        # with the mouse
+        if self.backend.btnp(pyxel.MOUSE_BUTTON_MIDDLE) and mouse_y < VIEW_HEIGHT:
+            self.pan_anchor = self.viewport.to_canvas(mouse_x, mouse_y)
+        elif not self.backend.btn(pyxel.MOUSE_BUTTON_MIDDLE):
+            self.pan_anchor = None
+        if self.pan_anchor is not None:
+            self.viewport.keep(*self.pan_anchor, mouse_x, mouse_y)
+
+        # Arrow keys scroll a quarter of the view at a time (not while
+        # typing, where they move the text cursor)
+        if not self.typing:
+            step_x = VIEW_WIDTH // 4 // self.viewport.zoom
+            step_y = VIEW_HEIGHT // 4 // self.viewport.zoom
+            for key, dx, dy in (
+                (pyxel.KEY_LEFT, -step_x, 0),
+                (pyxel.KEY_RIGHT, step_x, 0),
+                (pyxel.KEY_UP, 0, -step_y),
+                (pyxel.KEY_DOWN, 0, step_y),
+            ):
+                if self.backend.btnp(key, TEXT_KEY_HOLD, TEXT_KEY_REPEAT):
+                    self.viewport.pan(dx, dy)
 
     def draw_point(self, x, y):
         color = 0 if self.current_tool == TOOL_ERASER else self.current_color
@@ -448,12 +709,126 @@ class BunnyPyx:
 
         if self.current_tool == TOOL_BRUSH:
             # Use the brush size as the diameter (radius = size/2)
-            pyxel.image(1).circ(x, y, size // 2, color)
+            self.canvas.circ(x, y, size // 2, color)
         else:
             # For other tools like pencil, center the square properly
             # For even-numbered sizes, we need to offset by size/2
             offset = size // 2
-            pyxel.image(1).rect(x - offset, y - offset, size, size, color)
+            self.canvas.rect(x - offset, y - offset, size, size, color)
+
+    def apply_dabs(self, dabs, old_x, old_y):
+        # Use the current tool once at every dab of a stroke.
+        # The algorithmic brush also gets the previous dab, since some
+        # of its patterns connect the two.
+        for x, y in dabs:
+            if self.current_tool == TOOL_STAMP:
+                self.stamp_image(x, y)
+            elif self.current_tool == TOOL_ALGO_BRUSH:
+                self.apply_algo_brush(x, y, old_x, old_y)
+            elif self.current_tool == TOOL_TYPE:
+                self.place_char(x, y)
+            old_x = x
+            old_y = y
+
+    def start_fill(self, x, y):
+        # Fill a copy of the canvas as a job, and copy the filled area
+        # back in one go when it is done
+        color = self.current_color
+        connectivity = self.fill_connectivity
+        canvas = self.canvas  # The layer it started on
+
+        def start():
+            # Reading the layer is done a band at a time too
+            pixels = yield from scaled(canvas.read_steps(), 0, 0.1)
+            box = yield from scaled(
+                flood_fill_steps(pixels, x, y, color, connectivity), 0.1, 1
+            )
+            return pixels, box
+
+        def finish(result):
+            pixels, box = result
+            if box is not None:
+                bx, by, bw, bh = box
+                canvas.write(pixels[by:by + bh, bx:bx + bw], bx, by)
+
+        self.jobs.add("fill", start, finish)
+        self.add_history_job()
+
+    def add_history_job(self):
+        # Save what the job before changed as one undo step, a band of
+        # tiles at a time (a filter can change every tile of a layer)
+        self.jobs.add("history", self.history.commit_steps, lambda changed: None)
+
+    def start_text(self, x, y):
+        # Paint any text still being typed, then start new text with its
+        # top-left corner at x, y
+        self.commit_text()
+        self.typing = True
+        self.typed_text = ""
+        self.text_cursor = 0
+        self.text_x = x
+        self.text_y = y
+
+    def text_scale(self):
+        # Text grows with the brush size (the font is 4x6 pixels)
+        return max(1, self.current_size // 2)
+
+    def update_text(self):
+        # Enter paints the text onto the canvas
+        if self.backend.btnp(pyxel.KEY_RETURN):
+            self.commit_text()
+            return
+
+        def pressed(key):
+            return self.backend.btnp(key, TEXT_KEY_HOLD, TEXT_KEY_REPEAT)
+
+        text = self.typed_text
+        cursor = self.text_cursor
+
+        # Backspace on empty text stops typing without painting anything
+        if pressed(pyxel.KEY_BACKSPACE):
+            if not text:
+                self.typing = False
+                return
+            if cursor > 0:
+                text = text[:cursor - 1] + text[cursor:]
+                cursor -= 1
+        if pressed(pyxel.KEY_DELETE):
+            text = text[:cursor] + text[cursor + 1:]
+
+        # Moving the cursor
+        if pressed(pyxel.KEY_LEFT):
+            cursor = max(cursor - 1, 0)
+        if pressed(pyxel.KEY_RIGHT):
+            cursor = min(cursor + 1, len(text))
+        if self.backend.btnp(pyxel.KEY_HOME):
+            cursor = 0
+        if self.backend.btnp(pyxel.KEY_END):
+            cursor = len(text)
+
+        # Typed characters (not with Ctrl, which is for shortcuts), as
+        # long as the font has them
+        if not self.backend.btn(pyxel.KEY_CTRL):
+            shift = self.backend.btn(pyxel.KEY_SHIFT)
+            for key, char, shifted_char in TEXT_KEYS:
+                if pressed(key):
+                    char = shifted_char if shift else char
+                    if self.glyphs.has(char):
+                        text = text[:cursor] + char + text[cursor:]
+                        cursor += 1
+
+        self.typed_text = text
+        self.text_cursor = cursor
+
+    def commit_text(self):
+        # Paint the typed text onto the canvas in one go
+        if not self.typing:
+            return
+        self.typing = False
+        if self.typed_text:
+            sprite, _ = self.glyphs.layout(self.typed_text, self.text_scale())
+            self.canvas.paint_mask(self.text_x, self.text_y, sprite, self.current_color)
+            self.backend.play(0, 0)  # Play sound 0 on channel 0
 
     def stamp_image(self, x, y):
         # Get stamp coordinates
@@ -464,10 +839,10 @@ class BunnyPyx:
         dest_y = y - 8
 
         # Copy the stamp to the canvas with transparency (color 0)
-        pyxel.image(1).blt(dest_x, dest_y, 0, sx, sy, 16, 16, 0)
+        self.canvas.blt(dest_x, dest_y, self.backend.image(0), sx, sy, 16, 16, 0)
         
         # Play sound effect when stamping
-        pyxel.play(0, 0)  # Play sound 0 on channel 0
+        self.backend.play(0, 0)  # Play sound 0 on channel 0
     
     def place_char(self, x, y):
         # Get character coordinates
@@ -478,267 +853,353 @@ class BunnyPyx:
         dest_y = y - 8
 
         # Copy the character to the canvas with transparency (color 0)
-        pyxel.image(1).blt(dest_x, dest_y, 0, sx, sy, 16, 16, 0)
+        self.canvas.blt(dest_x, dest_y, self.backend.image(0), sx, sy, 16, 16, 0)
         
         # Play sound effect when placing a character
-        pyxel.play(0, 0)  # Play sound 0 on channel 0
+        self.backend.play(0, 0)  # Play sound 0 on channel 0
     
     def apply_filter(self, x, y):
-        # Apply the selected filter to the entire canvas
-        if self.current_filter == FILTER_INVERT:
-            self.filter_invert()
-        elif self.current_filter == FILTER_GRAYSCALE:
-            self.filter_grayscale()
-        elif self.current_filter == FILTER_FLIP_X:
-            self.filter_flip_x()
-        elif self.current_filter == FILTER_FLIP_Y:
-            self.filter_flip_y()
-        elif self.current_filter == FILTER_ROTATE_90:
-            self.filter_rotate_90()
-        elif self.current_filter == FILTER_WAVE:
-            self.filter_wave()
-        elif self.current_filter == FILTER_PIXELATE:
-            self.filter_pixelate()
-        elif self.current_filter == FILTER_BLUR:
-            self.filter_blur()
+        # Shift+click queues the selected filter for later
+        if self.backend.btn(pyxel.KEY_SHIFT):
+            self.queued_filters.append(self.current_filter)
+            self.backend.play(0, 4)  # Play sound 4 on channel 0
+            return
+
+        # Apply the queued filters and then the selected one to the whole
+        # current layer, a band of rows at a time over the next frames
+        filter_types = self.queued_filters + [self.current_filter]
+        self.queued_filters = []
+        canvas = self.canvas  # Even if another layer is picked meanwhile
+
+        def start():
+            # Reading the layer is done a band at a time too
+            pixels = yield from scaled(canvas.read_steps(), 0, 0.1)
+            return (yield from scaled(self.filter_steps(pixels, filter_types), 0.1, 1))
+
+        self.jobs.add("filter", start, canvas.write)
+        self.add_history_job()
             
         # Play sound when a filter is applied
-        pyxel.play(0, 2)  # Play sound 2 on channel 0
+        self.backend.play(0, 2)  # Play sound 2 on channel 0
+
+    def filter_stages(self, height, width, filter_types):
+        # Turn a chain of filters into stages of (band rows, bands), where
+        # bands(pixels, rows) yields the filtered pixels a band of rows at
+        # a time. Neighbouring remaps and pixel moves are fused into one
+        # stage. Cheap filters go through the canvas in bigger bands.
+        # This is a job too (see jobs.py), as gather maps that aren't kept
+        # yet are built a band of rows at a time; it returns the stages.
+        def band_rows(cost):
+            return max(1, int(FILTER_BAND_PIXELS / cost) // width)
+
+        def in_bands(function):
+            # Bands from a function that filters rows y1 to y2 on its own
+            def bands(pixels, rows):
+                for y1 in range(0, height, rows):
+                    yield function(pixels, y1, min(y1 + rows, height))
+            return bands
+
+        # The kernels are timed by the profiler as "filter" and their names
+        # (a fused stage under the names of all its filters)
+        timed = self.profiler.timed
+
+        def chain_stage(chain, names, cost):
+            name = "filter " + "+".join(names)
+            rows = lambda pixels, y1, y2: timed(name, chain.apply_rows, pixels, y1, y2)
+            return band_rows(cost), in_bands(rows)
+
+        stages = []
+        chain = FusedChain(height, width)
+        chain_names = []
+        chain_cost = 0
+        for filter_type in filter_types:
+            entry = self.filters[filter_type]
+            name = "filter " + entry.name
+            if entry.kind == "remap":
+                chain.add_remap(get_remap(entry.kernel))
+                chain_names.append(entry.name)
+                chain_cost += entry.cost
+            elif entry.kind == "map":
+                key = (entry.name, self.filter_settings(entry))
+                move = lambda pixels, y1, y2, entry=entry, name=name: timed(
+                    name, entry.kernel, self, pixels, y1, y2
+                )
+                rows = band_rows(entry.cost)
+                index = yield from self.gather_maps.get_steps(key, move, height, width, rows)
+                yield from chain.add_map_steps(index, rows)
+                chain_names.append(entry.name)
+                chain_cost += entry.cost
+            else:
+                if not chain.is_empty():
+                    stages.append(chain_stage(chain, chain_names, chain_cost))
+                    chain = FusedChain(height, width)
+                    chain_names = []
+                    chain_cost = 0
+                # Bands hold a whole number of align rows
+                align = entry.align(self) if entry.align is not None else 1
+                rows = max(1, band_rows(entry.cost) // align) * align
+                if entry.kind == "bands":
+                    bands = lambda pixels, rows, entry=entry, name=name: (
+                        self.profiler.timed_steps(name, entry.kernel(self, pixels, rows))
+                    )
+                else:
+                    kernel = lambda pixels, y1, y2, entry=entry, name=name: timed(
+                        name, entry.kernel, self, pixels, y1, y2
+                    )
+                    bands = in_bands(kernel)
+                stages.append((rows, bands))
+        if not chain.is_empty():
+            stages.append(chain_stage(chain, chain_names, chain_cost))
+        return stages
+
+    def filter_settings(self, entry):
+        # What a filter's result depends on besides the canvas
+        return entry.settings(self) if entry.settings is not None else None
+
+    def filter_steps(self, pixels, filter_types):
+        # Run a chain of filters on an array of colors as a job (see jobs.py):
+        # yields how far along it is after every band of rows and returns
+        # the filtered array. Building gather maps first doesn't count
+        # towards how far along it is.
+        height, width = pixels.shape
+        stages = yield from scaled(self.filter_stages(height, width, filter_types), 0, 0)
+        for number, (rows, bands) in enumerate(stages):
+            result = np.empty_like(pixels)
+            y = 0
+            for band in bands(pixels, rows):
+                result[y:y + len(band)] = band
+                y += len(band)
+                yield (number + y / height) / len(stages)
+            pixels = result
+        return pixels
+
+    def filtered(self, pixels, filter_types):
+        # Run a chain of filters on an array of colors right away
+        return run_to_end(self.filter_steps(pixels, filter_types))
+
+    def run_filters(self, filter_types):
+        self.canvas.write(self.filtered(self.canvas.read(), filter_types))
     
+    def toggle_fill_connectivity(self):
+        self.fill_connectivity = 8 if self.fill_connectivity == 4 else 4
+
+    def change_filter_setting(self, step):
+        adjust = self.filters[self.current_filter].adjust
+        if adjust is not None:
+            adjust(self, step)
+
+    def change_blur_radius(self, step):
+        self.blur_radius = min(
+            max(self.blur_radius + step, MIN_BLUR_RADIUS), MAX_BLUR_RADIUS
+        )
+
+    def change_pixelate_block(self, step):
+        width, height = self.pixelate_block
+        width = self.next_pixelate_size(width, step)
+        if not self.backend.btn(pyxel.KEY_SHIFT):
+            height = self.next_pixelate_size(height, step)
+        self.pixelate_block = (width, height)
+
+    def pixelate_label(self):
+        block_w, block_h = self.pixelate_block
+        if block_w == block_h:
+            return str(block_w)
+        return "%dx%d" % (block_w, block_h)
+
+    def next_pixelate_size(self, size, step):
+        # The next bigger or smaller size in PIXELATE_SIZES
+        if step > 0:
+            bigger = [s for s in PIXELATE_SIZES if s > size]
+            return bigger[0] if bigger else size
+        smaller = [s for s in PIXELATE_SIZES if s < size]
+        return smaller[-1] if smaller else size
+
     def filter_invert(self):
-        # Create a temporary image to store the inverted result
-        temp_img = pyxel.Image(CANVAS_WIDTH, CANVAS_HEIGHT)
-        
-        # Invert each pixel color
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                col = pyxel.image(1).pget(x, y)
-                if col != 0:  # Don't invert transparent pixels
-                    # Simple inversion - this could be improved with a proper color map
-                    temp_img.pset(x, y, 15 - col)
-                else:
-                    temp_img.pset(x, y, 0)
-        
-        # Copy the result back to the canvas
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                pyxel.image(1).pset(x, y, temp_img.pget(x, y))
+        self.run_filters([FILTER_INVERT])
     
     def filter_grayscale(self):
-        # Create a grayscale mapping for the Pyxel color palette
-        # This is a simplified mapping - could be improved with actual luminance values
-        gray_map = [0, 5, 5, 6, 5, 5, 6, 7, 5, 6, 5, 6, 6, 7, 13, 7]
-        
-        # Apply grayscale to each pixel
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                col = pyxel.image(1).pget(x, y)
-                if col != 0:  # Don't convert transparent pixels
-                    pyxel.image(1).pset(x, y, gray_map[col])
+        self.run_filters([FILTER_GRAYSCALE])
     
     def filter_flip_x(self):
-        # Create a temporary image to store the flipped result
-        temp_img = pyxel.Image(CANVAS_WIDTH, CANVAS_HEIGHT)
-        
-        # Copy pixels in horizontally flipped order
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                temp_img.pset(CANVAS_WIDTH - 1 - x, y, pyxel.image(1).pget(x, y))
-        
-        # Copy the result back to the canvas
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                pyxel.image(1).pset(x, y, temp_img.pget(x, y))
+        self.run_filters([FILTER_FLIP_X])
     
     def filter_flip_y(self):
-        # Create a temporary image to store the flipped result
-        temp_img = pyxel.Image(CANVAS_WIDTH, CANVAS_HEIGHT)
-        
-        # Copy pixels in vertically flipped order
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                temp_img.pset(x, CANVAS_HEIGHT - 1 - y, pyxel.image(1).pget(x, y))
-        
-        # Copy the result back to the canvas
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                pyxel.image(1).pset(x, y, temp_img.pget(x, y))
+        self.run_filters([FILTER_FLIP_Y])
     
     def filter_rotate_90(self):
-        # Create a temporary image to store the rotated result
-        temp_img = pyxel.Image(CANVAS_HEIGHT, CANVAS_WIDTH)  # Note the swapped dimensions
-        
-        # Copy pixels in rotated order (90 degrees clockwise)
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                temp_img.pset(CANVAS_HEIGHT - 1 - y, x, pyxel.image(1).pget(x, y))
+        self.run_filters([FILTER_ROTATE_90])
+    
+    def filter_wave(self):
+        self.run_filters([FILTER_WAVE])
+    
+    def filter_pixelate(self):
+        self.run_filters([FILTER_PIXELATE])
+    
+    def filter_blur(self):
+        self.run_filters([FILTER_BLUR])
+
+    # The filters themselves. Each one takes an array of colors and rows
+    # y1 to y2 (not included) and returns those rows of the filtered
+    # array, so a big canvas can be done a band at a time. The ones that
+    # only move pixels also work on the pixel numbers used to build
+    # gather maps.
+
+    def flip_x(self, pixels, y1, y2):
+        # Reverse the order of the columns
+        return pixels[y1:y2, ::-1]
+    
+    def flip_y(self, pixels, y1, y2):
+        # Reverse the order of the rows
+        height = pixels.shape[0]
+        return pixels[height - y2:height - y1][::-1]
+    
+    def rotate_90(self, pixels, y1, y2):
+        height, width = pixels.shape
+
+        # Rotate the whole canvas 90 degrees clockwise
+        # Note the rotated image has swapped dimensions
+        rotated = np.rot90(pixels, k=-1)
         
         # The rotated image might be larger than our canvas due to aspect ratio
         # We'll center it and crop to fit
-        offset_x = (CANVAS_WIDTH - CANVAS_HEIGHT) // 2
-        offset_y = (CANVAS_HEIGHT - CANVAS_WIDTH) // 2
+        offset_x = (width - height) // 2
+        offset_y = (height - width) // 2
+        size = min(width, height)
         
-        # Clear the original image
-        pyxel.image(1).cls(0)
+        # Only the part of the size x size corner of the rotated image
+        # that lands inside the canvas (and in rows y1 to y2) is copied
+        left = max(0, -offset_x)
+        right = min(size, width - offset_x)
+        top = max(0, -offset_y, y1 - offset_y)
+        bottom = min(size, height - offset_y, y2 - offset_y)
         
-        # Copy the rotated content back, centered
-        for y in range(min(CANVAS_WIDTH, CANVAS_HEIGHT)):
-            for x in range(min(CANVAS_WIDTH, CANVAS_HEIGHT)):
-                if 0 <= x + offset_x < CANVAS_WIDTH and 0 <= y + offset_y < CANVAS_HEIGHT:
-                    pyxel.image(1).pset(x + offset_x, y + offset_y, temp_img.pget(x, y))
+        result = np.zeros((y2 - y1, width), dtype=pixels.dtype)
+        if left < right and top < bottom:
+            result[
+                top + offset_y - y1:bottom + offset_y - y1,
+                left + offset_x:right + offset_x,
+            ] = rotated[top:bottom, left:right]
+        return result
     
-    def filter_wave(self):
-        # Create a temporary image to store the wave result
-        temp_img = pyxel.Image(CANVAS_WIDTH, CANVAS_HEIGHT)
-        
-        # Copy the original image to the temporary image
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                temp_img.pset(x, y, pyxel.image(1).pget(x, y))
-        
+    def wave(self, pixels, y1, y2):
+        height, width = pixels.shape
+
         # Apply a sine wave distortion to the vertical position
-        amplitude = 4  # Wave amplitude
-        frequency = 0.05  # Wave frequency
+        # Calculate the wave offset for each column (once per width)
+        offsets = self.wave_offsets.get(width)
+        if offsets is None:
+            offsets = np.array(
+                [
+                    int(WAVE_AMPLITUDE * self.backend.sin(x * WAVE_FREQUENCY * 360))
+                    for x in range(width)
+                ]
+            )
+            self.wave_offsets[width] = offsets
         
-        # Clear the original image
-        pyxel.image(1).cls(0)
+        # Get the source row for every pixel with the wave effect (and wrap around)
+        rows = (np.arange(y1, y2)[:, None] + offsets[None, :]) % height
         
-        # Apply the wave effect
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                # Calculate the wave offset for this column
-                offset = int(amplitude * pyxel.sin(x * frequency * 360))
-                
-                # Get y position with wave effect (and wrap around)
-                wave_y = (y + offset) % CANVAS_HEIGHT
-                
-                # Copy the pixel with the wave effect applied
-                pyxel.image(1).pset(x, y, temp_img.pget(x, wave_y))
+        # Copy every pixel with the wave effect applied
+        return np.take_along_axis(pixels, rows, axis=0)
     
-    def filter_pixelate(self):
-        # Create a temporary image to store the original
-        temp_img = pyxel.Image(CANVAS_WIDTH, CANVAS_HEIGHT)
-        
-        # Copy the original image to the temporary image
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                temp_img.pset(x, y, pyxel.image(1).pget(x, y))
+    def pixelate_rows(self, pixels, y1, y2):
+        # Bands always start at the top of a row of blocks
+        pixels = pixels[y1:y2]
+        height, width = pixels.shape
+
+        # Pixelation block size (blocks don't have to be square)
+        block_w, block_h = self.pixelate_block
         
-        # Pixelation block size
-        block_size = 4
+        # Pad the canvas with transparent pixels up to a whole number of blocks
+        pad_y = -height % block_h
+        pad_x = -width % block_w
+        padded = np.pad(pixels, ((0, pad_y), (0, pad_x)))
+        blocks_y = padded.shape[0] // block_h
+        blocks_x = padded.shape[1] // block_w
         
-        # Apply pixelation effect
-        for block_y in range(0, CANVAS_HEIGHT, block_size):
-            for block_x in range(0, CANVAS_WIDTH, block_size):
-                # Determine the dominant color in this block
-                colors = {}
-                for y in range(block_size):
-                    for x in range(block_size):
-                        px = block_x + x
-                        py = block_y + y
-                        if px < CANVAS_WIDTH and py < CANVAS_HEIGHT:
-                            color = temp_img.pget(px, py)
-                            if color != 0:  # Ignore transparent pixels
-                                colors[color] = colors.get(color, 0) + 1
-                
-                # Find the most common color
-                dominant_color = 0
-                if colors:
-                    dominant_color = max(colors, key=colors.get)
-                
-                # Set the entire block to the dominant color
-                for y in range(block_size):
-                    for x in range(block_size):
-                        px = block_x + x
-                        py = block_y + y
-                        if px < CANVAS_WIDTH and py < CANVAS_HEIGHT:
-                            if temp_img.pget(px, py) != 0:  # Only change non-transparent pixels
-                                pyxel.image(1).pset(px, py, dominant_color)
-    
-    def filter_blur(self):
-        # Create a temporary image to store the original
-        temp_img = pyxel.Image(CANVAS_WIDTH, CANVAS_HEIGHT)
+        # Gather the pixels of each block, in reading order, into one row
+        blocks = (
+            padded.reshape(blocks_y, block_h, blocks_x, block_w)
+            .transpose(0, 2, 1, 3)
+            .reshape(blocks_y, blocks_x, block_w * block_h)
+        )
         
-        # Copy the original image to the temporary image
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                temp_img.pset(x, y, pyxel.image(1).pget(x, y))
+        # Determine the dominant color in every block (ignoring transparent pixels)
+        dominant = dominant_colors(blocks)
         
-        # Apply a simple box blur
-        kernel_size = 3
-        half_kernel = kernel_size // 2
+        # Spread each block's color back over the block
+        dominant = np.repeat(np.repeat(dominant, block_h, axis=0), block_w, axis=1)
+        dominant = dominant[:height, :width]
         
-        for y in range(CANVAS_HEIGHT):
-            for x in range(CANVAS_WIDTH):
-                # Skip transparent pixels
-                if temp_img.pget(x, y) == 0:
-                    continue
-                
-                # Count colors in the kernel
-                colors = {}
-                for ky in range(-half_kernel, half_kernel + 1):
-                    for kx in range(-half_kernel, half_kernel + 1):
-                        nx, ny = x + kx, y + ky
-                        if 0 <= nx < CANVAS_WIDTH and 0 <= ny < CANVAS_HEIGHT:
-                            col = temp_img.pget(nx, ny)
-                            if col != 0:  # Ignore transparent pixels
-                                colors[col] = colors.get(col, 0) + 1
-                
-                # Find the average color (or most common)
-                if colors:
-                    avg_color = max(colors, key=colors.get)
-                    pyxel.image(1).pset(x, y, avg_color)
-
-    def apply_algo_brush(self, x, y):
+        # Only change non-transparent pixels
+        return np.where(pixels != 0, dominant, 0).astype(np.uint8)
+    
+    def blur_bands(self, pixels, rows):
+        # Find the most common color around every pixel, ignoring
+        # transparent pixels (a bigger radius looks further out). The
+        # counts are carried from band to band, so the rows around each
+        # band are not counted again.
+        y = 0
+        for common in mode_filter_bands(pixels, self.blur_radius, rows):
+            # Skip transparent pixels
+            band = pixels[y:y + len(common)]
+            y += len(common)
+            yield np.where(band != 0, common, 0).astype(np.uint8)
+
+    def apply_algo_brush(self, x, y, old_x=None, old_y=None):
         # Apply the selected algorithmic brush pattern
-        if self.current_algo_brush == ALGO_RANDOM_CIRCLES:
-            self.draw_random_circles(x, y)
-        elif self.current_algo_brush == ALGO_ROTATING_LINES:
-            self.draw_rotating_lines(x, y)
-        elif self.current_algo_brush == ALGO_LOOPS:
-            self.draw_loops(x, y, self.old_x, self.old_y)
-        elif self.current_algo_brush == ALGO_SPIRALS:
-            self.draw_spirals(x, y)
-        elif self.current_algo_brush == ALGO_SQUARES:
-            self.draw_squares(x, y)
-        elif self.current_algo_brush == ALGO_STARS:
-            self.draw_stars(x, y)
-        elif self.current_algo_brush == ALGO_CONFETTI:
-            self.draw_confetti(x, y)
-        elif self.current_algo_brush == ALGO_WAVES:
-            self.draw_waves(x, y, self.old_x, self.old_y)
-        
+        # Patterns that follow the path start from the last mouse position
+        # unless another starting point is given
+        if old_x is None:
+            old_x = self.old_x
+            old_y = self.old_y
+
+        # The brush's own functions are timed by the profiler as "brush"
+        # and its name
+        brush = self.brushes[self.current_algo_brush]
+        name = "brush " + brush.name
+        if brush.kind == "sprite":
+            key, colors = self.profiler.timed(name, brush.state, self)
+            self.stamp_algo_sprite(brush, key, colors, x, y)
+        else:
+            self.profiler.timed(name, brush.draw, self, x, y, old_x, old_y)
+
         # Update the brush state
         self.algo_brush_angle = (self.algo_brush_angle + 10) % 360
         self.algo_brush_step += 1
     
-    def draw_random_circles(self, x, y):
+    def draw_random_circles(self, x, y, old_x, old_y):
         # Draw 3-5 circles of random sizes and colors
-        for _ in range(pyxel.rndi(3, 5)):
+        for _ in range(self.backend.rndi(3, 5)):
             # Random position near the cursor
-            cx = x + pyxel.rndi(-10, 10)
-            cy = y + pyxel.rndi(-10, 10)
+            cx = x + self.backend.rndi(-10, 10)
+            cy = y + self.backend.rndi(-10, 10)
             # Random radius
-            radius = pyxel.rndi(1, 8)
+            radius = self.backend.rndi(1, 8)
             # Random color from the current palette
-            color = COLOR_PALETTES[self.current_palette][pyxel.rndi(0, 13)]
+            color = COLOR_PALETTES[self.current_palette][self.backend.rndi(0, 13)]
             # Random filled or outlined
-            if pyxel.rndi(0, 1) == 0:
-                pyxel.image(1).circ(cx, cy, radius, color)
+            if self.backend.rndi(0, 1) == 0:
+                self.canvas.circ(cx, cy, radius, color)
             else:
-                pyxel.image(1).circb(cx, cy, radius, color)
+                self.canvas.circb(cx, cy, radius, color)
     
-    def draw_rotating_lines(self, x, y):
+    def rotating_lines_state(self):
+        # Lines radiating from the center, drawn once per angle and step
+        palette = COLOR_PALETTES[self.current_palette]
+        colors = [palette[(i + self.algo_brush_step) % 14] for i in range(8)]
+        return (self.algo_brush_angle, self.algo_brush_step % 14), colors
+
+    def render_rotating_lines(self, target, x, y):
         # Draw lines radiating from the center with rotation
         num_lines = 8
         length = 12
         for i in range(num_lines):
             angle = self.algo_brush_angle + (i * 360 / num_lines)
-            angle_rad = angle * 3.14159 / 180
-            ex = x + length * pyxel.cos(angle_rad)
-            ey = y + length * pyxel.sin(angle_rad)
+            ex = x + length * self.backend.cos(angle)
+            ey = y + length * self.backend.sin(angle)
             color = COLOR_PALETTES[self.current_palette][(i + self.algo_brush_step) % 14]
-            pyxel.image(1).line(x, y, ex, ey, color)
+            target.line(x, y, ex, ey, color)
     
     def draw_loops(self, x, y, old_x, old_y):
         # Draw loopy patterns following the mouse path
@@ -750,15 +1211,20 @@ class BunnyPyx:
         mid_y = (y + old_y) // 2
         
         # Add some controlled randomness
-        offset_x = pyxel.rndi(-5, 5)
-        offset_y = pyxel.rndi(-5, 5)
+        offset_x = self.backend.rndi(-5, 5)
+        offset_y = self.backend.rndi(-5, 5)
         
         # Draw a bezier-like curve
         color = COLOR_PALETTES[self.current_palette][self.algo_brush_step % 14]
-        pyxel.image(1).line(old_x, old_y, mid_x + offset_x, mid_y + offset_y, color)
-        pyxel.image(1).line(mid_x + offset_x, mid_y + offset_y, x, y, color)
+        self.canvas.line(old_x, old_y, mid_x + offset_x, mid_y + offset_y, color)
+        self.canvas.line(mid_x + offset_x, mid_y + offset_y, x, y, color)
     
-    def draw_spirals(self, x, y):
+    def spiral_state(self):
+        # A spiral, drawn once per angle and step
+        color = COLOR_PALETTES[self.current_palette][self.algo_brush_step % 14]
+        return (self.algo_brush_angle, self.algo_brush_step % 14), [color]
+
+    def render_spiral(self, target, x, y):
         # Draw spiral shapes
         turns = 3
         points = 20
@@ -769,17 +1235,22 @@ class BunnyPyx:
         
         for i in range(points):
             angle = start_angle + (i * turns * 360 / points)
-            angle_rad = angle * 3.14159 / 180
             radius = i * radius_step
-            px = x + radius * pyxel.cos(angle_rad)
-            py = y + radius * pyxel.sin(angle_rad)
+            px = x + radius * self.backend.cos(angle)
+            py = y + radius * self.backend.sin(angle)
             
             if i > 0:
-                pyxel.image(1).line(prev_x, prev_y, px, py, color)
+                target.line(prev_x, prev_y, px, py, color)
                 
             prev_x, prev_y = px, py
     
-    def draw_squares(self, x, y):
+    def squares_state(self):
+        # Nested squares, drawn once per step (they don't rotate)
+        palette = COLOR_PALETTES[self.current_palette]
+        colors = [palette[(i + self.algo_brush_step) % 14] for i in range(0, 16, 2)]
+        return (self.algo_brush_step % 14,), colors
+
+    def render_squares(self, target, x, y):
         # Draw nested squares
         max_size = 16
         min_size = 2
@@ -792,7 +1263,7 @@ class BunnyPyx:
                 
             color = COLOR_PALETTES[self.current_palette][(i + self.algo_brush_step) % 14]
             half_size = size // 2
-            pyxel.image(1).rectb(
+            target.rectb(
                 x - half_size, 
                 y - half_size, 
                 size, 
@@ -800,7 +1271,12 @@ class BunnyPyx:
                 color
             )
     
-    def draw_stars(self, x, y):
+    def star_state(self):
+        # A star, drawn once per angle and step
+        color = COLOR_PALETTES[self.current_palette][self.algo_brush_step % 14]
+        return (self.algo_brush_angle, self.algo_brush_step % 14), [color]
+
+    def render_star(self, target, x, y):
         # Draw a star shape
         num_points = 5
         inner_radius = 3
@@ -811,29 +1287,42 @@ class BunnyPyx:
         points = []
         for i in range(num_points * 2):
             angle = self.algo_brush_angle + (i * 360 / (num_points * 2))
-            angle_rad = angle * 3.14159 / 180
             radius = outer_radius if i % 2 == 0 else inner_radius
-            px = x + radius * pyxel.cos(angle_rad)
-            py = y + radius * pyxel.sin(angle_rad)
+            px = x + radius * self.backend.cos(angle)
+            py = y + radius * self.backend.sin(angle)
             points.append((px, py))
         
         # Connect the points
         for i in range(len(points)):
             j = (i + 1) % len(points)
-            pyxel.image(1).line(points[i][0], points[i][1], points[j][0], points[j][1], color)
+            target.line(points[i][0], points[i][1], points[j][0], points[j][1], color)
+
+    def stamp_algo_sprite(self, brush, key, colors, x, y):
+        # Copy the brush picture for this state onto the canvas, drawing
+        # it into the brush's page of the sprite cache the first time.
+        # Switching to another palette drops the pictures drawn with the
+        # old one.
+        self.algo_sprites.set_palette(self.current_palette)
+        render = lambda target, x, y: self.profiler.timed(
+            "brush " + brush.name, brush.render, self, target, x, y
+        )
+        image, u, v, colkey = self.algo_sprites.get(brush.name, key, colors, render)
+        half = SPRITE_SIZE // 2
+        self.canvas.blt(x - half, y - half, image, u, v,
+                        SPRITE_SIZE, SPRITE_SIZE, colkey)
     
-    def draw_confetti(self, x, y):
+    def draw_confetti(self, x, y, old_x, old_y):
         # Draw tiny colored squares like confetti
         for _ in range(20):
             # Random position near the cursor
-            cx = x + pyxel.rndi(-15, 15)
-            cy = y + pyxel.rndi(-15, 15)
+            cx = x + self.backend.rndi(-15, 15)
+            cy = y + self.backend.rndi(-15, 15)
             # Random size
-            size = pyxel.rndi(1, 3)
+            size = self.backend.rndi(1, 3)
             # Random color
-            color = COLOR_PALETTES[self.current_palette][pyxel.rndi(0, 13)]
+            color = COLOR_PALETTES[self.current_palette][self.backend.rndi(0, 13)]
             # Draw the confetti piece
-            pyxel.image(1).rect(cx, cy, size, size, color)
+            self.canvas.rect(cx, cy, size, size, color)
     
     def draw_waves(self, x, y, old_x, old_y):
         # Draw wavy patterns
@@ -859,15 +1348,15 @@ class BunnyPyx:
         # Draw the wave pattern
         num_segments = 10
         segment_length = dist / num_segments
-        amplitude = 5 * pyxel.sin(self.algo_brush_step * 0.1)
+        amplitude = 5 * self.backend.sin(self.algo_brush_step * 0.1)
         
         for i in range(num_segments):
             t1 = i / num_segments
             t2 = (i + 1) / num_segments
             
             # Wave amplitude oscillates along the path
-            wave_factor1 = amplitude * pyxel.sin(t1 * 3.14159 * 2 + self.algo_brush_step * 0.2)
-            wave_factor2 = amplitude * pyxel.sin(t2 * 3.14159 * 2 + self.algo_brush_step * 0.2)
+            wave_factor1 = amplitude * self.backend.sin(t1 * 3.14159 * 2 + self.algo_brush_step * 0.2)
+            wave_factor2 = amplitude * self.backend.sin(t2 * 3.14159 * 2 + self.algo_brush_step * 0.2)
             
             # Start and end points with wave offset
             x1 = old_x + dx * (dist * t1) + perp_x * wave_factor1
@@ -877,134 +1366,206 @@ class BunnyPyx:
             
             # Draw the segment
             color = COLOR_PALETTES[self.current_palette][(i + self.algo_brush_step) % 14]
-            pyxel.image(1).line(x1, y1, x2, y2, color)
+            self.canvas.line(x1, y1, x2, y2, color)
 
     def draw(self):
-        pyxel.cls(5)  # Background color
+        # The screen keeps last frame's picture, so only the parts of the
+        # canvas that changed, or that last frame's previews and cursor
+        # were drawn over, need to be copied to it again
+        # (overlay_rects are boxes on the screen)
+        if self.viewport.key() != self.view_key:
+            # The view moved or zoomed, so all of it is drawn again, on a
+            # background for the part past the canvas edge
+            self.view_key = self.viewport.key()
+            self.dirty.mark_all(only="screen")
+            self.backend.rect(0, 0, VIEW_WIDTH, VIEW_HEIGHT, 0)
+        for rect in self.overlay_rects:
+            self.dirty.mark(*self.viewport.canvas_rect(*rect), only="screen")
+        self.overlay_rects = [
+            (self.backend.mouse_x - 16, self.backend.mouse_y - 16, 32, 32)
+        ]
+
+        # Put the layers together where they changed, then draw the
+        # canvas, looking only at tiles that are on screen
+        self.layers.flatten()
+        tiles = self.dirty.take("screen")
+        for x, y, w, h in self.dirty.rects(tiles, self.viewport.visible()):
+            self.draw_canvas_rect(x, y, w, h)
+
+        # Draw the toolbar
+        toolbar_y = 160 - TOOLBAR_HEIGHT  # Position at bottom of window
+        self.update_toolbar()
+        self.backend.blt(0, toolbar_y, self.toolbar, 0, 0, VIEW_WIDTH, TOOLBAR_HEIGHT)
+
+        # Progress of a filter or fill that is still working
+        # (Backspace cancels it)
+        if self.jobs.busy():
+            self.backend.rect(0, toolbar_y, VIEW_WIDTH, 3, 1)
+            self.backend.rect(
+                0, toolbar_y, int(VIEW_WIDTH * self.jobs.progress()), 3, 11
+            )
 
-        # Draw the canvas
-        pyxel.blt(0, 0, 1, 0, 0, CANVAS_WIDTH, CANVAS_HEIGHT)
+        # Preview for shape tools, drawn on the screen, so the shape's
+        # corners are turned into screen positions first
+        if self.drawing and self.backend.mouse_y < VIEW_HEIGHT:
+            zoom = self.viewport.zoom
+            half = zoom // 2
+            if self.current_tool in (TOOL_LINE, TOOL_RECT):
+                x1, y1 = self.viewport.to_screen(
+                    min(self.start_x, self.mouse_x), min(self.start_y, self.mouse_y)
+                )
+                w = (abs(self.mouse_x - self.start_x) + 1) * zoom
+                h = (abs(self.mouse_y - self.start_y) + 1) * zoom
+                self.overlay_rects.append((x1, y1, w, h))
 
-        # Draw toolbar background
-        toolbar_y = 160 - TOOLBAR_HEIGHT  # Position at bottom of window
-        pyxel.rect(0, toolbar_y, CANVAS_WIDTH, TOOLBAR_HEIGHT, 13)
+            if self.current_tool == TOOL_LINE:
+                x1, y1 = self.viewport.to_screen(self.start_x, self.start_y)
+                x2, y2 = self.viewport.to_screen(self.mouse_x, self.mouse_y)
+                self.backend.line(
+                    x1 + half,
+                    y1 + half,
+                    x2 + half,
+                    y2 + half,
+                    self.current_color,
+                )
+            elif self.current_tool == TOOL_RECT:
+                # x1, y1, w, h are the top-left corner and size from above
+                self.backend.rectb(x1, y1, w, h, self.current_color)
+            elif self.current_tool == TOOL_CIRCLE:
+                x1, y1 = self.start_x, self.start_y
+                x2, y2 = self.mouse_x, self.mouse_y
+                radius = int(((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5) * zoom
+                cx, cy = self.viewport.to_screen(x1, y1)
+                self.backend.circb(cx + half, cy + half, radius, self.current_color)
+                self.overlay_rects.append(
+                    (cx + half - radius, cy + half - radius, radius * 2 + 1, radius * 2 + 1)
+                )
+            elif self.current_tool == TOOL_STAMP:
+                # Show stamp preview at cursor position
+                sx, sy = STAMPS[self.current_stamp]
+                self.backend.blt(self.backend.mouse_x - 8, self.backend.mouse_y - 8, 0, sx, sy, 16, 16, 0)
+            elif self.current_tool == TOOL_ALGO_BRUSH:
+                # Show a preview of the algorithmic brush effect
+                self.draw_algo_brush_preview(self.backend.mouse_x, self.backend.mouse_y)
+            elif self.current_tool == TOOL_TYPE:
+                # Show a preview of the selected character
+                self.draw_char_preview(self.backend.mouse_x, self.backend.mouse_y)
+
+        # Text being typed, with a blinking cursor
+        if self.typing:
+            self.draw_text_preview()
+
+        # Show what the selected filter would do, before clicking
+        if self.current_tool == TOOL_FILTER and self.backend.mouse_y < VIEW_HEIGHT:
+            self.draw_filter_preview(self.backend.mouse_x, self.backend.mouse_y)
+
+        self.draw_layer_boxes()
+
+        # Draw custom mouse cursor based on current tool
+        self.draw_custom_cursor(self.backend.mouse_x, self.backend.mouse_y)
+
+    def draw_canvas_rect(self, x, y, w, h):
+        # Copy a box of the canvas to its place on the screen, with every
+        # canvas pixel blown up to zoom x zoom screen pixels
+        sx, sy = self.viewport.to_screen(x, y)
+        zoom = self.viewport.zoom
+        pixels = self.layers.flat.read((x, y, w, h))
+        if zoom > 1:
+            pixels = pixels.repeat(zoom, axis=0).repeat(zoom, axis=1)
+        self.view.pixels[sy:sy + h * zoom, sx:sx + w * zoom] = pixels
+        self.backend.blt(sx, sy, self.view.image, sx, sy, w * zoom, h * zoom)
+
+    def update_toolbar(self):
+        # Draw the toolbar image again if anything on it changed
+        self.update_brush_icons()
+        key = (
+            self.current_tool,
+            self.current_size,
+            self.current_color,
+            self.current_palette,
+            self.current_stamp,
+            self.current_algo_brush,
+            self.current_char,
+            self.current_filter,
+            self.fill_connectivity,
+            self.blur_radius,
+            self.pixelate_block,
+            len(self.queued_filters),
+        )
+        if key == self.toolbar_key:
+            return
+        self.toolbar_key = key
+
+        # Toolbar background
+        self.toolbar.cls(13)
 
         # Draw tool icons (16x16 each)
         for i in range(NUM_TOOLS):
             x = i * 16
-            y = toolbar_y
 
             # Highlight selected tool with yellow background
             if i == self.current_tool:
-                pyxel.rect(x, y, 16, 16, 10)  # Yellow background
+                self.toolbar.rect(x, 0, 16, 16, 10)  # Yellow background
 
             # Draw the icon from sprite sheet (image 0)
-            pyxel.blt(x, y, 0, i * 16, 0, 16, 16, 0)
+            self.toolbar.blt(x, 0, self.icons, i * 16, 0, 16, 16, 0)
+
+        # The fill bucket's mode (4 or 8 neighbours) on its icon
+        self.toolbar.text(TOOL_FILL * 16 + 12, 10, str(self.fill_connectivity), 7)
 
         # Draw brush size selectors
         for i, size in enumerate(SIZES):
-            # Calculate the base position for this brush size selector (top-left corner)
+            # Calculate the position for this brush size selector (top-left corner)
             x = 256 - (len(SIZES) - i) * 16
-            y = toolbar_y
-
-            # Calculate the center of the 16x16 area
-            center_x = x + 8
-            center_y = y + 8
 
             # Highlight selected size with yellow background
             if size == self.current_size:
-                pyxel.rect(x, y, 16, 16, 10)  # Yellow background
+                self.toolbar.rect(x, 0, 16, 16, 10)  # Yellow background
 
-            # Get the brush size icon based on index
-            sx, sy = BRUSH_SIZE_ICONS[i]
-            
-            # Draw the brush size icon with color replacement
-            # This replaces color 2 (purple) with the current color
-            # The last parameter is the color key for transparency (0)
-            # Color 2 is explicitly not included in the color key to allow it to be replaced
-            colkey = 0  # Only color 0 is transparent
-            
-            # First draw the icon without the purple parts
-            for dy in range(16):
-                for dx in range(16):
-                    pixel_color = pyxel.image(0).pget(sx + dx, sy + dy)
-                    if pixel_color != 0 and pixel_color != 2:  # Not transparent or purple
-                        pyxel.pset(x + dx, y + dy, pixel_color)
-            
-            # Then draw the purple parts with the current color
-            for dy in range(16):
-                for dx in range(16):
-                    pixel_color = pyxel.image(0).pget(sx + dx, sy + dy)
-                    if pixel_color == 2:  # Purple parts
-                        pyxel.pset(x + dx, y + dy, self.current_color)
+            # Draw the brush size icon, already tinted with the current color
+            self.toolbar.blt(
+                x, 0, self.brush_icons, i * 16, 0, 16, 16, self.brush_icon_colkey
+            )
 
         # Draw appropriate palette based on current tool
-        if self.current_tool == TOOL_STAMP:
-            self.draw_stamp_palette(toolbar_y + 16)
-        elif self.current_tool == TOOL_ALGO_BRUSH:
-            self.draw_algo_brush_palette(toolbar_y + 16)
-        elif self.current_tool == TOOL_TYPE:
-            self.draw_type_palette(toolbar_y + 16)
-        elif self.current_tool == TOOL_FILTER:
-            self.draw_filter_palette(toolbar_y + 16)
+        row = self.palette_rows.get(self.current_tool)
+        if row is None:
+            self.draw_color_palette(16)
         else:
-            self.draw_color_palette(toolbar_y + 16)
+            name, icons, extra = row
+            self.draw_icon_palette(16, icons, getattr(self, name))
+            if extra is not None:
+                extra(16)
 
-        # Preview for shape tools
-        if self.drawing and pyxel.mouse_y < CANVAS_HEIGHT:
-            if self.current_tool == TOOL_LINE:
-                pyxel.line(
-                    self.start_x,
-                    self.start_y,
-                    pyxel.mouse_x,
-                    pyxel.mouse_y,
-                    self.current_color,
-                )
-            elif self.current_tool == TOOL_RECT:
-                x1, y1 = self.start_x, self.start_y
-                x2, y2 = pyxel.mouse_x, pyxel.mouse_y
-
-                # Make sure x1,y1 is top-left and x2,y2 is bottom-right
-                if x1 > x2:
-                    x1, x2 = x2, x1
-                if y1 > y2:
-                    y1, y2 = y2, y1
+    def update_brush_icons(self):
+        if self.brush_icon_color == self.current_color:
+            return
+        self.brush_icon_color = self.current_color
 
-                pyxel.rectb(x1, y1, x2 - x1 + 1, y2 - y1 + 1, self.current_color)
-            elif self.current_tool == TOOL_CIRCLE:
-                x1, y1 = self.start_x, self.start_y
-                x2, y2 = pyxel.mouse_x, pyxel.mouse_y
-                radius = int(((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5)
-                pyxel.circb(x1, y1, radius, self.current_color)
-            elif self.current_tool == TOOL_STAMP:
-                # Show stamp preview at cursor position
-                sx, sy = STAMPS[self.current_stamp]
-                pyxel.blt(pyxel.mouse_x - 8, pyxel.mouse_y - 8, 0, sx, sy, 16, 16, 0)
-            elif self.current_tool == TOOL_ALGO_BRUSH:
-                # Show a preview of the algorithmic brush effect
-                self.draw_algo_brush_preview(pyxel.mouse_x, pyxel.mouse_y)
-            elif self.current_tool == TOOL_TYPE:
-                # Show a preview of the selected character
-                self.draw_char_preview(pyxel.mouse_x, pyxel.mouse_y)
-            elif self.current_tool == TOOL_FILTER:
-                # Show a preview of the selected filter effect
-                self.draw_filter_preview(pyxel.mouse_x, pyxel.mouse_y)
+        # Pick a transparent color that the tinted icons don't use,
+        # so a black (color 0) brush still shows up
+        used = set(np.unique(self.brush_icon_pixels).tolist()) - {0, 2}
+        used.add(self.current_color)
+        self.brush_icon_colkey = min(set(range(16)) - used, default=0)
 
-        # Draw custom mouse cursor based on current tool
-        self.draw_custom_cursor(pyxel.mouse_x, pyxel.mouse_y)
+        # Replace the purple parts (color 2) with the current color
+        icons = self.brush_icon_pixels
+        tinted = np.where(icons == 2, self.current_color, icons)
+        tinted = np.where(icons == 0, self.brush_icon_colkey, tinted)
+        CanvasBuffer(self.brush_icons, icons.shape[1], 16).write(tinted)
 
     def draw_color_palette(self, y):
         # Draw left arrow button using icon
-        pyxel.blt(0, y, 0, 192, 0, 16, 16, 0)  # Left arrow icon at (192,0)
+        self.toolbar.blt(0, y, self.icons, 192, 0, 16, 16, 0)  # Left arrow icon at (192,0)
 
         # Draw right arrow button using icon
-        pyxel.blt(240, y, 0, 208, 0, 16, 16, 0)  # Right arrow icon at (208,0)
+        self.toolbar.blt(240, y, self.icons, 208, 0, 16, 16, 0)  # Right arrow icon at (208,0)
 
         # Draw palette layer indicator (small dots at the bottom)
         for i in range(self.num_palettes):
             dot_x = 128 - (self.num_palettes * 4) + i * 8
             dot_color = 7 if i == self.current_palette else 5
-            pyxel.rect(dot_x, y + 13, 3, 2, dot_color)
+            self.toolbar.rect(dot_x, y + 13, 3, 2, dot_color)
 
         # Draw color palette (14 colors between the arrows)
         colors = COLOR_PALETTES[self.current_palette]
@@ -1013,234 +1574,293 @@ class BunnyPyx:
 
             # Draw yellow background for selected color
             if color == self.current_color:
-                pyxel.rect(x, y, 16, 16, 10)  # Yellow background
+                self.toolbar.rect(x, y, 16, 16, 10)  # Yellow background
 
             # Draw color sample (fill the space but leave room for outline)
-            pyxel.rect(x + 2, y + 2, 12, 12, color)
+            self.toolbar.rect(x + 2, y + 2, 12, 12, color)
             
             # Draw dark blue outline around all colors
-            pyxel.rectb(x + 1, y + 1, 14, 14, 1)
-
-    def draw_stamp_palette(self, y):
-        # Draw left arrow button using icon
-        pyxel.blt(0, y, 0, 192, 0, 16, 16, 0)  # Left arrow icon at (192,0)
-
-        # Draw right arrow button using icon
-        pyxel.blt(240, y, 0, 208, 0, 16, 16, 0)  # Right arrow icon at (208,0)
+            self.toolbar.rectb(x + 1, y + 1, 14, 14, 1)
 
-        # Draw stamps between the arrows
-        for i in range(14):  # Show 14 stamps at a time
-            stamp_idx = i
-            if stamp_idx < len(STAMPS):
-                x = 16 + i * 16
-                sx, sy = STAMPS[stamp_idx]
-
-                # Draw yellow background for selected stamp
-                if stamp_idx == self.current_stamp:
-                    pyxel.rect(x, y, 16, 16, 10)  # Yellow background
-
-                # Draw stamp
-                pyxel.blt(x, y, 0, sx, sy, 16, 16, 0)
-    
-    def draw_algo_brush_palette(self, y):
+    def draw_icon_palette(self, y, icons, selected):
         # Draw left arrow button using icon
-        pyxel.blt(0, y, 0, 192, 0, 16, 16, 0)  # Left arrow icon at (192,0)
+        self.toolbar.blt(0, y, self.icons, 192, 0, 16, 16, 0)  # Left arrow icon at (192,0)
 
         # Draw right arrow button using icon
-        pyxel.blt(240, y, 0, 208, 0, 16, 16, 0)  # Right arrow icon at (208,0)
+        self.toolbar.blt(240, y, self.icons, 208, 0, 16, 16, 0)  # Right arrow icon at (208,0)
 
-        # Draw algorithmic brush icons between the arrows
-        for i in range(min(14, self.num_algo_brushes)):
+        # Draw the stamps, brushes, characters or filters between the
+        # arrows (14 at a time)
+        for i, (sx, sy) in enumerate(icons[:14]):
             x = 16 + i * 16
-            
-            # For now, we're using temporary icons from the same resource file
-            sx, sy = ALGO_BRUSH_ICONS[i]
-
-            # Draw yellow background for selected brush
-            if i == self.current_algo_brush:
-                pyxel.rect(x, y, 16, 16, 10)  # Yellow background
 
-            # Draw brush icon
-            pyxel.blt(x, y, 0, sx, sy, 16, 16, 0)
-            
-            # If no icon available, draw a placeholder with text
-            if i >= len(ALGO_BRUSH_ICONS):
-                pyxel.rect(x + 2, y + 2, 12, 12, 5)  # Gray background
-                pyxel.text(x + 4, y + 5, "B" + str(i), 7)  # White text
-    
-    def draw_algo_brush_preview(self, x, y):
-        # Show a simplified preview of the algorithmic brush at the cursor position
-        if self.current_algo_brush == ALGO_RANDOM_CIRCLES:
-            # Show a simple circle preview
-            pyxel.circb(x, y, 5, 7)
-            pyxel.circb(x+3, y-2, 3, 8)
-            pyxel.circ(x-4, y+2, 2, 11)
-        elif self.current_algo_brush == ALGO_ROTATING_LINES:
-            # Show rotating lines preview
-            length = 6
-            for i in range(4):
-                angle = self.algo_brush_angle + (i * 90)
-                angle_rad = angle * 3.14159 / 180
-                ex = x + length * pyxel.cos(angle_rad)
-                ey = y + length * pyxel.sin(angle_rad)
-                pyxel.line(x, y, ex, ey, i + 8)
-        elif self.current_algo_brush == ALGO_LOOPS:
-            # Show loops preview
-            pyxel.circb(x, y, 4, 7)
-            pyxel.circb(x+3, y+3, 3, 7)
-        elif self.current_algo_brush == ALGO_SPIRALS:
-            # Show spiral preview
-            for i in range(8):
-                angle = self.algo_brush_angle + (i * 45)
-                angle_rad = angle * 3.14159 / 180
-                radius = i * 0.7
-                px = x + radius * pyxel.cos(angle_rad)
-                py = y + radius * pyxel.sin(angle_rad)
-                if i > 0:
-                    pyxel.line(prev_x, prev_y, px, py, 7)
-                prev_x, prev_y = px, py
-        elif self.current_algo_brush == ALGO_SQUARES:
-            # Show squares preview
-            pyxel.rectb(x-5, y-5, 11, 11, 7)
-            pyxel.rectb(x-3, y-3, 7, 7, 8)
-            pyxel.rectb(x-1, y-1, 3, 3, 10)
-        elif self.current_algo_brush == ALGO_STARS:
-            # Show star preview
-            pyxel.line(x, y-5, x+3, y-1, 7)
-            pyxel.line(x+3, y-1, x+5, y-5, 7)
-            pyxel.line(x+5, y-5, x+1, y+1, 7)
-            pyxel.line(x+1, y+1, x+3, y+5, 7)
-            pyxel.line(x+3, y+5, x-1, y+2, 7)
-            pyxel.line(x-1, y+2, x-5, y+4, 7)
-            pyxel.line(x-5, y+4, x-3, y, 7)
-            pyxel.line(x-3, y, x-5, y-4, 7)
-            pyxel.line(x-5, y-4, x, y-5, 7)
-        elif self.current_algo_brush == ALGO_CONFETTI:
-            # Show confetti preview
-            for i in range(8):
-                cx = x + pyxel.sin(i * 45) * 4
-                cy = y + pyxel.cos(i * 45) * 4
-                pyxel.pset(cx, cy, 8 + (i % 7))
-        elif self.current_algo_brush == ALGO_WAVES:
-            # Show waves preview
-            px = x - 5
-            py = y
-            for i in range(10):
-                nx = x - 5 + i
-                ny = y + pyxel.sin(i * 0.6 + self.algo_brush_angle * 0.1) * 3
-                pyxel.line(px, py, nx, ny, 7)
-                px, py = nx, ny
-    
-    def draw_type_palette(self, y):
-        # Draw left arrow button using icon
-        pyxel.blt(0, y, 0, 192, 0, 16, 16, 0)  # Left arrow icon at (192,0)
+            # Draw yellow background for the selected one
+            if i == selected:
+                self.toolbar.rect(x, y, 16, 16, 10)  # Yellow background
 
-        # Draw right arrow button using icon
-        pyxel.blt(240, y, 0, 208, 0, 16, 16, 0)  # Right arrow icon at (208,0)
+            self.toolbar.blt(x, y, self.icons, sx, sy, 16, 16, 0)
 
-        # Draw character palette (14 characters between the arrows)
-        for i in range(14):
-            char_idx = i
-            if char_idx < len(CHARS):
+    def draw_filter_labels(self, y):
+        # Show filter settings (like the blur radius) on their icons
+        for i, filter_entry in enumerate(self.filters[:14]):
+            if filter_entry.label is not None:
+                label = filter_entry.label(self)
                 x = 16 + i * 16
-                sx, sy = CHARS[char_idx]
+                self.toolbar.text(x + 16 - len(label) * 4, y + 10, label, 7)
 
-                # Draw yellow background for selected character
-                if char_idx == self.current_char:
-                    pyxel.rect(x, y, 16, 16, 10)  # Yellow background
+        # Number of filters queued with Shift+click
+        if self.queued_filters:
+            x = 16 + min(14, self.num_filters) * 16
+            self.toolbar.text(x + 2, y + 5, "+%d" % len(self.queued_filters), 7)
 
-                # Draw character
-                pyxel.blt(x, y, 0, sx, sy, 16, 16, 0)
-
-    def draw_filter_palette(self, y):
-        # Draw left arrow button using icon
-        pyxel.blt(0, y, 0, 192, 0, 16, 16, 0)  # Left arrow icon at (192,0)
-
-        # Draw right arrow button using icon
-        pyxel.blt(240, y, 0, 208, 0, 16, 16, 0)  # Right arrow icon at (208,0)
+    def draw_algo_brush_preview(self, x, y):
+        # Show a simplified preview of the algorithmic brush at the cursor position
+        brush = self.brushes[self.current_algo_brush]
+        if brush.preview is not None:
+            self.profiler.timed(
+                "brush " + brush.name + " preview", brush.preview, self, x, y
+            )
 
-        # Draw filter icons between the arrows
-        for i in range(min(14, self.num_filters)):
-            x = 16 + i * 16
-            
-            # For now, we're using temporary icons from the same resource file
-            sx, sy = FILTER_ICONS[i]
+    def preview_random_circles(self, x, y):
+        # Show a simple circle preview
+        self.backend.circb(x, y, 5, 7)
+        self.backend.circb(x+3, y-2, 3, 8)
+        self.backend.circ(x-4, y+2, 2, 11)
+
+    def preview_rotating_lines(self, x, y):
+        # Show rotating lines preview
+        length = 6
+        for i in range(4):
+            angle = self.algo_brush_angle + (i * 90)
+            ex = x + length * self.backend.cos(angle)
+            ey = y + length * self.backend.sin(angle)
+            self.backend.line(x, y, ex, ey, i + 8)
+
+    def preview_loops(self, x, y):
+        # Show loops preview
+        self.backend.circb(x, y, 4, 7)
+        self.backend.circb(x+3, y+3, 3, 7)
+
+    def preview_spirals(self, x, y):
+        # Show spiral preview
+        for i in range(8):
+            angle = self.algo_brush_angle + (i * 45)
+            radius = i * 0.7
+            px = x + radius * self.backend.cos(angle)
+            py = y + radius * self.backend.sin(angle)
+            if i > 0:
+                self.backend.line(prev_x, prev_y, px, py, 7)
+            prev_x, prev_y = px, py
 
-            # Draw yellow background for selected filter
-            if i == self.current_filter:
-                pyxel.rect(x, y, 16, 16, 10)  # Yellow background
+    def preview_squares(self, x, y):
+        # Show squares preview
+        self.backend.rectb(x-5, y-5, 11, 11, 7)
+        self.backend.rectb(x-3, y-3, 7, 7, 8)
+        self.backend.rectb(x-1, y-1, 3, 3, 10)
+
+    def preview_stars(self, x, y):
+        # Show star preview
+        self.backend.line(x, y-5, x+3, y-1, 7)
+        self.backend.line(x+3, y-1, x+5, y-5, 7)
+        self.backend.line(x+5, y-5, x+1, y+1, 7)
+        self.backend.line(x+1, y+1, x+3, y+5, 7)
+        self.backend.line(x+3, y+5, x-1, y+2, 7)
+        self.backend.line(x-1, y+2, x-5, y+4, 7)
+        self.backend.line(x-5, y+4, x-3, y, 7)
+        self.backend.line(x-3, y, x-5, y-4, 7)
+        self.backend.line(x-5, y-4, x, y-5, 7)
+
+    def preview_confetti(self, x, y):
+        # Show confetti preview
+        for i in range(8):
+            cx = x + self.backend.sin(i * 45) * 4
+            cy = y + self.backend.cos(i * 45) * 4
+            self.backend.pset(cx, cy, 8 + (i % 7))
+
+    def preview_waves(self, x, y):
+        # Show waves preview
+        px = x - 5
+        py = y
+        for i in range(10):
+            nx = x - 5 + i
+            ny = y + self.backend.sin(i * 0.6 + self.algo_brush_angle * 0.1) * 3
+            self.backend.line(px, py, nx, ny, 7)
+            px, py = nx, ny
 
-            # Draw filter icon
-            pyxel.blt(x, y, 0, sx, sy, 16, 16, 0)
-            
-            # If no icon available, draw a placeholder with text
-            if i >= len(FILTER_ICONS):
-                pyxel.rect(x + 2, y + 2, 12, 12, 5)  # Gray background
-                pyxel.text(x + 4, y + 5, "F" + str(i), 7)  # White text
-    
     def draw_char_preview(self, x, y):
         # Show a simplified preview of the selected character
         sx, sy = CHARS[self.current_char]
-        pyxel.blt(x - 8, y - 8, 0, sx, sy, 16, 16, 0)
+        self.backend.blt(x - 8, y - 8, 0, sx, sy, 16, 16, 0)
+
+    def update_filter_preview(self):
+        # Only filter the small copy of the current layer again when the
+        # layers, the filters or their settings changed
+        filter_types = tuple(self.queued_filters + [self.current_filter])
+        settings = tuple(
+            self.filter_settings(self.filters[filter_type]) for filter_type in filter_types
+        )
+        key = (filter_types, settings, self.layers.dirty.version, self.current_layer)
+        if key == self.preview_key:
+            return
+        self.preview_key = key
+
+        step = self.preview_step
+        small = self.canvas.read()[::step, ::step]
+        self.preview.write(self.filtered(small, filter_types))
 
     def draw_filter_preview(self, x, y):
-        # Show a simplified preview of the selected filter effect
-        if self.current_filter == FILTER_INVERT:
-            # Show inverted preview
-            pyxel.circb(x, y, 5, 7)
-            pyxel.circb(x+3, y-2, 3, 8)
-            pyxel.circ(x-4, y+2, 2, 11)
-        elif self.current_filter == FILTER_GRAYSCALE:
-            # Show grayscale preview
-            pyxel.rectb(x-5, y-5, 11, 11, 7)
-            pyxel.rectb(x-3, y-3, 7, 7, 8)
-            pyxel.rectb(x-1, y-1, 3, 3, 10)
-        elif self.current_filter == FILTER_FLIP_X:
-            # Show flipped horizontally preview
-            pyxel.circb(x, y, 5, 7)
-            pyxel.circb(x+3, y-2, 3, 8)
-            pyxel.circ(x-4, y+2, 2, 11)
-        elif self.current_filter == FILTER_FLIP_Y:
-            # Show flipped vertically preview
-            pyxel.circb(x, y, 5, 7)
-            pyxel.circb(x+3, y-2, 3, 8)
-            pyxel.circ(x-4, y+2, 2, 11)
-        elif self.current_filter == FILTER_ROTATE_90:
-            # Show rotated 90 degrees preview
-            pyxel.circb(x, y, 5, 7)
-            pyxel.circb(x+3, y-2, 3, 8)
-            pyxel.circ(x-4, y+2, 2, 11)
-        elif self.current_filter == FILTER_WAVE:
-            # Show wave preview
-            pyxel.circb(x, y, 5, 7)
-            pyxel.circb(x+3, y-2, 3, 8)
-            pyxel.circ(x-4, y+2, 2, 11)
-        elif self.current_filter == FILTER_PIXELATE:
-            # Show pixelated preview
-            pyxel.rectb(x-5, y-5, 11, 11, 7)
-            pyxel.rectb(x-3, y-3, 7, 7, 8)
-            pyxel.rectb(x-1, y-1, 3, 3, 10)
-        elif self.current_filter == FILTER_BLUR:
-            # Show blurred preview
-            pyxel.rectb(x-5, y-5, 11, 11, 7)
-            pyxel.rectb(x-3, y-3, 7, 7, 8)
-            pyxel.rectb(x-1, y-1, 3, 3, 10)
+        # Show the filter applied to a small copy of the canvas next to the cursor
+        self.update_filter_preview()
+        width = self.preview.width
+        height = self.preview.height
+
+        # Keep it on the view, below the cursor if there is room
+        px = min(max(x + 8, 1), VIEW_WIDTH - width - 1)
+        py = y + 8 if y + 8 + height < VIEW_HEIGHT else y - 8 - height
+        py = max(py, 1)
+
+        self.backend.rectb(px - 1, py - 1, width + 2, height + 2, 7)
+        self.backend.blt(px, py, self.preview.image, 0, 0, width, height)
+        self.overlay_rects.append((px - 1, py - 1, width + 2, height + 2))
+
+    def draw_layer_boxes(self):
+        # One numbered box per layer in the top-right corner of the view:
+        # yellow for the layer being drawn on, white if it is shown and
+        # gray if it is hidden
+        count = self.layers.count
+        left = VIEW_WIDTH - count * 8 - 1
+        for i in range(count):
+            x = left + i * 8
+            if i == self.current_layer:
+                color = 10
+            elif self.layers.visible[i]:
+                color = 7
+            else:
+                color = 13
+            self.backend.rect(x, 1, 7, 7, color)
+            self.backend.text(x + 2, 2, str(i + 1), 0)
+            if not self.layers.visible[i]:
+                # Crossed out while hidden
+                self.backend.line(x, 7, x + 6, 1, 8)
+        self.overlay_rects.append((left, 1, count * 8, 7))
+
+    def draw_text_preview(self):
+        # The text is drawn at the view's zoom, where it will end up
+        scale = self.text_scale() * self.viewport.zoom
+        sprite, positions = self.glyphs.layout(self.typed_text, scale)
+        h, w = sprite.shape
+        color = self.current_color
+        colkey = 0 if color != 0 else 1
+
+        # The preview image is only redrawn when the text or its size or
+        # color change, not every frame
+        key = (self.typed_text, scale, color)
+        if key != self.text_preview_key:
+            self.text_preview_key = key
+            self.text_preview.pixels[:, :] = colkey
+            self.text_preview.paint_mask(0, 0, sprite, color)
+
+        x, y = self.viewport.to_screen(self.text_x, self.text_y)
+        w = min(w, VIEW_WIDTH)
+        h = min(h, VIEW_HEIGHT)
+        if w > 0:
+            self.backend.blt(x, y, self.text_preview.image, 0, 0, w, h, colkey)
+
+        # Blinking cursor in front of the letter it is at
+        if self.backend.frame_count // 8 % 2 == 0:
+            cursor_x = x + positions[self.text_cursor]
+            self.backend.rect(cursor_x, y, max(1, scale // 2), h, 7)
+
+        self.overlay_rects.append((x, y, w + scale, h))
 
     def draw_custom_cursor(self, x, y):
         # Use different cursors based on current tool
         if self.current_tool == TOOL_STAMP:
             # Show stamp preview at cursor position with center hotspot
             sx, sy = STAMPS[self.current_stamp]
-            pyxel.blt(x - 8, y - 8, 0, sx, sy, 16, 16, 0)
+            self.backend.blt(x - 8, y - 8, 0, sx, sy, 16, 16, 0)
         elif self.current_tool == TOOL_TYPE:
             # Show character preview with lower-left hotspot
             sx, sy = CHARS[self.current_char]
-            pyxel.blt(x, y - 15, 0, sx, sy, 16, 16, 0)
+            self.backend.blt(x, y - 15, 0, sx, sy, 16, 16, 0)
         else:
             # For all other tools, position hotspot at lower-left corner
             tool_x = self.current_tool * 16
             # Place the icon so its lower-left corner is at the mouse position
-            pyxel.blt(x, y - 15, 0, tool_x, 0, 16, 16, 0)
-
-
-BunnyPyx()
+            self.backend.blt(x, y - 15, 0, tool_x, 0, 16, 16, 0)
+
+
+# Built-in filters, in toolbar order (matching the FILTER_ numbers above)
+register_filter("invert", "remap", "invert", cost=0.005)
+register_filter("grayscale", "remap", "grayscale", cost=0.005)
+register_filter("flip_x", "map", BunnyPyx.flip_x, cost=0.01)
+register_filter("flip_y", "map", BunnyPyx.flip_y, cost=0.01)
+register_filter("rotate_90", "map", BunnyPyx.rotate_90, cost=0.01)
+register_filter("wave", "map", BunnyPyx.wave, cost=0.01)
+register_filter(
+    "pixelate",
+    "rows",
+    BunnyPyx.pixelate_rows,
+    cost=0.05,
+    settings=lambda app: app.pixelate_block,
+    align=lambda app: app.pixelate_block[1],
+    label=BunnyPyx.pixelate_label,
+    adjust=BunnyPyx.change_pixelate_block,
+)
+register_filter(
+    "blur",
+    "bands",
+    BunnyPyx.blur_bands,
+    settings=lambda app: app.blur_radius,
+    label=lambda app: str(app.blur_radius),
+    adjust=BunnyPyx.change_blur_radius,
+)
+
+# Built-in algorithmic brushes, in toolbar order (matching the ALGO_ numbers)
+register_brush(
+    "random_circles", "primitives",
+    draw=BunnyPyx.draw_random_circles, preview=BunnyPyx.preview_random_circles,
+)
+register_brush(
+    "rotating_lines", "sprite",
+    render=BunnyPyx.render_rotating_lines, state=BunnyPyx.rotating_lines_state,
+    preview=BunnyPyx.preview_rotating_lines,
+)
+register_brush(
+    "loops", "primitives", draw=BunnyPyx.draw_loops, preview=BunnyPyx.preview_loops
+)
+register_brush(
+    "spirals", "sprite",
+    render=BunnyPyx.render_spiral, state=BunnyPyx.spiral_state,
+    preview=BunnyPyx.preview_spirals,
+)
+register_brush(
+    "squares", "sprite",
+    render=BunnyPyx.render_squares, state=BunnyPyx.squares_state,
+    preview=BunnyPyx.preview_squares,
+)
+register_brush(
+    "stars", "sprite",
+    render=BunnyPyx.render_star, state=BunnyPyx.star_state,
+    preview=BunnyPyx.preview_stars,
+)
+register_brush(
+    "confetti", "primitives",
+    draw=BunnyPyx.draw_confetti, preview=BunnyPyx.preview_confetti,
+)
+register_brush(
+    "waves", "primitives", draw=BunnyPyx.draw_waves, preview=BunnyPyx.preview_waves
+)
+
+# Filters and brushes from the plugins folder (see registry.py)
+load_plugins(PLUGIN_FOLDER)
+
+
+if __name__ == "__main__":
+    # python bunny-pyx.py --record session.bpxr records the session for
+    # replay.py. A recording starts from an empty canvas, so the autosave
+    # is left out.
+    if len(sys.argv) == 3 and sys.argv[1] == "--record":
+        BunnyPyx(RecordingBackend(PyxelBackend(), sys.argv[2]))
+    else:
+        BunnyPyx(autosave_file=AUTOSAVE_FILE)
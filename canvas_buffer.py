@@ -0,0 +1,401 @@
+# Canvas buffer
+# Lets Bunny Pyx read and write a whole pyxel image at once
+# instead of one pget/pset call per pixel.
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from jobs import run_to_end, scaled
+
+# How many runs flood_fill_steps fills between yields, and how many
+# pixels it looks for runs in between yields before that
+FILL_STEP_RUNS = 256
+FILL_STEP_PIXELS = 1 << 16
+
+# Rows per band when mode_filter does the whole canvas at once
+MODE_FILTER_ROWS = 32
+
+# Colors 1 to 15 (0 is transparent), to compare a row with all of them
+COLORS = np.arange(1, 16, dtype=np.uint8)[:, None]
+
+
+class CanvasBuffer:
+    def __init__(self, image, width, height, dirty=None):
+        # The canvas is the top-left width x height corner of the image
+        self.image = image
+        self.width = width
+        self.height = height
+
+        # Optional DirtyTracker that hears about every change made
+        # through this buffer
+        self.dirty = dirty
+
+        # Live view of the image memory as a (height, width) array of
+        # palette indices. Writing into it changes the image directly.
+        memory = np.ctypeslib.as_array(image.data_ptr())
+        memory = memory.reshape(image.height, image.width)
+        self.pixels = memory[:height, :width]
+
+    def read(self):
+        # Return a copy of the whole canvas that is safe to modify
+        return self.pixels.copy()
+
+    def write(self, pixels):
+        # Copy a whole array of palette indices back into the canvas
+        self.pixels[:, :] = pixels
+        self.mark_all()
+
+    def mark(self, x, y, w, h):
+        # Report a box that was changed by writing to pixels directly
+        if self.dirty is not None:
+            self.dirty.mark(x, y, w, h)
+
+    def mark_all(self):
+        if self.dirty is not None:
+            self.dirty.mark_all()
+
+    # Drawing on the canvas image, marking the box each call can touch.
+    # The boxes are one pixel bigger than needed on each side so pyxel's
+    # rounding of float coordinates never reaches outside them.
+
+    def cls(self, col):
+        self.image.cls(col)
+        self.mark_all()
+
+    def pset(self, x, y, col):
+        self.image.pset(x, y, col)
+        self.mark(x - 1, y - 1, 3, 3)
+
+    def line(self, x1, y1, x2, y2, col):
+        self.image.line(x1, y1, x2, y2, col)
+        self.mark(min(x1, x2) - 1, min(y1, y2) - 1, abs(x2 - x1) + 3, abs(y2 - y1) + 3)
+
+    def rect(self, x, y, w, h, col):
+        self.image.rect(x, y, w, h, col)
+        self.mark(x - 1, y - 1, w + 2, h + 2)
+
+    def rectb(self, x, y, w, h, col):
+        self.image.rectb(x, y, w, h, col)
+        self.mark(x - 1, y - 1, w + 2, h + 2)
+
+    def circ(self, x, y, r, col):
+        self.image.circ(x, y, r, col)
+        self.mark(x - r - 1, y - r - 1, r * 2 + 3, r * 2 + 3)
+
+    def circb(self, x, y, r, col):
+        self.image.circb(x, y, r, col)
+        self.mark(x - r - 1, y - r - 1, r * 2 + 3, r * 2 + 3)
+
+    def blt(self, x, y, img, u, v, w, h, colkey=None):
+        self.image.blt(x, y, img, u, v, w, h, colkey)
+        self.mark(x - 1, y - 1, abs(w) + 2, abs(h) + 2)
+
+    def paint_mask(self, x, y, mask, col):
+        # Paint col wherever a boolean mask is True, with the mask's
+        # top-left corner at x, y, in one write
+        h, w = mask.shape
+        x1 = max(x, 0)
+        y1 = max(y, 0)
+        x2 = min(x + w, self.width)
+        y2 = min(y + h, self.height)
+        if x1 >= x2 or y1 >= y2:
+            return
+        area = self.pixels[y1:y2, x1:x2]
+        area[mask[y1 - y:y2 - y, x1 - x:x2 - x]] = col
+        self.mark(x1, y1, x2 - x1, y2 - y1)
+
+
+def dominant_colors(samples):
+    # Find the most common non-transparent color along the last axis.
+    # Ties go to the color that shows up first, and groups with no
+    # colored samples at all come out as 0 (transparent).
+    shape = samples.shape[:-1]
+    size = samples.shape[-1]
+    groups = samples.reshape(-1, size)
+    count = len(groups)
+
+    # Count every color in every group at once with a single bincount,
+    # and note where each color first shows up in its group
+    bins = (np.arange(count)[:, None] * 16 + groups).ravel()
+    counts = np.bincount(bins, minlength=count * 16).reshape(count, 16)
+    first = np.full(count * 16, size)
+    np.minimum.at(first, bins, np.tile(np.arange(size), count))
+    first = first.reshape(count, 16)
+
+    # More samples wins, then the earlier first sample
+    counts[:, 0] = 0
+    best = np.argmax(counts * (size + 1) - first, axis=1)
+    best[counts.max(axis=1) == 0] = 0
+    return best.astype(np.uint8).reshape(shape)
+
+
+def mode_filter(pixels, radius):
+    # For every pixel, the most common non-transparent color in the
+    # (2 * radius + 1) square around it, for the whole canvas at once
+    # (see mode_filter_bands)
+    result = np.empty(pixels.shape, dtype=np.uint8)
+    y = 0
+    for band in mode_filter_bands(pixels, radius, MODE_FILTER_ROWS):
+        result[y:y + len(band)] = band
+        y += len(band)
+    return result
+
+
+def mode_filter_bands(pixels, radius, rows):
+    # For every pixel, the most common non-transparent color in the
+    # (2 * radius + 1) square around it. Ties go to the color seen first
+    # reading the square left to right, top to bottom, and squares with
+    # no colored pixels come out as 0 (transparent).
+    # Yields the result a band of rows rows at a time, top to bottom.
+    #
+    # Every input row is looked at once, when the first band that needs it
+    # comes up, and what was found out about it is kept (for the rows that
+    # later bands still need) instead of being worked out again. So the
+    # cost per pixel does not grow with the radius or shrink with the band.
+    #  - Counts come from running sums along each row, then down the
+    #    canvas (a sliding histogram with one bin per color).
+    #  - Where a color is first seen in a square is the smallest of its
+    #    rows' first positions. The rows are split into blocks as tall as
+    #    the square, so every square is the end of one block and the start
+    #    of the next, and each block keeps the smallest first position up
+    #    to each row (prefix) and from each row on (suffix).
+    # Arrays have one slice per color (1 to 15) along their first axis.
+    height, width = pixels.shape
+    xs = np.arange(width)
+    left = np.maximum(xs - radius, 0)
+    right = np.minimum(xs + radius + 1, width)
+    size = 2 * radius + 1
+    never = height * width  # Later than any position
+
+    # What is kept about each input row, in ring buffers (row y is at
+    # y % ring) big enough for the rows a band reaches back to.
+    # sums holds, for row y, the running sums of the rows above it.
+    ring = rows + 2 * size
+    sums = np.zeros((15, ring, width), dtype=np.int32)
+    firsts = np.zeros((15, ring, width), dtype=np.int64)
+    prefix = np.zeros((15, ring, width), dtype=np.int64)
+    suffix = np.zeros((15, ring, width), dtype=np.int64)
+    total = np.zeros((15, width), dtype=np.int32)
+    row_sums = np.zeros((15, width + 1), dtype=np.int32)
+
+    seen = 0
+    for y1 in range(0, height, rows):
+        y2 = min(y1 + rows, height)
+
+        # Look at the rows that just came into reach of the band
+        for y in range(seen, min(y2 + radius, height)):
+            matches = pixels[y] == COLORS
+            np.cumsum(matches, axis=1, out=row_sums[:, 1:])
+            total += row_sums[:, right] - row_sums[:, left]
+            sums[:, (y + 1) % ring] = total
+
+            # First position of each color in this row of every square
+            next_col = np.where(matches, xs, width)
+            next_col = np.minimum.accumulate(next_col[:, ::-1], axis=1)[:, ::-1]
+            col = next_col[:, left]
+            firsts[:, y % ring] = np.where(col < right, y * width + col, never)
+
+            if y % size == 0:
+                prefix[:, y % ring] = firsts[:, y % ring]
+            else:
+                np.minimum(
+                    prefix[:, (y - 1) % ring], firsts[:, y % ring], out=prefix[:, y % ring]
+                )
+
+            # At the end of a block, go back up it for the suffixes
+            if y % size == size - 1 or y == height - 1:
+                smallest = firsts[:, y % ring]
+                for t in range(y, y - y % size - 1, -1):
+                    smallest = np.minimum(smallest, firsts[:, t % ring])
+                    suffix[:, t % ring] = smallest
+            seen = y + 1
+
+        # The squares of this band's pixels go from row top to bottom - 1
+        ys = np.arange(y1, y2)
+        top = np.maximum(ys - radius, 0)
+        bottom = np.minimum(ys + radius + 1, height)
+        count = sums[:, bottom % ring] - sums[:, top % ring]
+
+        # A square inside one block (only at the canvas edges) is the
+        # block's start up to its last row, or from its first row to the
+        # block's end
+        starts = prefix[:, (bottom - 1) % ring]
+        ends = suffix[:, top % ring]
+        one_block = (top // size == (bottom - 1) // size)[:, None]
+        at_start = (top % size == 0)[:, None]
+        first = np.where(
+            one_block, np.where(at_start, starts, ends), np.minimum(starts, ends)
+        )
+
+        # More samples wins, then the earlier first sample
+        best = np.argmax(count * np.int64(never + 1) - first, axis=0)
+        colors = (best + 1).astype(np.uint8)
+        colors[count.max(axis=0) == 0] = 0
+        yield colors
+
+
+def find_runs_steps(pixels, color, rows=None):
+    # Find every horizontal run of the given color, rows rows at a time
+    # (all at once by default), as a job (see jobs.py).
+    # Returns, for each row, a list of run starts and a list of run ends
+    # (both inclusive and sorted left to right).
+    height, width = pixels.shape
+    if rows is None:
+        rows = max(height, 1)
+    starts = []
+    ends = []
+    for y1 in range(0, height, rows):
+        band = pixels[y1:y1 + rows]
+        mask = np.zeros((len(band), width + 2), dtype=np.int8)
+        mask[:, 1:-1] = band == color
+        edges = np.diff(mask, axis=1)
+        start_rows, start_cols = np.nonzero(edges == 1)
+        _, end_cols = np.nonzero(edges == -1)
+
+        # Split the flat lists back into rows
+        splits = np.searchsorted(start_rows, np.arange(1, len(band)))
+        starts += [row.tolist() for row in np.split(start_cols, splits)]
+        ends += [(row - 1).tolist() for row in np.split(end_cols, splits)]
+        yield (y1 + len(band)) / height
+    return starts, ends
+
+
+def flood_fill(pixels, x, y, color, connectivity=4):
+    # Fill the area of same-colored pixels around (x, y) with color.
+    # Returns the (x, y, w, h) box around the filled area, or None if
+    # nothing was filled.
+    return run_to_end(flood_fill_steps(pixels, x, y, color, connectivity))
+
+
+def flood_fill_steps(pixels, x, y, color, connectivity=4):
+    # flood_fill as a job (see jobs.py): yields how far along it is
+    # every FILL_STEP_RUNS runs and returns the box around the filled area.
+    # Works a whole run (span) of pixels at a time. Each run is filled as
+    # soon as it is found and then pushed on the stack, so every run is
+    # pushed at most once and the stack can never hold more entries than
+    # there are runs of the target color.
+    height, width = pixels.shape
+    if not (0 <= x < width and 0 <= y < height):
+        return None
+    target = pixels[y, x]
+    if target == color:
+        return None
+
+    # Finding the runs is the first half of the work, FILL_STEP_PIXELS
+    # pixels at a time
+    rows = max(1, FILL_STEP_PIXELS // width)
+    starts, ends = yield from scaled(find_runs_steps(pixels, target, rows), 0, 0.5)
+    filled = [bytearray(len(row)) for row in starts]
+    total_runs = sum(len(row) for row in starts)
+    done_runs = 0
+
+    # With 8-connectivity, runs that only touch diagonally are connected too
+    reach = 1 if connectivity == 8 else 0
+
+    # Start from the run under the cursor
+    i = bisect_right(starts[y], x) - 1
+    filled[y][i] = 1
+    pixels[y, starts[y][i]:ends[y][i] + 1] = color
+    stack = [(y, starts[y][i], ends[y][i])]
+    top = bottom = y
+    min_left = starts[y][i]
+    max_right = ends[y][i]
+
+    while stack:
+        # Take a break every so often (the most there is left to fill is
+        # every run of the target color)
+        done_runs += 1
+        if done_runs % FILL_STEP_RUNS == 0:
+            yield 0.5 + done_runs / total_runs / 2
+
+        row, left, right = stack.pop()
+        top = min(top, row)
+        bottom = max(bottom, row)
+        min_left = min(min_left, left)
+        max_right = max(max_right, right)
+
+        # Look for unfilled runs touching this one in the rows above and below
+        for next_row in (row - 1, row + 1):
+            if not 0 <= next_row < height:
+                continue
+            row_starts = starts[next_row]
+            row_ends = ends[next_row]
+            row_filled = filled[next_row]
+
+            # Runs that end at or after left and start at or before right
+            first = bisect_left(row_ends, left - reach)
+            last = bisect_right(row_starts, right + reach)
+            for j in range(first, last):
+                if not row_filled[j]:
+                    row_filled[j] = 1
+                    pixels[next_row, row_starts[j]:row_ends[j] + 1] = color
+                    stack.append((next_row, row_starts[j], row_ends[j]))
+
+    return (min_left, top, max_right - min_left + 1, bottom - top + 1)
+
+
+def line_points(x1, y1, x2, y2):
+    # The pixels pyxel draws for a line between two integer points,
+    # as arrays of x and y coordinates.
+    # It steps one pixel at a time along the longer axis and rounds the
+    # other one, using 32-bit floats for the slope just like pyxel.
+    if x1 == x2 and y1 == y2:
+        return np.array([x1]), np.array([y1])
+
+    if abs(x1 - x2) > abs(y1 - y2):
+        if x1 > x2:
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        steps = np.arange(x2 - x1 + 1)
+        alpha = np.float32(y2 - y1) / np.float32(x2 - x1)
+        return x1 + steps, y1 + round_half_away(alpha * steps.astype(np.float32))
+
+    if y1 > y2:
+        x1, y1, x2, y2 = x2, y2, x1, y1
+    steps = np.arange(y2 - y1 + 1)
+    alpha = np.float32(x2 - x1) / np.float32(y2 - y1)
+    return x1 + round_half_away(alpha * steps.astype(np.float32)), y1 + steps
+
+
+def round_half_away(values):
+    # Round an array of floats half away from zero, like pyxel does
+    values = values.astype(np.float64)
+    return (np.sign(values) * np.floor(np.abs(values) + 0.5)).astype(np.int64)
+
+
+def stroke_capsule(pixels, x1, y1, x2, y2, radius, color):
+    # Draw a thick line with round ends (a capsule) between two points.
+    # Returns the (x, y, w, h) box around it.
+    # The shape is the one-pixel line from (x1, y1) to (x2, y2) with a
+    # disk of the given radius drawn at every one of its pixels. Each row
+    # of that shape is a single horizontal span, so every pixel is
+    # written exactly once.
+    height, width = pixels.shape
+    xs, ys = line_points(x1, y1, x2, y2)
+
+    # Half-width of the disk at each distance from its center row
+    offsets = np.arange(-radius, radius + 1)
+    half_widths = np.sqrt(radius * radius - offsets * offsets).astype(np.int64)
+
+    # Every line pixel widened by the disk, one row of the disk at a time
+    rows = (ys[:, None] + offsets[None, :]).ravel()
+    lefts = (xs[:, None] - half_widths[None, :]).ravel()
+    rights = (xs[:, None] + half_widths[None, :]).ravel()
+
+    # Combine them into one span per row
+    top = rows.min()
+    span_count = rows.max() - top + 1
+    span_lefts = np.full(span_count, width, dtype=np.int64)
+    span_rights = np.full(span_count, -1, dtype=np.int64)
+    np.minimum.at(span_lefts, rows - top, lefts)
+    np.maximum.at(span_rights, rows - top, rights)
+
+    # Fill the spans that are on the canvas
+    span_lefts = np.maximum(span_lefts, 0)
+    span_rights = np.minimum(span_rights, width - 1)
+    for i in range(span_count):
+        row = top + i
+        if 0 <= row < height and span_lefts[i] <= span_rights[i]:
+            pixels[row, span_lefts[i]:span_rights[i] + 1] = color
+
+    left = lefts.min()
+    return (left, top, rights.max() - left + 1, span_count)
@@ -0,0 +1,115 @@
+# Dirty regions
+# Keeps track of which 16x16 tiles of the canvas have been drawn on.
+# Everything that changes the canvas marks the box it touched, and each
+# part of the program that needs to know (the undo history, the screen)
+# takes the tiles that changed since the last time it asked.
+import math
+
+import numpy as np
+
+TILE_SIZE = 16
+
+
+class DirtyTracker:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.rows = -(-height // TILE_SIZE)
+        self.cols = -(-width // TILE_SIZE)
+
+        # One grid of dirty tiles for every consumer, by name
+        self.grids = {}
+
+        # Goes up by one with every change, so anything worked out from
+        # the canvas can tell when it is out of date
+        self.version = 0
+
+    def grid(self, name):
+        # A new consumer starts with everything dirty, since it has not
+        # seen the canvas yet
+        if name not in self.grids:
+            self.grids[name] = np.ones((self.rows, self.cols), dtype=bool)
+        return self.grids[name]
+
+    def mark(self, x, y, w, h, only=None):
+        # Mark every tile touched by the box at (x, y) of size w x h.
+        # Coordinates may be floats, the box is grown to whole pixels.
+        # With only, just that consumer hears about it, and the canvas
+        # itself doesn't count as changed (like when something was drawn
+        # over the canvas on the screen).
+        x1 = max(0, math.floor(x))
+        y1 = max(0, math.floor(y))
+        x2 = min(self.width, math.ceil(x + w))
+        y2 = min(self.height, math.ceil(y + h))
+        if x1 >= x2 or y1 >= y2:
+            return
+
+        tiles = (
+            slice(y1 // TILE_SIZE, (y2 - 1) // TILE_SIZE + 1),
+            slice(x1 // TILE_SIZE, (x2 - 1) // TILE_SIZE + 1),
+        )
+        if only is not None:
+            self.grid(only)[tiles] = True
+            return
+
+        self.version += 1
+        for grid in self.grids.values():
+            grid[tiles] = True
+
+    def mark_all(self, only=None):
+        if only is not None:
+            self.grid(only)[:, :] = True
+            return
+
+        self.version += 1
+        for grid in self.grids.values():
+            grid[:, :] = True
+
+    def mark_tiles(self, tiles, only=None):
+        # Mark a whole grid of tiles at once (like the ones take returns)
+        if only is not None:
+            self.grids[only] = self.grid(only) | tiles
+            return
+
+        self.version += 1
+        for grid in self.grids.values():
+            grid |= tiles
+
+    def take(self, name):
+        # Return the consumer's dirty tiles and start it over as clean
+        grid = self.grid(name)
+        self.grids[name] = np.zeros_like(grid)
+        return grid
+
+    def rects(self, tiles, area=None):
+        # Turn a grid of dirty tiles into (x, y, w, h) pixel boxes,
+        # joining neighbouring dirty tiles in a row into one box.
+        # With area, only tiles inside that (x, y, w, h) box are looked
+        # at and the boxes are cut to fit it.
+        if area is None:
+            area = (0, 0, self.width, self.height)
+        ax, ay, aw, ah = area
+        ax2 = min(ax + aw, self.width)
+        ay2 = min(ay + ah, self.height)
+        if ax >= ax2 or ay >= ay2:
+            return []
+        first_col = ax // TILE_SIZE
+        last_col = (ax2 - 1) // TILE_SIZE + 1
+
+        rects = []
+        for tile_y in range(ay // TILE_SIZE, (ay2 - 1) // TILE_SIZE + 1):
+            row = tiles[tile_y]
+            y = max(tile_y * TILE_SIZE, ay)
+            h = min((tile_y + 1) * TILE_SIZE, ay2) - y
+            tile_x = first_col
+            while tile_x < last_col:
+                if not row[tile_x]:
+                    tile_x += 1
+                    continue
+                start = tile_x
+                while tile_x < last_col and row[tile_x]:
+                    tile_x += 1
+                x = max(start * TILE_SIZE, ax)
+                w = min(tile_x * TILE_SIZE, ax2) - x
+                rects.append((x, y, w, h))
+        return rects
@@ -0,0 +1,140 @@
+# Gather maps
+# A geometric filter (flip, rotate, wave) only moves pixels around, so it
+# can be written as a "gather map": for every pixel of the result, the
+# number of the pixel it is copied from. Maps are worked out once for
+# each canvas size and filter setting and then reused. Only the few maps
+# used most recently are kept, since a big canvas makes big maps.
+#
+# A chain of geometric filters and palette remaps fuses into a single
+# map and a single color table, so the whole chain is one pass over the
+# canvas however long it is.
+from collections import OrderedDict
+
+import numpy as np
+
+from palette import IDENTITY
+
+# How many maps are kept at once
+MAX_MAPS = 8
+
+
+def build_map_steps(move, height, width, rows=None):
+    # Build a map as a job (see jobs.py): yields how far along it is after
+    # every band of rows and returns the map.
+    # The filter's move function (move(pixels, y1, y2) returns rows y1 to
+    # y2 of the moved picture) is run on a picture of pixel numbers, a
+    # band of rows at a time. Numbers start at 1, so pixels the filter
+    # fills with 0 (transparent) can be told apart. They point one past
+    # the last pixel. int32 is enough for any canvas and takes half the
+    # memory of int64.
+    if rows is None:
+        rows = height
+    size = height * width
+    numbers = np.empty((height, width), dtype=np.int32)
+    for y1 in range(0, height, rows):
+        y2 = min(y1 + rows, height)
+        numbers[y1:y2] = np.arange(
+            y1 * width + 1, y2 * width + 1, dtype=np.int32
+        ).reshape(-1, width)
+        yield y2 / height / 2
+
+    index = np.empty(size, dtype=np.int32)
+    for y1 in range(0, height, rows):
+        y2 = min(y1 + rows, height)
+        band = index[y1 * width:y2 * width]
+        band[:] = move(numbers, y1, y2).ravel()
+        band -= 1
+        band[band < 0] = size
+        yield 0.5 + y2 / height / 2
+    return index
+
+
+class GatherMaps:
+    def __init__(self, max_maps=MAX_MAPS):
+        # (key, height, width) -> map, least recently used first
+        self.maps = OrderedDict()
+        self.max_maps = max_maps
+
+    def get_steps(self, key, move, height, width, rows=None):
+        # The map for key as a job (see jobs.py). If it isn't kept already
+        # it is built rows rows at a time (all at once by default).
+        # key names the filter and its settings, so changing a setting
+        # (or the canvas size) builds a new map
+        full_key = (key, height, width)
+        index = self.maps.get(full_key)
+        if index is not None:
+            self.maps.move_to_end(full_key)
+            return index
+
+        index = yield from build_map_steps(move, height, width, rows)
+
+        # Make room by dropping the map that was used least recently
+        if len(self.maps) >= self.max_maps:
+            self.maps.popitem(last=False)
+        self.maps[full_key] = index
+        return index
+
+
+class FusedChain:
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.size = height * width
+
+        # Where each result pixel comes from (None means it stays put),
+        # and the color table for source pixels
+        self.index = None
+        self.table = IDENTITY
+
+        # Colors of pixels a map filled in. Remaps after the map still
+        # change them, so each map that fills gets its own entry,
+        # numbered from size upwards in the index.
+        self.fills = []
+
+    def is_empty(self):
+        return self.index is None and (self.table == IDENTITY).all()
+
+    def add_map_steps(self, index, rows):
+        # Add a map after the chain so far, rows rows at a time, as a job
+        # (see jobs.py)
+        fill = self.size + len(self.fills)
+        combined = np.empty_like(index)
+        any_filled = False
+        for y1 in range(0, self.height, rows):
+            y2 = min(y1 + rows, self.height)
+            part = index[y1 * self.width:y2 * self.width]
+            band = combined[y1 * self.width:y2 * self.width]
+            if self.index is None:
+                band[:] = part
+            else:
+                band[:] = self.index[np.minimum(part, self.size - 1)]
+            filled = part == self.size
+            if filled.any():
+                band[filled] = fill
+                any_filled = True
+            yield y2 / self.height
+        if any_filled:
+            self.fills.append(0)
+        self.index = combined
+
+    def add_remap(self, table):
+        self.table = table[self.table]
+        self.fills = [int(table[color]) for color in self.fills]
+
+    def apply(self, pixels):
+        # Run the whole chain on a (height, width) array of colors
+        return self.apply_rows(pixels, 0, self.height)
+
+    def apply_rows(self, pixels, y1, y2):
+        # Rows y1 to y2 (not included) of the chain's result
+        source = pixels.ravel()
+        if self.index is None:
+            return self.table[source[y1 * self.width:y2 * self.width]].reshape(-1, self.width)
+
+        index = self.index[y1 * self.width:y2 * self.width]
+        inside = index < self.size
+        values = self.table[source[np.where(inside, index, 0)]]
+        if self.fills:
+            fills = np.array(self.fills, dtype=np.uint8)
+            values = np.where(inside, values, fills[np.maximum(index - self.size, 0)])
+        return values.reshape(-1, self.width)
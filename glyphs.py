@@ -0,0 +1,77 @@
+# Glyphs for the keyboard text tool
+# Every character of pyxel's built-in font is drawn once into a glyph
+# atlas and measured, so letters can sit next to each other with their
+# own widths ("i" is narrower than "m"). A typed string is turned into a
+# sprite (an array of ink pixels) once and kept, so the preview and the
+# final paste don't lay the string out again every frame.
+from collections import OrderedDict
+
+import numpy as np
+import pyxel
+
+from canvas_buffer import CanvasBuffer
+
+# Characters the font has, in atlas order
+FONT_CHARS = "".join(chr(code) for code in range(32, 127))
+
+# Gap between two letters, and how wide a space is, in font pixels
+LETTER_SPACING = 1
+SPACE_WIDTH = 3
+
+# How many string sprites to keep
+MAX_SPRITES = 64
+
+
+class GlyphAtlas:
+    def __init__(self):
+        # Draw the whole font in one row, one cell per character.
+        # The font lives in pyxel itself, so this works without a window.
+        width = pyxel.FONT_WIDTH * len(FONT_CHARS)
+        image = pyxel.Image(width, pyxel.FONT_HEIGHT)
+        image.text(0, 0, FONT_CHARS, 1)
+        atlas = CanvasBuffer(image, width, pyxel.FONT_HEIGHT).read() != 0
+
+        # char -> (ink mask trimmed to the letter, advance width)
+        # Characters without any ink (apart from space) are left out, so
+        # only letters that really exist can be typed.
+        self.glyphs = {}
+        for i, char in enumerate(FONT_CHARS):
+            cell = atlas[:, i * pyxel.FONT_WIDTH:(i + 1) * pyxel.FONT_WIDTH]
+            columns = np.flatnonzero(cell.any(axis=0))
+            if char == " ":
+                self.glyphs[char] = (cell[:, :0], SPACE_WIDTH)
+            elif len(columns) > 0:
+                mask = cell[:, columns[0]:columns[-1] + 1]
+                self.glyphs[char] = (mask, mask.shape[1] + LETTER_SPACING)
+
+        # (text, scale) -> (sprite, x of each letter and of the end)
+        self.sprites = OrderedDict()
+
+    def has(self, char):
+        return char in self.glyphs
+
+    def layout(self, text, scale=1):
+        # The string as an ink mask, and where each letter starts
+        # (with one more entry for the end of the string)
+        key = (text, scale)
+        if key in self.sprites:
+            self.sprites.move_to_end(key)
+            return self.sprites[key]
+
+        positions = [0]
+        for char in text:
+            positions.append(positions[-1] + self.glyphs[char][1])
+
+        sprite = np.zeros((pyxel.FONT_HEIGHT, positions[-1]), dtype=bool)
+        for char, x in zip(text, positions):
+            mask = self.glyphs[char][0]
+            sprite[:, x:x + mask.shape[1]] = mask
+
+        # Scale up by repeating every pixel
+        sprite = sprite.repeat(scale, axis=0).repeat(scale, axis=1)
+        result = (sprite, [x * scale for x in positions])
+
+        self.sprites[key] = result
+        if len(self.sprites) > MAX_SPRITES:
+            self.sprites.popitem(last=False)
+        return result
@@ -0,0 +1,192 @@
+# Undo and redo history
+# Each step only remembers the 16x16 tiles of the canvas that changed.
+# Tiles are stored once per unique content and shared between steps,
+# so repeating the same change (or undoing back and forth) is cheap.
+# The canvas is a TileStore (see tiles.py), and so is the copy of it
+# that changes are spotted against, so neither costs memory for tiles
+# that were never painted.
+#
+# A big change (like a filter over a whole layer) can be committed as a
+# job (see jobs.py), a band of tiles at a time, so storing it is spread
+# over several frames too.
+import hashlib
+
+import numpy as np
+
+from dirty import TILE_SIZE
+from jobs import run_to_end, scaled
+
+# Default memory budget for stored tiles (4 MB is 16384 tiles). The
+# newest step is always kept, even when it is bigger than that.
+MAX_HISTORY_BYTES = 4 * 1024 * 1024
+
+# How many tiles commit_steps looks at (or forgets) between yields
+COMMIT_STEP_TILES = 512
+
+
+class History:
+    def __init__(self, store, max_bytes=MAX_HISTORY_BYTES, dirty=None):
+        # store is the live canvas TileStore that undo and redo write into
+        self.store = store
+        self.max_bytes = max_bytes
+
+        # With a DirtyTracker, commit only compares the tiles that were
+        # drawn on, and undo and redo report the tiles they change
+        self.dirty = dirty
+        if dirty is not None:
+            dirty.grid("history")
+
+        # Copy of the canvas as of the last commit, used to spot changes
+        self.last = store.copy()
+
+        # Unique tile contents: hash -> [tile bytes, number of users]
+        self.tiles = {}
+        self.tile_bytes = 0
+
+        # Each step is a list of (tile_y, tile_x, before hash, after hash)
+        self.undo_steps = []
+        self.redo_steps = []
+
+    def nbytes(self):
+        # Current memory footprint: stored tiles plus the comparison copy
+        return self.tile_bytes + self.last.nbytes()
+
+    def can_undo(self):
+        return len(self.undo_steps) > 0
+
+    def can_redo(self):
+        return len(self.redo_steps) > 0
+
+    def commit(self):
+        # Record everything that changed since the last commit as one step
+        return run_to_end(self.commit_steps())
+
+    def commit_steps(self, step_tiles=COMMIT_STEP_TILES):
+        # commit as a job: yields how far along it is after every
+        # step_tiles tiles looked at, and returns whether anything changed.
+        # Nothing else should change the canvas until it is done.
+        if self.dirty is None:
+            candidates = np.ones_like(self.store.stored)
+        else:
+            candidates = self.dirty.take("history")
+
+        # Only tiles with paint on them now or at the last commit can have
+        # changed
+        candidates &= self.store.stored | self.last.stored
+        tile_ys, tile_xs = np.nonzero(candidates)
+
+        step = []
+        done = 0
+        try:
+            while done < len(tile_ys):
+                ys = tile_ys[done:done + step_tiles]
+                xs = tile_xs[done:done + step_tiles]
+                before = self.last.get_tiles(ys, xs)
+                after = self.store.get_tiles(ys, xs)
+                changed = (before != after).any(axis=(1, 2))
+                ys, xs, before, after = ys[changed], xs[changed], before[changed], after[changed]
+                step += [
+                    (tile_y, tile_x, self.store_tile(old), self.store_tile(new))
+                    for tile_y, tile_x, old, new in zip(ys.tolist(), xs.tolist(), before, after)
+                ]
+                self.last.set_tiles(ys, xs, after)
+                done += len(changed)
+                yield done / len(tile_ys)
+        except GeneratorExit:
+            # Stopped part way (see JobRunner.cancel): what was stored so
+            # far is still one step, and the rest is left for the next
+            # commit
+            if self.dirty is not None:
+                left = np.zeros_like(candidates)
+                left[tile_ys[done:], tile_xs[done:]] = True
+                self.dirty.mark_tiles(left, only="history")
+            if step:
+                run_to_end(self.add_step_steps(step, step_tiles))
+            raise
+
+        if not step:
+            return False
+        # (how far along it is stays at the end while old steps go)
+        yield from scaled(self.add_step_steps(step, step_tiles), 1, 1)
+        return True
+
+    def add_step_steps(self, step, step_tiles):
+        # Add a step to undo, as a job that forgets old steps step_tiles
+        # tiles at a time if there are too many
+        self.undo_steps.append(step)
+
+        # A new change makes the redo steps unreachable
+        for old_step in self.redo_steps:
+            self.release_step(old_step)
+        self.redo_steps = []
+
+        yield from self.trim_steps(step_tiles)
+
+    def undo(self):
+        if not self.undo_steps:
+            return False
+        step = self.undo_steps.pop()
+        self.apply_step(step, 2)
+        self.redo_steps.append(step)
+        return True
+
+    def redo(self):
+        if not self.redo_steps:
+            return False
+        step = self.redo_steps.pop()
+        self.apply_step(step, 3)
+        self.undo_steps.append(step)
+        return True
+
+    def apply_step(self, step, which):
+        # Write either the before (2) or after (3) tiles of a step back
+        tile_ys = [entry[0] for entry in step]
+        tile_xs = [entry[1] for entry in step]
+        tiles = np.array(
+            [np.frombuffer(self.tiles[entry[which]][0], dtype=np.uint8) for entry in step]
+        ).reshape(-1, TILE_SIZE, TILE_SIZE)
+        self.store.set_tiles(tile_ys, tile_xs, tiles)
+        self.last.set_tiles(tile_ys, tile_xs, tiles)
+        if self.dirty is not None:
+            for tile_y, tile_x in zip(tile_ys, tile_xs):
+                self.dirty.mark(tile_x * TILE_SIZE, tile_y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+
+    def store_tile(self, tile):
+        # Tiles are never changed after they are stored, so steps with
+        # the same tile content can all share one copy
+        data = tile.tobytes()
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        stored = self.tiles.get(key)
+        if stored is None:
+            self.tiles[key] = [data, 1]
+            self.tile_bytes += len(data)
+        else:
+            stored[1] += 1
+        return key
+
+    def release_step(self, entries):
+        # Let go of the tiles of a step (or of some of its entries)
+        for entry in entries:
+            for key in (entry[2], entry[3]):
+                stored = self.tiles[key]
+                stored[1] -= 1
+                if stored[1] == 0:
+                    self.tile_bytes -= len(stored[0])
+                    del self.tiles[key]
+
+    def trim_steps(self, step_tiles):
+        # Forget the oldest steps until the stored tiles fit the budget,
+        # but keep the newest one whatever its size, so the last change
+        # can always be undone. A job that lets go of step_tiles entries
+        # at a time.
+        while self.tile_bytes > self.max_bytes and len(self.undo_steps) > 1:
+            step = self.undo_steps.pop(0)
+            done = 0
+            try:
+                while done < len(step):
+                    self.release_step(step[done:done + step_tiles])
+                    done += step_tiles
+                    yield min(done, len(step)) / len(step)
+            finally:
+                # The rest of the step goes at once if stopped part way
+                self.release_step(step[done:])
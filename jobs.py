@@ -0,0 +1,110 @@
+# Background jobs
+# Big canvas operations (filters, fills) run a little at a time, a few
+# milliseconds per frame, so the window keeps drawing and reacting to
+# input while they work. No threads are needed.
+#
+# A job is a generator that does a slice of work (like one band of rows)
+# between each yield, yields how far along it is (0 to 1) and finally
+# returns its result. The result is only handed to the job's finish
+# function at the very end, so the canvas never shows half a filter.
+import time
+from collections import deque
+
+# Milliseconds of job work per frame
+JOB_BUDGET_MS = 8
+
+
+class Job:
+    def __init__(self, name, start, finish):
+        # start() makes the generator. It is only called when the job's
+        # turn comes, so it sees the canvas as the jobs before it left it.
+        self.name = name
+        self.start = start
+        self.finish = finish
+        self.steps = None
+        self.progress = 0.0
+
+
+def untimed(name, function, *args):
+    return function(*args)
+
+
+class JobRunner:
+    def __init__(self, budget_ms=JOB_BUDGET_MS, timed=untimed):
+        # timed(name, function, *args) runs each slice of work, so a
+        # profiler can time it under "job " and the job's name
+        self.budget_ms = budget_ms
+        self.timed = timed
+        self.jobs = deque()
+
+    def add(self, name, start, finish):
+        job = Job(name, start, finish)
+        self.jobs.append(job)
+        return job
+
+    def busy(self):
+        return len(self.jobs) > 0
+
+    def progress(self):
+        # How far along the current job is, from 0 to 1
+        return self.jobs[0].progress if self.jobs else 0.0
+
+    def cancel(self):
+        # Drop every job. Nothing they did shows up on the canvas. Jobs
+        # that started are closed, so they can tidy up after themselves.
+        for job in self.jobs:
+            if job.steps is not None:
+                job.steps.close()
+        self.jobs.clear()
+
+    def run(self, budget_ms=None, steps=None):
+        # Work on the jobs, in order, until this frame's time is used up
+        # (or, with steps, for exactly that many slices of work, so a
+        # replay does the same work each frame as the recording).
+        # Returns how many slices were done.
+        if budget_ms is None:
+            budget_ms = self.budget_ms
+        end = time.perf_counter() + budget_ms / 1000
+        done_steps = 0
+        while self.jobs and done_steps != steps:
+            job = self.jobs[0]
+            try:
+                job.progress = self.timed("job " + job.name, self.step, job)
+            except StopIteration as done:
+                self.jobs.popleft()
+                job.progress = 1.0
+                job.finish(done.value)
+            done_steps += 1
+            if steps is None and time.perf_counter() >= end:
+                break
+        return done_steps
+
+    def step(self, job):
+        # One slice of a job's work
+        if job.steps is None:
+            job.steps = job.start()
+        return next(job.steps)
+
+    def finish_all(self):
+        # Run every job to the end right now
+        self.run(budget_ms=float("inf"))
+
+
+def scaled(steps, start, end):
+    # Run a part of a job: progress from 0 to 1 in the part becomes
+    # start to end for the whole job
+    while True:
+        try:
+            progress = next(steps)
+        except StopIteration as done:
+            return done.value
+        yield start + (end - start) * progress
+
+
+def run_to_end(steps):
+    # Run a job's generator in one go and return its result
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
@@ -0,0 +1,110 @@
+# Layers
+# The drawing is made of a few layers, put one over the other from the
+# first to the last. Color 0 is see-through on every layer: wherever a
+# layer has color 0, the layers under it show. Hidden layers are left out.
+#
+# All the layers live in one tall picture, one under the other, so the
+# undo history, the autosave and saved drawings see them as a single
+# picture. The picture is kept as sparse tiles (see tiles.py): only the
+# tiles that were painted on take up memory. Each layer is drawn on
+# through its own TileCanvas, which keeps the drawing inside that layer.
+#
+# What the screen shows (and what is exported) is the flat picture, with
+# the layers put together. It is kept as sparse tiles too, and only the
+# tiles that changed on some layer since last time are put together again,
+# so painting on one layer costs about the same however many layers there
+# are.
+import numpy as np
+
+from dirty import TILE_SIZE, DirtyTracker
+from tiles import SCRATCH_SIZE, TileCanvas, TileStore
+
+LAYER_COUNT = 4
+
+
+class Layers:
+    def __init__(self, backend, width, height, count=LAYER_COUNT, dirty=None):
+        # dirty is an optional DirtyTracker for the flat picture, which
+        # hears about every tile that was put together again
+        self.width = width
+        self.height = height
+        self.count = count
+
+        # Every layer starts on a whole tile, so no tile has two layers in it
+        self.stride = -(-height // TILE_SIZE) * TILE_SIZE
+
+        # Which tiles of which layers changed, for the undo history, the
+        # autosave and the flat picture
+        self.dirty = DirtyTracker(width, self.stride * count)
+        self.dirty.grid("flat")
+
+        # All the layers, one under the other, and the flat picture. The
+        # canvases share one scratch image to draw shapes on.
+        self.store = TileStore(width, self.stride * count)
+        scratch = backend.new_image(SCRATCH_SIZE, SCRATCH_SIZE)
+        self.buffers = [
+            TileCanvas(self.store, scratch, width, height, self.dirty, top=i * self.stride)
+            for i in range(count)
+        ]
+        self.visible = [True] * count
+        self.flat = TileCanvas(TileStore(width, height), scratch, width, height, dirty)
+
+    def nbytes(self):
+        # Memory used by the tiles of the layers and the flat picture
+        return self.store.nbytes() + self.flat.store.nbytes()
+
+    def read(self):
+        # A copy of every layer at once (one under the other)
+        return self.store.read()
+
+    def write(self, pixels):
+        # Replace every layer at once (stacked like read returns them). A
+        # smaller picture goes in the top-left corner and the rest is
+        # cleared.
+        height = min(pixels.shape[0], self.store.height)
+        width = min(pixels.shape[1], self.store.width)
+        self.store.clear()
+        self.store.write(pixels[:height, :width])
+        self.dirty.mark_all()
+
+    def toggle(self, index):
+        # Show or hide a layer. The layer itself didn't change, so only the
+        # flat picture hears about it (not the undo history or autosave).
+        self.visible[index] = not self.visible[index]
+        self.dirty.mark(0, index * self.stride, self.width, self.height, only="flat")
+
+    def flatten(self):
+        # Put the layers together again wherever one of them changed
+        rows = -(-self.height // TILE_SIZE)
+        tiles = self.dirty.take("flat").reshape(self.count, -1, self.flat.store.cols)
+        tiles = tiles[:, :rows].any(axis=0)
+
+        # Tiles that no layer has paint on, and that are empty in the flat
+        # picture already, stay empty
+        stored = self.store.stored.reshape(self.count, -1, self.flat.store.cols)
+        tiles &= stored[:, :rows].any(axis=0) | self.flat.store.stored
+        tile_ys, tile_xs = np.nonzero(tiles)
+        if len(tile_ys) == 0:
+            return
+
+        # The lowest layer with paint goes down as it is (there is nothing
+        # under it), then every layer above it where it isn't 0. Layers
+        # only look at the tiles they have paint on.
+        flat = np.zeros((len(tile_ys), TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+        bottom = True
+        for i in range(self.count):
+            layer_ys = tile_ys + i * self.stride // TILE_SIZE
+            painted = self.store.stored[layer_ys, tile_xs]
+            if not self.visible[i] or not painted.any():
+                continue
+            layer = self.store.get_tiles(layer_ys[painted], tile_xs[painted])
+            if bottom:
+                flat[painted] = layer
+                bottom = False
+            else:
+                under = flat[painted]
+                np.copyto(under, layer, where=layer != 0)
+                flat[painted] = under
+        self.flat.store.set_tiles(tile_ys, tile_xs, flat)
+        if self.flat.dirty is not None:
+            self.flat.dirty.mark_tiles(tiles)
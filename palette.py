@@ -0,0 +1,63 @@
+# Palette remaps
+# A color filter like invert or grayscale only depends on each pixel's
+# color, so it can be written as a table of 16 entries: the new color for
+# each of the 16 pyxel colors. Looking the whole canvas up in the table
+# is one numpy operation, and several remaps in a row can be combined
+# into a single table first, so the canvas is only touched once.
+import numpy as np
+
+# The table that leaves every color as it is
+IDENTITY = np.arange(16, dtype=np.uint8)
+
+# Remaps by name
+REMAPS = {}
+
+
+def make_remap(mapping):
+    # Turn a list of 16 colors, or a dict of {old color: new color}
+    # (colors not in it stay the same), into a remap table
+    if isinstance(mapping, dict):
+        table = IDENTITY.copy()
+        for old, new in mapping.items():
+            table[old] = new
+    else:
+        table = np.array(mapping, dtype=np.uint8)
+
+    if table.shape != (16,) or table.max() > 15:
+        raise ValueError("a remap needs a new color (0-15) for each of the 16 colors")
+    return table
+
+
+def register_remap(name, mapping):
+    # Add a named remap that "remap" filters (see registry.py) and compose
+    # can use
+    table = make_remap(mapping)
+    REMAPS[name] = table
+    return table
+
+
+def get_remap(remap):
+    # A remap can be given by name or as a table
+    if isinstance(remap, str):
+        return REMAPS[remap]
+    return make_remap(remap)
+
+
+def compose(*remaps):
+    # One table that does the same as applying the remaps in order
+    table = IDENTITY
+    for remap in remaps:
+        table = get_remap(remap)[table]
+    return table
+
+
+def swap_colors(a, b):
+    # A remap that swaps two colors
+    return make_remap({a: b, b: a})
+
+
+# Invert every color except transparent (color 0)
+register_remap("invert", [0] + [15 - color for color in range(1, 16)])
+
+# A simplified grayscale - could be improved with actual luminance values
+register_remap("grayscale", [0, 5, 5, 6, 5, 5, 6, 7, 5, 6, 5, 6, 6, 7, 13, 7])
@@ -0,0 +1,204 @@
+# Frame profiler
+# Times update, draw and every tool, filter, brush and toolbar method,
+# shows the numbers in a small overlay and saves them as a trace file
+# that chrome://tracing or https://ui.perfetto.dev can open.
+#
+# While it is off the app's methods are left untouched, so it costs nothing.
+# Turning it on wraps each method on the app object with a timed version.
+#
+# Some work doesn't go through those methods: the slices of background
+# jobs (see jobs.py) and the kernels of registered filters and brushes
+# (see registry.py). Whoever runs them passes them through timed (or
+# timed_steps for a generator), which times them under their own name
+# while the profiler is on and just calls them while it is off.
+import json
+import time
+from collections import deque
+
+# Methods that get timed (plus every filter_* and draw_* method)
+PROFILED_METHODS = (
+    "update",
+    "draw",
+    "apply_filter",
+    "apply_algo_brush",
+    "stamp_image",
+    "place_char",
+    "update_brush_icons",
+    "update_toolbar",
+)
+PROFILED_PREFIXES = ("filter_", "draw_")
+
+# How many frames the overlay numbers are taken over
+OVERLAY_FRAMES = 120
+
+# Where dump_trace writes the trace by default
+TRACE_FILE = "bunny-pyx-trace.json"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class Profiler:
+    def __init__(self, app, max_events=200000):
+        self.app = app
+        self.enabled = False
+
+        # Trace events, oldest dropped first once the limit is reached
+        self.events = deque(maxlen=max_events)
+
+        # Time between frame starts, and time spent per method in each frame
+        self.frame_times = deque(maxlen=OVERLAY_FRAMES)
+        self.frame_costs = deque(maxlen=OVERLAY_FRAMES)
+        self.costs = {}
+        self.frame_start = None
+        self.origin = time.perf_counter()
+
+    def method_names(self):
+        names = []
+        for name in dir(type(self.app)):
+            if name in PROFILED_METHODS or name.startswith(PROFILED_PREFIXES):
+                if callable(getattr(self.app, name)):
+                    names.append(name)
+        return names
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.frame_start = None
+        for name in self.method_names():
+            setattr(self.app, name, self.wrap(name, getattr(self.app, name)))
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        # Removing the wrappers brings back the class methods
+        for name in self.method_names():
+            self.app.__dict__.pop(name, None)
+
+    def wrap(self, name, method):
+        def timed(*args, **kwargs):
+            if name == "update":
+                self.start_frame()
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter())
+                if name == "draw":
+                    self.draw_overlay()
+
+        return timed
+
+    def timed(self, name, function, *args):
+        # Call function(*args), timing it under name
+        if not self.enabled:
+            return function(*args)
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def timed_steps(self, name, steps):
+        # A generator that runs steps, timing every step under name (a
+        # generator does its work as it is stepped, not when it is made)
+        while True:
+            try:
+                value = self.timed(name, next, steps)
+            except StopIteration as done:
+                return done.value
+            yield value
+
+    def start_frame(self):
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.frame_times.append((now - self.frame_start) * 1000)
+            self.frame_costs.append(self.costs)
+        self.costs = {}
+        self.frame_start = now
+
+    def record(self, name, start, end):
+        duration = (end - start) * 1000
+        self.costs[name] = self.costs.get(name, 0.0) + duration
+        self.events.append((name, start, end))
+
+    def stats(self):
+        # FPS, frame time percentiles and the average cost of each method
+        times = sorted(self.frame_times)
+        total = sum(times)
+        fps = len(times) * 1000 / total if total > 0 else 0.0
+
+        averages = {}
+        for costs in self.frame_costs:
+            for name, ms in costs.items():
+                averages[name] = averages.get(name, 0.0) + ms
+        frames = max(1, len(self.frame_costs))
+        for name in averages:
+            averages[name] /= frames
+
+        return {
+            "fps": fps,
+            "p50": percentile(times, 0.50),
+            "p95": percentile(times, 0.95),
+            "p99": percentile(times, 0.99),
+            "costs": averages,
+        }
+
+    def draw_overlay(self):
+        stats = self.stats()
+        costs = stats["costs"]
+        top = sorted(
+            (name for name in costs if name not in ("update", "draw")),
+            key=costs.get,
+            reverse=True,
+        )[:4]
+
+        lines = [
+            "FPS %.1f" % stats["fps"],
+            "FRAME p50 %.1f p95 %.1f p99 %.1f" % (stats["p50"], stats["p95"], stats["p99"]),
+            "UPDATE %.2f DRAW %.2f" % (costs.get("update", 0.0), costs.get("draw", 0.0)),
+        ]
+        lines += ["%s %.2f" % (name, costs[name]) for name in top]
+
+        backend = self.app.backend
+        backend.rect(0, 0, 136, len(lines) * 7 + 2, 0)
+
+        # The app redraws the canvas under the overlay next frame
+        self.app.overlay_rects.append((0, 0, 136, len(lines) * 7 + 2))
+        for i, line in enumerate(lines):
+            backend.text(2, 2 + i * 7, line, 7 if i < 3 else 10)
+
+    def trace(self):
+        # Chrome trace event format: complete events with times in microseconds
+        return {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "cat": "bunny-pyx",
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": 1,
+                    "tid": 1,
+                }
+                for name, start, end in self.events
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def dump_trace(self, filename=TRACE_FILE):
+        with open(filename, "w") as f:
+            json.dump(self.trace(), f)
+        return filename
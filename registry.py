@@ -0,0 +1,129 @@
+# Filters and algorithmic brushes
+# Every filter and algorithmic brush is registered here by name, with
+# everything Bunny Pyx needs to know about it: how to run it, its icon,
+# its preview and how costly it is. The toolbar shows them in the order
+# they were registered, and the app finds the selected one by its number
+# in that order, without going through a list of ifs.
+#
+# Registering a name again replaces that entry (in the same place), so a
+# plugin can swap out a built-in filter or brush.
+#
+# Plugins are Python files in the plugins folder next to bunny-pyx.py.
+# They are run when Bunny Pyx starts and register their own kernels:
+#
+#   from registry import register_filter
+#
+#   def stripes_rows(app, pixels, y1, y2):
+#       band = pixels[y1:y2].copy()
+#       band[::2] = 0
+#       return band
+#
+#   register_filter("stripes", "rows", stripes_rows, cost=0.05)
+#
+# Kernel functions get the app as their first argument, so they can read
+# its settings (and built-in ones are simply BunnyPyx methods). The app
+# calls them through its profiler, which times them as "filter" or
+# "brush" and their name.
+import importlib.util
+import os
+
+# Placeholder icon (x, y) in the resource file
+DEFAULT_ICON = (0, 16)
+
+# Filters and brushes by name, in toolbar order
+FILTERS = {}
+BRUSHES = {}
+
+
+class Filter:
+    # kind is how the filter works, which is also a cost hint:
+    #   "remap" - kernel is a palette remap (a name from palette.py or a
+    #             16-color table); vectorized, and fused with its
+    #             neighbours into one pass
+    #   "map"   - kernel(app, pixels, y1, y2) returns rows y1 to y2 of the
+    #             pixels moved around, without looking at their colors;
+    #             vectorized through a cached gather map (see gather.py,
+    #             built a band of rows at a time) and fused like remaps
+    #   "rows"  - kernel(app, pixels, y1, y2) returns rows y1 to y2 of the
+    #             filtered pixels; run on its own, a band of rows at a time
+    #   "bands" - kernel(app, pixels, rows) yields the filtered pixels, rows
+    #             rows at a time from the top; like "rows", but it can keep
+    #             what it worked out for one band for the next ones (the
+    #             blur keeps its running counts)
+    # cost is about how much work a pixel is, compared to the blur (1).
+    # Cheap filters go through the canvas in bigger bands.
+    # The optional functions all take the app:
+    #   settings(app)     - anything the result depends on besides the canvas
+    #   align(app)        - bands must be a multiple of this many rows
+    #   label(app)        - short text shown on the icon
+    #   adjust(app, step) - what [ and ] do
+    def __init__(
+        self, name, kind, kernel, icon=DEFAULT_ICON, cost=1.0,
+        settings=None, align=None, label=None, adjust=None,
+    ):
+        if kind not in ("remap", "map", "rows", "bands"):
+            raise ValueError("unknown filter kind %r" % kind)
+        self.name = name
+        self.kind = kind
+        self.kernel = kernel
+        self.icon = icon
+        self.cost = cost
+        self.settings = settings
+        self.align = align
+        self.label = label
+        self.adjust = adjust
+
+
+class Brush:
+    # kind is how the brush draws, which is also a cost hint:
+    #   "sprite"     - the same picture for the same state, so it is drawn
+    #                  once into the sprite cache and copied after that.
+    #                  render(app, target, x, y) draws it centered on x, y
+    #                  and state(app) returns (key, colors): what the
+    #                  picture depends on and the colors it uses.
+    #   "primitives" - draw(app, x, y, old_x, old_y) draws lines, circles
+    #                  and so on right onto the canvas every time (for
+    #                  random or path-following brushes)
+    # preview(app, x, y) draws a small hint at the cursor on the screen.
+    def __init__(
+        self, name, kind, icon=DEFAULT_ICON, preview=None,
+        draw=None, render=None, state=None,
+    ):
+        if kind not in ("sprite", "primitives"):
+            raise ValueError("unknown brush kind %r" % kind)
+        if kind == "sprite" and (render is None or state is None):
+            raise ValueError("a sprite brush needs render and state")
+        if kind == "primitives" and draw is None:
+            raise ValueError("a primitives brush needs draw")
+        self.name = name
+        self.kind = kind
+        self.icon = icon
+        self.preview = preview
+        self.draw = draw
+        self.render = render
+        self.state = state
+
+
+def register_filter(name, kind, kernel, **options):
+    # Add a filter (see Filter for the options). Returns its number.
+    FILTERS[name] = Filter(name, kind, kernel, **options)
+    return list(FILTERS).index(name)
+
+
+def register_brush(name, kind, **options):
+    # Add an algorithmic brush (see Brush for the options). Returns its number.
+    BRUSHES[name] = Brush(name, kind, **options)
+    return list(BRUSHES).index(name)
+
+
+def load_plugins(folder):
+    # Run every .py file in the folder, in name order
+    if not os.path.isdir(folder):
+        return
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith(".py"):
+            continue
+        name = "bunny_pyx_plugin_" + filename[:-3]
+        spec = importlib.util.spec_from_file_location(name, os.path.join(folder, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
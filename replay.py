@@ -0,0 +1,332 @@
+# Recording and replaying drawing sessions
+# RecordingBackend wraps a backend and writes down, frame by frame,
+# everything Bunny Pyx asks it about the outside world: where the mouse
+# is, which keys and buttons it asked about were down, pressed or
+# released, and how many slices of filter and fill work got done.
+# Random numbers come from a generator that is seeded again at the start
+# of every frame, so they are the same in a replay.
+#
+# ReplayBackend wraps a backend the same way and answers those questions
+# from a recording instead, so the same tool code makes the same canvas.
+#
+#   python bunny-pyx.py --record session.bpxr    # record while drawing
+#   python replay.py session.bpxr                # replay headless, fast
+#   python replay.py session.bpxr --window       # watch it in a window
+#
+# A replay makes exactly the same canvas when it runs on the same kind of
+# backend as the recording: the window for a session drawn in the window
+# (--window, sped up with --speed), the headless backend for one recorded
+# headless. The headless images draw some big circles a pixel different
+# from pyxel, so a headless replay of a window session can be a little off.
+# Files loaded with Ctrl+O are read again when the replay gets there.
+#
+# The file is "BPYR", a version byte and the random seed, then one
+# zlib-compressed stream of frames:
+#   mouse x, mouse y, mouse wheel (2 bytes each), frame count and job
+#   steps (4 bytes each), then how many keys are held, pressed, pressed
+#   again by key repeat and released (1 byte each), followed by the keys
+#   (4 bytes each)
+import argparse
+import importlib.util
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+
+from backend import HeadlessBackend, PyxelBackend
+from storage import save_drawing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MAGIC = b"BPYR"
+VERSION = 1
+HEADER = struct.Struct("<4sBI")
+FRAME = struct.Struct("<hhhII4B")
+
+
+class Frame:
+    # What the app saw of the outside world during one frame
+    def __init__(self, mouse_x=0, mouse_y=0, mouse_wheel=0, frame_count=0):
+        self.mouse_x = mouse_x
+        self.mouse_y = mouse_y
+        self.mouse_wheel = mouse_wheel
+        self.frame_count = frame_count
+        self.job_steps = 0
+        self.held = set()
+        self.pressed = set()
+        self.repeated = set()
+        self.released = set()
+
+    def to_bytes(self):
+        keys = (self.held, self.pressed, self.repeated, self.released)
+        data = FRAME.pack(
+            self.mouse_x,
+            self.mouse_y,
+            self.mouse_wheel,
+            self.frame_count,
+            self.job_steps,
+            *(len(k) for k in keys),
+        )
+        for k in keys:
+            data += struct.pack("<%dI" % len(k), *sorted(k))
+        return data
+
+
+def seed_frame(generator, seed, frame):
+    # Every frame gets its own random numbers, worked out from the
+    # recording's seed and the frame number
+    generator.seed("%d:%d" % (seed, frame))
+
+
+class RecordingBackend:
+    def __init__(self, backend, filename, seed=None):
+        self.backend = backend
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.random = random.Random()
+        self.frames = 0
+        self.frame = Frame()
+
+        self.file = open(filename, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.seed))
+        self.compressor = zlib.compressobj(6)
+
+    def __getattr__(self, name):
+        # Drawing, images, sound and so on go straight to the real backend
+        return getattr(self.backend, name)
+
+    def run(self, update, draw):
+        def recorded_update():
+            backend = self.backend
+            self.frame = Frame(
+                backend.mouse_x, backend.mouse_y, backend.mouse_wheel, backend.frame_count
+            )
+            seed_frame(self.random, self.seed, self.frames)
+            update()
+            self.write_frame()
+
+        self.backend.run(recorded_update, draw)
+
+    def write_frame(self):
+        # Sync-flushed every frame, so the recording is readable up to the
+        # last frame even if the window is closed without quitting
+        if self.file.closed:
+            return
+        data = self.compressor.compress(self.frame.to_bytes())
+        self.file.write(data + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.file.flush()
+        self.frames += 1
+
+    def quit(self):
+        self.write_frame()
+        self.file.write(self.compressor.flush())
+        self.file.close()
+        self.backend.quit()
+
+    # Input state, written down as it is asked for
+    def btn(self, key):
+        down = self.backend.btn(key)
+        if down:
+            self.frame.held.add(key)
+        return down
+
+    def btnp(self, key, hold=0, repeat=0):
+        pressed = self.backend.btnp(key, hold=hold, repeat=repeat)
+        if pressed:
+            if hold or repeat:
+                self.frame.repeated.add(key)
+            else:
+                self.frame.pressed.add(key)
+        return pressed
+
+    def btnr(self, key):
+        released = self.backend.btnr(key)
+        if released:
+            self.frame.released.add(key)
+        return released
+
+    @property
+    def mouse_x(self):
+        return self.frame.mouse_x
+
+    @property
+    def mouse_y(self):
+        return self.frame.mouse_y
+
+    @property
+    def mouse_wheel(self):
+        return self.frame.mouse_wheel
+
+    @property
+    def frame_count(self):
+        return self.frame.frame_count
+
+    def rndi(self, a, b):
+        return self.random.randint(min(a, b), max(a, b))
+
+    def run_jobs(self, jobs):
+        self.frame.job_steps = self.backend.run_jobs(jobs)
+        return self.frame.job_steps
+
+
+def load_recording(filename):
+    # Returns (seed, frames). A recording cut short ends at its last
+    # whole frame.
+    with open(filename, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError("not a Bunny Pyx recording: file is too short")
+    magic, version, seed = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a Bunny Pyx recording")
+    if version != VERSION:
+        raise ValueError("unknown Bunny Pyx recording version %d" % version)
+
+    try:
+        stream = zlib.decompressobj().decompress(data[HEADER.size:])
+    except zlib.error:
+        raise ValueError("damaged Bunny Pyx recording")
+
+    frames = []
+    offset = 0
+    while offset + FRAME.size <= len(stream):
+        values = FRAME.unpack_from(stream, offset)
+        frame = Frame(*values[:4])
+        frame.job_steps = values[4]
+        counts = values[5:]
+        if offset + FRAME.size + sum(counts) * 4 > len(stream):
+            break
+        offset += FRAME.size
+        for keys, count in zip(
+            (frame.held, frame.pressed, frame.repeated, frame.released), counts
+        ):
+            keys.update(struct.unpack_from("<%dI" % count, stream, offset))
+            offset += count * 4
+        frames.append(frame)
+    return seed, frames
+
+
+class ReplayBackend:
+    def __init__(self, backend, filename, speed=1):
+        # speed is how many recorded frames are played per frame drawn
+        self.backend = backend
+        self.seed, self.frames = load_recording(filename)
+        self.speed = speed
+        self.random = random.Random()
+        self.position = 0
+        self.frame = Frame()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def done(self):
+        return self.position >= len(self.frames)
+
+    def run(self, update, draw):
+        def replayed_update():
+            for _ in range(self.speed):
+                if self.done():
+                    break
+                self.frame = self.frames[self.position]
+                seed_frame(self.random, self.seed, self.position)
+                self.position += 1
+                update()
+
+        self.backend.run(replayed_update, draw)
+
+    # Input state, from the recording
+    def btn(self, key):
+        return key in self.frame.held
+
+    def btnp(self, key, hold=0, repeat=0):
+        if hold or repeat:
+            return key in self.frame.repeated
+        return key in self.frame.pressed
+
+    def btnr(self, key):
+        return key in self.frame.released
+
+    @property
+    def mouse_x(self):
+        return self.frame.mouse_x
+
+    @property
+    def mouse_y(self):
+        return self.frame.mouse_y
+
+    @property
+    def mouse_wheel(self):
+        return self.frame.mouse_wheel
+
+    @property
+    def frame_count(self):
+        return self.frame.frame_count
+
+    def rndi(self, a, b):
+        return self.random.randint(min(a, b), max(a, b))
+
+    def run_jobs(self, jobs):
+        return jobs.run(steps=self.frame.job_steps)
+
+
+def load_bunny_pyx():
+    # bunny-pyx.py has a dash in its name, so it is loaded by path
+    spec = importlib.util.spec_from_file_location(
+        "bunny_pyx", os.path.join(HERE, "bunny-pyx.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def replay_headless(filename):
+    # Play a recording as fast as possible, without drawing any frames.
+    # Returns the app and how long each frame's update took (in ms).
+    bunny_pyx = load_bunny_pyx()
+    headless = HeadlessBackend()
+    backend = ReplayBackend(headless, filename)
+    app = bunny_pyx.BunnyPyx(backend)
+
+    times = []
+    while not backend.done() and headless.running:
+        start = time.perf_counter()
+        headless.step(draw=False)
+        times.append((time.perf_counter() - start) * 1000)
+    return app, times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded Bunny Pyx session")
+    parser.add_argument("recording")
+    parser.add_argument("--window", action="store_true", help="replay in a pyxel window")
+    parser.add_argument(
+        "--speed", type=int, default=1, help="recorded frames per frame shown (--window)"
+    )
+    parser.add_argument("--save", help="save the final drawing to this .bpx file")
+    args = parser.parse_args(argv)
+
+    if args.window:
+        bunny_pyx = load_bunny_pyx()
+        bunny_pyx.BunnyPyx(ReplayBackend(PyxelBackend(), args.recording, args.speed))
+        return
+
+    try:
+        app, times = replay_headless(args.recording)
+    except (OSError, ValueError) as error:
+        sys.exit("replay.py: %s" % error)
+
+    total = sum(times)
+    times.sort()
+    print("%d frames in %.1f ms" % (len(times), total))
+    if times:
+        print(
+            "update  median %.3f  p95 %.3f  max %.3f ms"
+            % (times[len(times) // 2], times[int(len(times) * 0.95)], times[-1])
+        )
+    if args.save:
+        save_drawing(args.save, app.layers.read(), app.backend.colors())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# Saving and loading drawings
+# Drawings are saved in Bunny Pyx's own compact format:
+#
+#   header   "BPYX", version (1 byte), width and height (4 bytes each)
+#   palette  the 16 colors as red, green, blue bytes
+#   body     zlib-compressed tiles (see below)
+#
+# The canvas is cut into 16x16 tiles. A tile that is all one color (like
+# the empty background) is stored as just that color; other tiles are
+# stored with two pixels per byte (16 colors fit in 4 bits). The body is
+# one byte per tile (the color, or 16 for a packed tile) followed by the
+# packed tiles in order.
+#
+# Drawings can also be exported as PNG files. The PNG is written a band of
+# rows at a time, with the 16 colors as its palette, so even a huge
+# canvas is never turned into one big RGB picture in memory.
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"BPYX"
+VERSION = 1
+HEADER = struct.Struct("<4sBII")
+
+# Tiles are TILE x TILE pixels
+TILE = 16
+PACKED_TILE = 16
+
+# Rows of the PNG packed and compressed at a time
+PNG_BAND_ROWS = 64
+
+
+def pack_nibbles(pixels):
+    # Two 4-bit colors per byte, first one in the high bits. The last
+    # axis must have an even length.
+    return (pixels[..., 0::2] << 4) | pixels[..., 1::2]
+
+
+def unpack_nibbles(packed):
+    pixels = np.empty(packed.shape[:-1] + (packed.shape[-1] * 2,), dtype=np.uint8)
+    pixels[..., 0::2] = packed >> 4
+    pixels[..., 1::2] = packed & 15
+    return pixels
+
+
+def save_drawing(filename, pixels, colors):
+    # Save a (height, width) array of colors and the 16 palette colors
+    # (as 0xRRGGBB numbers)
+    with open(filename, "wb") as f:
+        f.write(drawing_bytes(pixels, colors))
+
+
+def drawing_bytes(pixels, colors):
+    # A drawing file's contents, as bytes
+    height, width = pixels.shape
+    rows = -(-height // TILE)
+    cols = -(-width // TILE)
+
+    # Cut the canvas (grown to whole tiles) into one row of pixels per tile
+    padded = np.zeros((rows * TILE, cols * TILE), dtype=np.uint8)
+    padded[:height, :width] = pixels
+    tiles = padded.reshape(rows, TILE, cols, TILE).transpose(0, 2, 1, 3)
+    tiles = tiles.reshape(rows * cols, TILE * TILE)
+
+    solid = (tiles == tiles[:, :1]).all(axis=1)
+    kinds = np.where(solid, tiles[:, 0], PACKED_TILE).astype(np.uint8)
+    packed = pack_nibbles(tiles[~solid])
+
+    # Level 1 compresses nearly as well as the default on drawings and is
+    # a lot faster
+    body = zlib.compress(kinds.tobytes() + packed.tobytes(), 1)
+
+    palette = bytes(
+        channel
+        for color in colors
+        for channel in ((color >> 16) & 255, (color >> 8) & 255, color & 255)
+    )
+    return HEADER.pack(MAGIC, VERSION, width, height) + palette + body
+
+
+def load_drawing(filename):
+    # Read a drawing saved by save_drawing. Returns (pixels, colors).
+    with open(filename, "rb") as f:
+        return drawing_from_bytes(f.read())
+
+
+def drawing_from_bytes(data):
+    if len(data) < HEADER.size + 48:
+        raise ValueError("not a Bunny Pyx drawing: file is too short")
+    magic, version, width, height = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a Bunny Pyx drawing")
+    if version != VERSION:
+        raise ValueError("unknown Bunny Pyx drawing version %d" % version)
+
+    palette = data[HEADER.size:HEADER.size + 48]
+    colors = [
+        (palette[i] << 16) | (palette[i + 1] << 8) | palette[i + 2]
+        for i in range(0, 48, 3)
+    ]
+
+    rows = -(-height // TILE)
+    cols = -(-width // TILE)
+    try:
+        body = zlib.decompress(data[HEADER.size + 48:])
+    except zlib.error:
+        raise ValueError("damaged Bunny Pyx drawing")
+    body = np.frombuffer(body, dtype=np.uint8)
+    kinds = body[:rows * cols]
+    packed = body[rows * cols:]
+    if (
+        len(kinds) != rows * cols
+        or (kinds > PACKED_TILE).any()
+        or len(packed) != (kinds == PACKED_TILE).sum() * TILE * TILE // 2
+    ):
+        raise ValueError("damaged Bunny Pyx drawing")
+    packed = packed.reshape(-1, TILE * TILE // 2)
+
+    tiles = np.repeat(kinds[:, None], TILE * TILE, axis=1)
+    tiles[kinds == PACKED_TILE] = unpack_nibbles(packed)
+    pixels = tiles.reshape(rows, cols, TILE, TILE).transpose(0, 2, 1, 3)
+    pixels = pixels.reshape(rows * TILE, cols * TILE)[:height, :width]
+    return np.ascontiguousarray(pixels), colors
+
+
+def png_chunk(f, kind, data):
+    f.write(struct.pack(">I", len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+
+def export_png(filename, pixels, colors):
+    # Write the colors as a 4-bit palette PNG
+    height, width = pixels.shape
+    palette = b"".join(struct.pack(">I", color)[1:] for color in colors)
+
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 4, 3, 0, 0, 0))
+        png_chunk(f, b"PLTE", palette)
+
+        # Every row starts with a 0 (no filter), then two pixels per byte
+        compressor = zlib.compressobj(1)
+        for y1 in range(0, height, PNG_BAND_ROWS):
+            band = pixels[y1:y1 + PNG_BAND_ROWS]
+            if width % 2:
+                band = np.hstack([band, np.zeros((len(band), 1), dtype=np.uint8)])
+            rows = np.zeros((len(band), 1 + band.shape[1] // 2), dtype=np.uint8)
+            rows[:, 1:] = pack_nibbles(band)
+
+            compressed = compressor.compress(rows.tobytes())
+            if compressed:
+                png_chunk(f, b"IDAT", compressed)
+        png_chunk(f, b"IDAT", compressor.flush())
+        png_chunk(f, b"IEND", b"")
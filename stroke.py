@@ -0,0 +1,54 @@
+# Stroke spacing
+# Walks the path the mouse takes while dragging and hands out "dabs":
+# points spaced a fixed number of pixels apart along the path.
+# Tools like the stamp draw one copy per dab, so a stroke looks the same
+# whether the mouse moved fast or slow and however many frames it took.
+import math
+
+
+def round_half_away(value):
+    if value >= 0:
+        return int(math.floor(value + 0.5))
+    return -int(math.floor(-value + 0.5))
+
+
+class Stroke:
+    def __init__(self, spacing=8):
+        self.spacing = spacing
+
+        # Where the path has reached, and how far it has gone since the last dab
+        self.x = 0
+        self.y = 0
+        self.travelled = 0.0
+
+    def start(self, x, y, spacing=None):
+        # Begin a new stroke. The first dab is always where it starts.
+        if spacing is not None:
+            self.spacing = spacing
+        self.x = x
+        self.y = y
+        self.travelled = 0.0
+        return [(x, y)]
+
+    def move(self, x, y):
+        # Continue the stroke to (x, y) and return the dabs along the way
+        dx = x - self.x
+        dy = y - self.y
+        length = math.hypot(dx, dy)
+        if length == 0:
+            return []
+
+        dabs = []
+        distance = self.spacing - self.travelled
+        while distance <= length:
+            t = distance / length
+            dabs.append(
+                (round_half_away(self.x + dx * t), round_half_away(self.y + dy * t))
+            )
+            distance += self.spacing
+
+        # Whatever is left over counts towards the next dab
+        self.travelled = length - (distance - self.spacing)
+        self.x = x
+        self.y = y
+        return dabs
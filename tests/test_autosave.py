@@ -0,0 +1,135 @@
+# Tests for autosaving and getting the drawing back (autosave.py)
+#
+#   python -m pytest tests
+import numpy as np
+
+from autosave import Autosave, recover
+from dirty import DirtyTracker
+from tiles import TileStore
+
+WIDTH = 100
+HEIGHT = 70
+
+COLORS = [(i * 0x10F0F1) & 0xFFFFFF for i in range(16)]
+
+
+def paint(store, dirty, x, y, w, h, color):
+    store.write(np.full((h, w), color, dtype=np.uint8), x, y)
+    dirty.mark(x, y, w, h)
+
+
+def new_canvas():
+    return TileStore(WIDTH, HEIGHT), DirtyTracker(WIDTH, HEIGHT)
+
+
+def recovered(filename, width=WIDTH, height=HEIGHT):
+    store = TileStore(width, height)
+    played, colors = recover(filename, store)
+    return store, played, colors
+
+
+def test_small_changes_are_played_back(tmp_path):
+    filename = str(tmp_path / "autosave.journal")
+    store, dirty = new_canvas()
+    autosave = Autosave(store, dirty, lambda: COLORS, filename)
+    for i in range(5):
+        paint(store, dirty, i * 17, i * 11, 9, 7, i + 1)
+        autosave.save()
+    autosave.close()
+
+    back, played, colors = recovered(filename)
+    assert played == 5
+    assert colors is None
+    assert (back.read() == store.read()).all()
+
+
+def test_checkpoints_hold_the_drawing_and_palette(tmp_path):
+    filename = str(tmp_path / "autosave.journal")
+    store, dirty = new_canvas()
+    palette = list(COLORS)
+    autosave = Autosave(store, dirty, lambda: palette, filename)
+
+    # A change to most of the canvas, then a new palette, each save the
+    # whole drawing, and the tiles after them are added on top
+    paint(store, dirty, 0, 0, WIDTH, HEIGHT, 3)
+    autosave.save()
+    palette[1] = 0x123456
+    paint(store, dirty, 5, 5, 4, 4, 9)
+    autosave.save()
+    paint(store, dirty, 50, 30, 4, 4, 10)
+    autosave.close()
+
+    back, played, colors = recovered(filename)
+    assert played == 2
+    assert colors == palette
+    assert (back.read() == store.read()).all()
+
+
+def test_checkpoint_is_not_changed_by_later_drawing(tmp_path):
+    filename = str(tmp_path / "autosave.journal")
+    store, dirty = new_canvas()
+    paint(store, dirty, 0, 0, WIDTH, HEIGHT, 4)
+    saved = store.read()
+    autosave = Autosave(store, dirty, lambda: COLORS, filename)
+    autosave.checkpoint()
+
+    # Whatever happens to the canvas before the worker gets to it
+    paint(store, dirty, 0, 0, WIDTH, HEIGHT, 8)
+    store.clear()
+    autosave.tasks.put(None)
+    autosave.worker.join()
+
+    back, played, colors = recovered(filename)
+    assert played == 1
+    assert (back.read() == saved).all()
+
+
+def test_journal_cut_short_keeps_the_whole_records(tmp_path):
+    filename = str(tmp_path / "autosave.journal")
+    store, dirty = new_canvas()
+    autosave = Autosave(store, dirty, lambda: COLORS, filename)
+    paint(store, dirty, 10, 10, 8, 8, 2)
+    autosave.save()
+    autosave.close()
+    first = store.read()
+
+    autosave = Autosave(store, dirty, lambda: COLORS, filename)
+    paint(store, dirty, 60, 40, 8, 8, 6)
+    autosave.close()
+
+    with open(filename, "rb") as f:
+        data = f.read()
+    with open(filename, "wb") as f:
+        f.write(data[:-3])
+
+    back, played, colors = recovered(filename)
+    assert played == 1
+    assert (back.read() == first).all()
+
+
+def test_journal_of_a_bigger_canvas_is_cropped(tmp_path):
+    filename = str(tmp_path / "autosave.journal")
+    store, dirty = new_canvas()
+    autosave = Autosave(store, dirty, lambda: COLORS, filename)
+    paint(store, dirty, 0, 0, WIDTH, HEIGHT, 5)
+    autosave.save()
+    paint(store, dirty, 90, 60, 10, 10, 7)
+    autosave.close()
+
+    back, played, colors = recovered(filename, 40, 30)
+    assert played == 2
+    assert (back.read() == store.read(area=(0, 0, 40, 30))).all()
+
+
+def test_missing_journal_plays_nothing(tmp_path):
+    back, played, colors = recovered(str(tmp_path / "nothing.journal"))
+    assert (played, colors) == (0, None)
+    assert not back.stored.any()
+
+
+def test_closing_twice_is_fine(tmp_path):
+    store, dirty = new_canvas()
+    autosave = Autosave(store, dirty, lambda: COLORS, str(tmp_path / "autosave.journal"))
+    autosave.close()
+    autosave.close()
+    assert not autosave.worker.is_alive()
@@ -0,0 +1,106 @@
+# Tests for the fill bucket and the blur's mode filter (canvas_buffer.py)
+#
+#   python -m pytest tests
+from collections import deque
+
+import numpy as np
+import pytest
+
+from canvas_buffer import flood_fill, mode_filter, mode_filter_bands
+
+
+def random_picture(height, width, colors, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, colors, size=(height, width), dtype=np.uint8)
+
+
+def simple_flood_fill(pixels, x, y, color, connectivity):
+    # One pixel at a time, to check the run-based fill against
+    pixels = pixels.copy()
+    height, width = pixels.shape
+    target = pixels[y, x]
+    if target == color:
+        return pixels
+    steps = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    if connectivity == 8:
+        steps += [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+    pixels[y, x] = color
+    todo = deque([(x, y)])
+    while todo:
+        x, y = todo.popleft()
+        for step_x, step_y in steps:
+            next_x, next_y = x + step_x, y + step_y
+            if 0 <= next_x < width and 0 <= next_y < height and pixels[next_y, next_x] == target:
+                pixels[next_y, next_x] = color
+                todo.append((next_x, next_y))
+    return pixels
+
+
+def simple_mode_filter(pixels, radius):
+    # Count the colors of every square by hand, to check the sliding
+    # histogram against. Ties go to the color seen first.
+    height, width = pixels.shape
+    result = np.zeros_like(pixels)
+    for y in range(height):
+        for x in range(width):
+            square = pixels[
+                max(y - radius, 0):y + radius + 1, max(x - radius, 0):x + radius + 1
+            ].ravel()
+            colored = [int(color) for color in square if color != 0]
+            if colored:
+                result[y, x] = max(
+                    colored, key=lambda color: (colored.count(color), -colored.index(color))
+                )
+    return result
+
+
+@pytest.mark.parametrize("connectivity", [4, 8])
+@pytest.mark.parametrize("seed", range(5))
+def test_fill_matches_pixel_by_pixel_fill(connectivity, seed):
+    pixels = random_picture(23, 31, 3, seed)
+    x, y = 11, 7
+    expected = simple_flood_fill(pixels, x, y, 9, connectivity)
+    filled = pixels.copy()
+    box = flood_fill(filled, x, y, 9, connectivity)
+    assert (filled == expected).all()
+
+    # The box is the smallest one around every changed pixel
+    ys, xs = np.nonzero(filled != pixels)
+    assert box == (xs.min(), ys.min(), xs.max() - xs.min() + 1, ys.max() - ys.min() + 1)
+
+
+def test_diagonal_gap_only_leaks_with_8_connectivity():
+    # A diagonal line of 1s splits the picture in two
+    pixels = np.zeros((8, 8), dtype=np.uint8)
+    pixels[np.arange(8), np.arange(8)] = 1
+
+    four = pixels.copy()
+    flood_fill(four, 7, 0, 5, 4)
+    assert (four[np.triu_indices(8, 1)] == 5).all()
+    assert (four[np.tril_indices(8, -1)] == 0).all()
+
+    eight = pixels.copy()
+    flood_fill(eight, 7, 0, 5, 8)
+    assert (eight[pixels == 0] == 5).all()
+
+
+def test_fill_with_the_same_color_does_nothing():
+    pixels = random_picture(10, 10, 3)
+    filled = pixels.copy()
+    assert flood_fill(filled, 4, 4, pixels[4, 4]) is None
+    assert (filled == pixels).all()
+
+
+@pytest.mark.parametrize("radius", [1, 2, 3])
+@pytest.mark.parametrize("height, width", [(1, 1), (7, 19), (19, 7), (24, 24)])
+def test_mode_filter_matches_counting_by_hand(radius, height, width):
+    pixels = random_picture(height, width, 4, seed=radius)
+    assert (mode_filter(pixels, radius) == simple_mode_filter(pixels, radius)).all()
+
+
+@pytest.mark.parametrize("rows", [1, 2, 5, 16, 100])
+def test_mode_filter_bands_of_any_height_give_the_same_result(rows):
+    pixels = random_picture(37, 29, 6, seed=1)
+    bands = list(mode_filter_bands(pixels, 2, rows))
+    assert all(len(band) == rows for band in bands[:-1])
+    assert (np.concatenate(bands) == mode_filter(pixels, 2)).all()
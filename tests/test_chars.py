@@ -0,0 +1,36 @@
+# Tests for the type tool's character cells (CHARS in bunny-pyx.py)
+#
+#   python -m pytest tests
+import os
+
+import pytest
+
+from backend import HeadlessBackend
+from canvas_buffer import CanvasBuffer
+from replay import load_bunny_pyx
+
+bunny_pyx = load_bunny_pyx()
+
+RESOURCE_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "bunny-pyx.pyxres"
+)
+
+
+@pytest.fixture(scope="module")
+def sheet():
+    # Image 0 of the resource file, where the character cells are
+    backend = HeadlessBackend()
+    backend.init(256, 160, "test")
+    backend.load(RESOURCE_FILE)
+    return CanvasBuffer(backend.image(0), 256, 256).pixels
+
+
+@pytest.mark.parametrize("cell", bunny_pyx.CHARS)
+def test_every_char_cell_has_pixels(sheet, cell):
+    x, y = cell
+    assert (x % 16, y % 16) == (0, 0)
+    assert sheet[y:y + 16, x:x + 16].any()
+
+
+def test_char_cells_are_not_shared():
+    assert len(set(bunny_pyx.CHARS)) == len(bunny_pyx.CHARS)
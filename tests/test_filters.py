@@ -0,0 +1,82 @@
+# Tests for running chains of filters (filter_steps in bunny-pyx.py and
+# gather.py), where remaps and pixel moves are fused into one pass
+#
+#   python -m pytest tests
+import itertools
+
+import numpy as np
+import pytest
+
+from backend import HeadlessBackend
+from palette import get_remap
+from replay import load_bunny_pyx
+
+bunny_pyx = load_bunny_pyx()
+
+
+@pytest.fixture(scope="module")
+def app():
+    return bunny_pyx.BunnyPyx(HeadlessBackend(seed=0))
+
+
+def random_picture(height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(1, 16, size=(height, width), dtype=np.uint8)
+    pixels[rng.random((height, width)) < 0.3] = 0
+    return pixels
+
+
+def filter_on_its_own(app, pixels, filter_type):
+    # Run one filter's kernel straight on the whole picture, without any
+    # fusing, gather maps or bands
+    entry = app.filters[filter_type]
+    height = pixels.shape[0]
+    if entry.kind == "remap":
+        return get_remap(entry.kernel)[pixels]
+    if entry.kind == "bands":
+        return np.concatenate(list(entry.kernel(app, pixels, height)))
+    return entry.kernel(app, pixels, 0, height)
+
+
+def filters_in_turn(app, pixels, filter_types):
+    for filter_type in filter_types:
+        pixels = filter_on_its_own(app, pixels, filter_type)
+    return pixels
+
+
+# Non-square pictures, so rotating crops and fills in part of the canvas
+SIZES = [(24, 40), (40, 24), (33, 33)]
+
+PAIRS = list(itertools.product(range(len(bunny_pyx.FILTERS)), repeat=2))
+
+
+@pytest.mark.parametrize("height, width", SIZES)
+@pytest.mark.parametrize("pair", PAIRS)
+def test_every_pair_matches_filters_in_turn(app, height, width, pair):
+    pixels = random_picture(height, width)
+    expected = filters_in_turn(app, pixels, pair)
+    assert (app.filtered(pixels, list(pair)) == expected).all()
+
+
+# (the tall one is filtered a band of rows at a time)
+@pytest.mark.parametrize("height, width", SIZES + [(130, 90)])
+def test_long_chain_matches_filters_in_turn(app, height, width):
+    chain = [
+        bunny_pyx.FILTER_ROTATE_90, bunny_pyx.FILTER_INVERT, bunny_pyx.FILTER_WAVE,
+        bunny_pyx.FILTER_ROTATE_90, bunny_pyx.FILTER_GRAYSCALE, bunny_pyx.FILTER_FLIP_X,
+        bunny_pyx.FILTER_PIXELATE, bunny_pyx.FILTER_FLIP_Y, bunny_pyx.FILTER_INVERT,
+        bunny_pyx.FILTER_BLUR, bunny_pyx.FILTER_WAVE,
+    ]
+    pixels = random_picture(height, width, seed=1)
+    expected = filters_in_turn(app, pixels, chain)
+
+    # The second time the gather maps are already kept
+    assert (app.filtered(pixels, chain) == expected).all()
+    assert (app.filtered(pixels, chain) == expected).all()
+
+
+def test_filters_leave_their_input_alone(app):
+    pixels = random_picture(24, 40)
+    original = pixels.copy()
+    app.filtered(pixels, list(range(len(bunny_pyx.FILTERS))))
+    assert (pixels == original).all()
@@ -0,0 +1,109 @@
+# Tests for tile undo and redo (history.py)
+#
+#   python -m pytest tests
+import numpy as np
+
+from dirty import TILE_SIZE, DirtyTracker
+from history import History
+from jobs import JobRunner
+from tiles import TileStore
+
+WIDTH = 100
+HEIGHT = 70
+
+
+def paint(store, dirty, x, y, w, h, color):
+    store.write(np.full((h, w), color, dtype=np.uint8), x, y)
+    dirty.mark(x, y, w, h)
+
+
+def new_history(max_bytes=1 << 20):
+    store = TileStore(WIDTH, HEIGHT)
+    dirty = DirtyTracker(WIDTH, HEIGHT)
+    return store, dirty, History(store, max_bytes=max_bytes, dirty=dirty)
+
+
+def test_undo_and_redo_go_back_and_forth():
+    store, dirty, history = new_history()
+    pictures = [store.read()]
+    for i, (x, y) in enumerate([(3, 5), (40, 20), (80, 60), (0, 0)]):
+        paint(store, dirty, x, y, 20, 10, i + 1)
+        assert history.commit()
+        pictures.append(store.read())
+
+    for picture in reversed(pictures[:-1]):
+        assert history.undo()
+        assert (store.read() == picture).all()
+    assert not history.undo()
+
+    for picture in pictures[1:]:
+        assert history.redo()
+        assert (store.read() == picture).all()
+    assert not history.redo()
+
+
+def test_commit_without_changes_adds_no_step():
+    store, dirty, history = new_history()
+    paint(store, dirty, 10, 10, 5, 5, 3)
+    history.commit()
+    paint(store, dirty, 10, 10, 5, 5, 3)
+    assert not history.commit()
+    assert len(history.undo_steps) == 1
+
+
+def test_new_change_drops_redo_steps():
+    store, dirty, history = new_history()
+    paint(store, dirty, 10, 10, 5, 5, 3)
+    history.commit()
+    history.undo()
+    assert history.can_redo()
+    paint(store, dirty, 50, 10, 5, 5, 4)
+    history.commit()
+    assert not history.can_redo()
+
+
+def test_old_steps_go_when_over_budget():
+    # Each step changes a different tile, storing two tiles (before and
+    # after, though every blank before is the same stored tile)
+    store, dirty, history = new_history(max_bytes=4 * TILE_SIZE * TILE_SIZE)
+    for i in range(6):
+        paint(store, dirty, i * TILE_SIZE, 0, TILE_SIZE, TILE_SIZE, i + 1)
+        history.commit()
+        assert history.tile_bytes <= history.max_bytes
+    assert len(history.undo_steps) == 3
+
+    # The steps kept are the newest ones
+    for i in range(3):
+        history.undo()
+    assert not history.can_undo()
+    assert store.read(area=(0, 0, 3 * TILE_SIZE, TILE_SIZE)).all()
+    assert not store.read(area=(3 * TILE_SIZE, 0, 3 * TILE_SIZE, TILE_SIZE)).any()
+
+
+def test_newest_step_is_kept_even_over_budget():
+    store, dirty, history = new_history(max_bytes=TILE_SIZE * TILE_SIZE)
+    paint(store, dirty, 0, 0, WIDTH, HEIGHT, 5)
+    history.commit()
+    paint(store, dirty, 0, 0, WIDTH, HEIGHT, 6)
+    history.commit()
+    assert len(history.undo_steps) == 1
+    assert history.undo()
+    assert (store.read() == 5).all()
+
+
+def test_cancelled_commit_leaves_the_rest_for_the_next_one():
+    store, dirty, history = new_history()
+    before = store.read()
+    paint(store, dirty, 0, 0, WIDTH, HEIGHT, 7)
+
+    # Stop the commit after its first slice of tiles
+    jobs = JobRunner()
+    jobs.add("history", lambda: history.commit_steps(step_tiles=4), lambda changed: None)
+    jobs.run(steps=1)
+    jobs.cancel()
+    assert history.commit()
+    assert len(history.undo_steps) == 2
+
+    assert history.undo()
+    assert history.undo()
+    assert (store.read() == before).all()
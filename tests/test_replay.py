@@ -0,0 +1,106 @@
+# Tests for recording and replaying drawing sessions (replay.py)
+#
+#   python -m pytest tests
+import random
+
+import pytest
+import pyxel
+
+from backend import HeadlessBackend
+from replay import RecordingBackend, load_bunny_pyx, load_recording, replay_headless
+
+bunny_pyx = load_bunny_pyx()
+
+
+def play_randomly(backend, app, frames, seed):
+    # Click tools and colors, drag on the canvas, undo and redo and scroll,
+    # with a fixed seed so every run does the same
+    rng = random.Random(seed)
+    keys = [pyxel.KEY_CTRL, pyxel.KEY_Z, pyxel.KEY_Y]
+    for frame in range(frames):
+        r = rng.random()
+        if r < 0.04:
+            # A tool
+            backend.set_mouse(rng.randrange(12) * 16 + 3, 130)
+            backend.press(pyxel.MOUSE_BUTTON_LEFT)
+        elif r < 0.07:
+            # A color
+            backend.set_mouse(rng.randrange(16, 128), 150)
+            backend.press(pyxel.MOUSE_BUTTON_LEFT)
+        elif r < 0.09:
+            backend.held.add(pyxel.KEY_CTRL)
+            backend.press(rng.choice(keys[1:]))
+        elif r < 0.1:
+            backend.scroll(rng.choice([-1, 1]))
+        elif r < 0.2:
+            backend.set_mouse(rng.randrange(-5, 260), rng.randrange(-5, 130))
+            backend.press(pyxel.MOUSE_BUTTON_LEFT)
+        elif r < 0.3:
+            backend.release(pyxel.MOUSE_BUTTON_LEFT)
+        else:
+            backend.set_mouse(rng.randrange(-5, 260), rng.randrange(-5, 130))
+        backend.step(draw=frame % 3 == 0)
+        for key in keys:
+            backend.release(key)
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_replay_makes_the_same_drawing(tmp_path, seed):
+    filename = str(tmp_path / "session.bpxr")
+    headless = HeadlessBackend(seed=seed)
+    recorder = RecordingBackend(headless, filename, seed=seed)
+    app = bunny_pyx.BunnyPyx(recorder)
+    play_randomly(headless, app, 600, seed)
+    app.jobs.finish_all()
+    drawing = app.layers.read()
+    recorder.quit()
+    assert drawing.any()
+
+    replayed, times = replay_headless(filename)
+    replayed.jobs.finish_all()
+    assert len(times) == recorder.frames
+    assert (replayed.layers.read() == drawing).all()
+
+
+def test_recording_cut_short_ends_at_a_whole_frame(tmp_path):
+    filename = str(tmp_path / "session.bpxr")
+    headless = HeadlessBackend()
+    recorder = RecordingBackend(headless, filename, seed=3)
+    app = bunny_pyx.BunnyPyx(recorder)
+    play_randomly(headless, app, 200, 3)
+    recorder.quit()
+
+    with open(filename, "rb") as f:
+        data = f.read()
+    with open(filename, "wb") as f:
+        f.write(data[:len(data) // 2])
+    seed, frames = load_recording(filename)
+    assert seed == 3
+    assert 0 < len(frames) < recorder.frames
+
+
+def test_not_a_recording_raises_value_error(tmp_path):
+    filename = tmp_path / "session.bpxr"
+    filename.write_bytes(b"XXXX" + bytes(20))
+    with pytest.raises(ValueError):
+        load_recording(str(filename))
+
+
+def test_releasing_over_the_toolbar_ends_the_stroke():
+    backend = HeadlessBackend()
+    app = bunny_pyx.BunnyPyx(backend)
+    app.current_tool = bunny_pyx.TOOL_PENCIL
+    backend.set_mouse(20, 20)
+    backend.press(pyxel.MOUSE_BUTTON_LEFT)
+    backend.step()
+    backend.set_mouse(60, 40)
+    backend.step()
+    assert app.drawing
+
+    # Let go with the mouse below the canvas
+    backend.set_mouse(60, bunny_pyx.VIEW_HEIGHT + 10)
+    backend.release(pyxel.MOUSE_BUTTON_LEFT)
+    backend.step()
+    assert not app.drawing
+    backend.step()
+    assert app.history.can_undo()
@@ -0,0 +1,130 @@
+# Tests for saving, loading and exporting drawings (storage.py)
+#
+#   python -m pytest tests
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from storage import drawing_bytes, drawing_from_bytes, export_png, load_drawing, save_drawing
+
+COLORS = [0x000000, 0x2B335F, 0x7E2072, 0x19959C, 0x8B4852, 0x395C98, 0xA9C1FF, 0xEEEEEE,
+          0xD4186C, 0xD38441, 0xE9C35B, 0x70C6A9, 0x7696DE, 0xA3A3A3, 0xFF9798, 0xEDC7B0]
+
+# Whole tiles, odd sizes, one row or column, and sizes that aren't a
+# multiple of the 16 pixel tiles
+SIZES = [(1, 1), (16, 16), (1, 37), (37, 1), (17, 33), (31, 5), (100, 250), (128, 256)]
+
+
+def random_pixels(height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 16, size=(height, width), dtype=np.uint8)
+    # Some solid areas too, so both kinds of tiles show up
+    pixels[: height // 2, : width // 2] = 5
+    return pixels
+
+
+@pytest.mark.parametrize("height, width", SIZES)
+def test_random_round_trip(tmp_path, height, width):
+    pixels = random_pixels(height, width)
+    filename = tmp_path / "drawing.bpx"
+    save_drawing(filename, pixels, COLORS)
+    loaded, colors = load_drawing(filename)
+    assert loaded.shape == (height, width)
+    assert (loaded == pixels).all()
+    assert colors == COLORS
+
+
+@pytest.mark.parametrize("height, width", SIZES)
+@pytest.mark.parametrize("color", [0, 7, 15])
+def test_solid_round_trip(height, width, color):
+    pixels = np.full((height, width), color, dtype=np.uint8)
+    loaded, colors = drawing_from_bytes(drawing_bytes(pixels, COLORS))
+    assert (loaded == pixels).all()
+    assert colors == COLORS
+
+
+def test_every_palette_color_round_trips():
+    colors = [(i * 0x10F0F1) & 0xFFFFFF for i in range(16)]
+    pixels = random_pixels(20, 20)
+    assert drawing_from_bytes(drawing_bytes(pixels, colors))[1] == colors
+
+
+def test_truncated_files_raise_value_error():
+    data = drawing_bytes(random_pixels(40, 50), COLORS)
+    for length in range(len(data)):
+        with pytest.raises(ValueError):
+            drawing_from_bytes(data[:length])
+
+
+def test_damaged_body_raises_value_error():
+    data = bytearray(drawing_bytes(random_pixels(40, 50), COLORS))
+    body_start = 13 + 48
+    for offset in range(body_start, len(data), 7):
+        damaged = bytearray(data)
+        damaged[offset] ^= 0x55
+        with pytest.raises(ValueError):
+            drawing_from_bytes(bytes(damaged))
+
+
+def test_wrong_header_raises_value_error():
+    data = drawing_bytes(random_pixels(8, 8), COLORS)
+    with pytest.raises(ValueError):
+        drawing_from_bytes(b"XXXX" + data[4:])
+    with pytest.raises(ValueError):
+        drawing_from_bytes(data[:4] + bytes([99]) + data[5:])
+
+
+def test_body_that_doesnt_fit_the_size_raises_value_error():
+    # A well-formed body for a different canvas size
+    header = struct.pack("<4sBII", b"BPYX", 1, 32, 32)
+    palette = bytes(48)
+    for body in (bytes(3), bytes(4) + bytes(10), bytes([17, 0, 0, 0])):
+        with pytest.raises(ValueError):
+            drawing_from_bytes(header + palette + zlib.compress(body))
+
+
+def read_png(filename):
+    # Decode a 4-bit palette PNG like export_png writes into its pixels
+    # and palette, checking every chunk on the way
+    with open(filename, "rb") as f:
+        data = f.read()
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+
+    offset = 8
+    chunks = []
+    while offset < len(data):
+        (length,) = struct.unpack_from(">I", data, offset)
+        kind = data[offset + 4:offset + 8]
+        body = data[offset + 8:offset + 8 + length]
+        (crc,) = struct.unpack_from(">I", data, offset + 8 + length)
+        assert crc == zlib.crc32(body, zlib.crc32(kind))
+        chunks.append((kind, body))
+        offset += 12 + length
+    assert chunks[0][0] == b"IHDR"
+    assert chunks[-1] == (b"IEND", b"")
+
+    width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", chunks[0][1])
+    assert (depth, color_type, interlace) == (4, 3, 0)
+    palette = dict(chunks)[b"PLTE"]
+    colors = [int.from_bytes(palette[i:i + 3], "big") for i in range(0, len(palette), 3)]
+
+    raw = zlib.decompress(b"".join(body for kind, body in chunks if kind == b"IDAT"))
+    rows = np.frombuffer(raw, dtype=np.uint8).reshape(height, -1)
+    assert (rows[:, 0] == 0).all()
+    pixels = np.empty((height, (rows.shape[1] - 1) * 2), dtype=np.uint8)
+    pixels[:, 0::2] = rows[:, 1:] >> 4
+    pixels[:, 1::2] = rows[:, 1:] & 15
+    return pixels[:, :width], colors
+
+
+@pytest.mark.parametrize("height, width", SIZES + [(200, 3)])
+def test_exported_png_matches_the_pixels(tmp_path, height, width):
+    pixels = random_pixels(height, width)
+    filename = tmp_path / "drawing.png"
+    export_png(filename, pixels, COLORS)
+    decoded, colors = read_png(filename)
+    assert decoded.shape == (height, width)
+    assert (decoded == pixels).all()
+    assert colors == COLORS
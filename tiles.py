@@ -0,0 +1,361 @@
+# Sparse tiles
+# A picture kept as 16x16 tiles, where only the tiles with something on
+# them are stored. A tile that is all color 0 (like every tile of a new
+# canvas) isn't stored at all, so a huge canvas only costs memory for the
+# parts that were painted.
+#
+# Pyxel can only draw on an image, so TileCanvas draws every shape on a
+# small scratch image that holds just the tiles under the shape, and puts
+# those tiles back afterwards.
+import math
+
+import numpy as np
+
+from canvas_buffer import stroke_capsule
+from dirty import TILE_SIZE
+
+# Size of the scratch image. Bigger shapes are drawn a piece at a time.
+SCRATCH_SIZE = 256
+
+# read_steps copies about this many pixels at a time
+READ_BAND_PIXELS = 1 << 20
+
+
+class TileStore:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.rows = -(-height // TILE_SIZE)
+        self.cols = -(-width // TILE_SIZE)
+
+        # (tile row, tile column) -> TILE_SIZE x TILE_SIZE array of colors.
+        # The pixels of edge tiles that are past the edge are always 0.
+        # A tile array is never changed once stored (set_tiles puts in a
+        # new one), so copies of the store can share them.
+        self.tiles = {}
+
+        # Which tiles are stored, so they can be found without going
+        # through every tile of the picture
+        self.stored = np.zeros((self.rows, self.cols), dtype=bool)
+
+    def nbytes(self):
+        # Memory used by the stored tiles
+        return len(self.tiles) * TILE_SIZE * TILE_SIZE
+
+    def copy(self):
+        # Only the tile dictionary is copied, not the tiles themselves, so
+        # this is quick even for a big drawing
+        store = TileStore(self.width, self.height)
+        store.tiles = dict(self.tiles)
+        store.stored = self.stored.copy()
+        return store
+
+    def get_tiles(self, tile_ys, tile_xs):
+        # The pixels of the tiles at arrays of tile rows and columns, as a
+        # (count, TILE_SIZE, TILE_SIZE) array (all 0 for tiles not stored)
+        tile_ys = np.asarray(tile_ys)
+        tile_xs = np.asarray(tile_xs)
+        tiles = np.zeros((len(tile_ys), TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+        found = self.stored[tile_ys, tile_xs]
+        if found.any():
+            tiles[found] = [
+                self.tiles[key]
+                for key in zip(tile_ys[found].tolist(), tile_xs[found].tolist())
+            ]
+        return tiles
+
+    def set_tiles(self, tile_ys, tile_xs, tiles):
+        # Replace the tiles at arrays of tile rows and columns with copies
+        # of a (count, TILE_SIZE, TILE_SIZE) array. Tiles that are all 0
+        # are dropped.
+        tile_ys = np.asarray(tile_ys)
+        tile_xs = np.asarray(tile_xs)
+        if len(tile_ys) == 0:
+            return
+
+        # Whatever is past the edge of the picture stays 0
+        edge_y = self.height % TILE_SIZE
+        edge_x = self.width % TILE_SIZE
+        on_edge_y = (tile_ys == self.rows - 1) if edge_y else None
+        on_edge_x = (tile_xs == self.cols - 1) if edge_x else None
+        if (edge_y and on_edge_y.any()) or (edge_x and on_edge_x.any()):
+            tiles = tiles.copy()
+            if edge_y:
+                tiles[on_edge_y, edge_y:, :] = 0
+            if edge_x:
+                tiles[on_edge_x, :, edge_x:] = 0
+
+        # Only the tiles that have paint now, or had it before, need
+        # looking at one by one
+        keep = tiles.any(axis=(1, 2))
+        look = keep | self.stored[tile_ys, tile_xs]
+        for tile_y, tile_x, tile, has in zip(
+            tile_ys[look].tolist(), tile_xs[look].tolist(), tiles[look], keep[look].tolist()
+        ):
+            if has:
+                tile = tile.copy()
+                tile.flags.writeable = False
+                self.tiles[(tile_y, tile_x)] = tile
+            else:
+                del self.tiles[(tile_y, tile_x)]
+        self.stored[tile_ys, tile_xs] = keep
+
+    def grid(self, tile_y, tile_x, rows, cols, out=None):
+        # The pixels of a rows x cols block of whole tiles, into out if
+        # given (a big enough array, of which the top-left corner is used)
+        if out is None:
+            out = np.zeros((rows * TILE_SIZE, cols * TILE_SIZE), dtype=np.uint8)
+        else:
+            out = out[:rows * TILE_SIZE, :cols * TILE_SIZE]
+            out[:, :] = 0
+        tile_ys, tile_xs = np.nonzero(
+            self.stored[tile_y:tile_y + rows, tile_x:tile_x + cols]
+        )
+        if len(tile_ys):
+            tiles = self.get_tiles(tile_ys + tile_y, tile_xs + tile_x)
+            blocks = out.reshape(rows, TILE_SIZE, cols, TILE_SIZE).swapaxes(1, 2)
+            blocks[tile_ys, tile_xs] = tiles
+        return out
+
+    def set_grid(self, tile_y, tile_x, pixels):
+        # Put back a block of whole tiles, like the one grid returns
+        rows = pixels.shape[0] // TILE_SIZE
+        cols = pixels.shape[1] // TILE_SIZE
+        blocks = pixels.reshape(rows, TILE_SIZE, cols, TILE_SIZE).swapaxes(1, 2)
+        tile_ys, tile_xs = np.indices((rows, cols)).reshape(2, -1)
+        self.set_tiles(
+            tile_ys + tile_y, tile_xs + tile_x, blocks.reshape(-1, TILE_SIZE, TILE_SIZE)
+        )
+
+    def tile_box(self, x, y, w, h):
+        # The block of whole tiles around a pixel box, as
+        # (tile_y, tile_x, rows, cols)
+        tile_y = y // TILE_SIZE
+        tile_x = x // TILE_SIZE
+        rows = (y + h - 1) // TILE_SIZE + 1 - tile_y
+        cols = (x + w - 1) // TILE_SIZE + 1 - tile_x
+        return tile_y, tile_x, rows, cols
+
+    def read(self, area=None):
+        # A copy of the (x, y, w, h) box of the picture (all of it by
+        # default) as a (h, w) array. The box must be on the picture.
+        x, y, w, h = area if area is not None else (0, 0, self.width, self.height)
+        if w <= 0 or h <= 0:
+            return np.zeros((max(h, 0), max(w, 0)), dtype=np.uint8)
+        tile_y, tile_x, rows, cols = self.tile_box(x, y, w, h)
+        pixels = self.grid(tile_y, tile_x, rows, cols)
+        top = y - tile_y * TILE_SIZE
+        left = x - tile_x * TILE_SIZE
+        return pixels[top:top + h, left:left + w]
+
+    def write(self, pixels, x=0, y=0):
+        # Copy a (h, w) array of colors into the picture with its top-left
+        # corner at x, y. The box must be on the picture.
+        h, w = pixels.shape
+        if w <= 0 or h <= 0:
+            return
+        tile_y, tile_x, rows, cols = self.tile_box(x, y, w, h)
+        top = y - tile_y * TILE_SIZE
+        left = x - tile_x * TILE_SIZE
+
+        # When the box is made of whole tiles (or ends at the edge of the
+        # picture), what is stored there now doesn't matter
+        whole = (
+            top == 0
+            and left == 0
+            and (h % TILE_SIZE == 0 or y + h == self.height)
+            and (w % TILE_SIZE == 0 or x + w == self.width)
+        )
+        if whole:
+            grid = np.zeros((rows * TILE_SIZE, cols * TILE_SIZE), dtype=np.uint8)
+        else:
+            grid = self.grid(tile_y, tile_x, rows, cols)
+        grid[top:top + h, left:left + w] = pixels
+        self.set_grid(tile_y, tile_x, grid)
+
+    def clear(self, tile_y=0, rows=None):
+        # Drop every tile in rows tile rows from tile_y (all of them by
+        # default)
+        if rows is None:
+            rows = self.rows - tile_y
+        tile_ys, tile_xs = np.nonzero(self.stored[tile_y:tile_y + rows])
+        for key in zip((tile_ys + tile_y).tolist(), tile_xs.tolist()):
+            del self.tiles[key]
+        self.stored[tile_y:tile_y + rows] = False
+
+
+class TileCanvas:
+    def __init__(self, store, scratch, width, height, dirty=None, top=0):
+        # A width x height canvas on a TileStore, top rows down (a whole
+        # number of tiles). scratch is a pyxel image of at least
+        # SCRATCH_SIZE x SCRATCH_SIZE that shapes are drawn on.
+        self.store = store
+        self.scratch = scratch
+        self.width = width
+        self.height = height
+        self.top = top
+
+        # Optional DirtyTracker that hears about every change made
+        # through this canvas (in store coordinates)
+        self.dirty = dirty
+
+        # Live view of the scratch image memory
+        memory = np.ctypeslib.as_array(scratch.data_ptr())
+        self.scratch_pixels = memory.reshape(scratch.height, scratch.width)
+
+    def read(self, area=None):
+        # A copy of the (x, y, w, h) box of the canvas (all of it by
+        # default) that is safe to modify
+        x, y, w, h = area if area is not None else (0, 0, self.width, self.height)
+        return self.store.read((x, y + self.top, w, h))
+
+    def read_steps(self):
+        # read as a job (see jobs.py): copies the whole canvas a band of
+        # tile rows at a time, yields how far along it is and returns the
+        # copy
+        pixels = np.empty((self.height, self.width), dtype=np.uint8)
+        rows = max(1, READ_BAND_PIXELS // (self.width * TILE_SIZE)) * TILE_SIZE
+        for y in range(0, self.height, rows):
+            h = min(rows, self.height - y)
+            pixels[y:y + h] = self.read((0, y, self.width, h))
+            yield (y + h) / self.height
+        return pixels
+
+    def write(self, pixels, x=0, y=0):
+        # Copy an array of colors into the canvas with its top-left corner
+        # at x, y (the whole canvas by default)
+        h, w = pixels.shape
+        self.store.write(pixels, x, y + self.top)
+        self.mark(x, y, w, h)
+
+    def mark(self, x, y, w, h):
+        # Report a box that was changed
+        if self.dirty is None:
+            return
+        # Cut to the canvas rows, so nothing above or below it is marked
+        y2 = min(y + h, self.height)
+        y = max(y, 0)
+        if y < y2:
+            self.dirty.mark(x, y + self.top, w, y2 - y)
+
+    def mark_all(self):
+        self.mark(0, 0, self.width, self.height)
+
+    def clip_box(self, x, y, w, h):
+        # The part of a box that is on the canvas, in whole pixels, as
+        # (x1, y1, x2, y2), or None when none of it is
+        x1 = max(0, math.floor(x))
+        y1 = max(0, math.floor(y))
+        x2 = min(self.width, math.ceil(x + w))
+        y2 = min(self.height, math.ceil(y + h))
+        if x1 >= x2 or y1 >= y2:
+            return None
+        return x1, y1, x2, y2
+
+    def draw(self, x, y, w, h, shape):
+        # Call shape(image) to draw a shape that stays inside the (x, y,
+        # w, h) box, on the scratch image holding the tiles under it. The
+        # image's camera is set so canvas coordinates land in the right
+        # place, and its clip box keeps the shape on the canvas.
+        box = self.clip_box(x, y, w, h)
+        if box is None:
+            return
+        x1, y1, x2, y2 = box
+        first_y = y1 // TILE_SIZE * TILE_SIZE
+        first_x = x1 // TILE_SIZE * TILE_SIZE
+
+        # A piece of the box at a time, each a block of whole tiles
+        for piece_y in range(first_y, y2, SCRATCH_SIZE):
+            for piece_x in range(first_x, x2, SCRATCH_SIZE):
+                rows = -(-(min(piece_y + SCRATCH_SIZE, y2) - piece_y) // TILE_SIZE)
+                cols = -(-(min(piece_x + SCRATCH_SIZE, x2) - piece_x) // TILE_SIZE)
+                tile_y = (piece_y + self.top) // TILE_SIZE
+                tile_x = piece_x // TILE_SIZE
+                pixels = self.store.grid(tile_y, tile_x, rows, cols, self.scratch_pixels)
+                self.scratch.clip(
+                    0,
+                    0,
+                    min(cols * TILE_SIZE, self.width - piece_x),
+                    min(rows * TILE_SIZE, self.height - piece_y),
+                )
+                self.scratch.camera(piece_x, piece_y)
+                shape(self.scratch)
+                self.store.set_grid(tile_y, tile_x, pixels)
+        self.mark(x1, y1, x2 - x1, y2 - y1)
+
+    # Drawing on the canvas. The boxes are one pixel bigger than needed on
+    # each side so pyxel's rounding of float coordinates never reaches
+    # outside them.
+
+    def cls(self, col):
+        if col == 0:
+            rows = -(-self.height // TILE_SIZE)
+            self.store.clear(self.top // TILE_SIZE, rows)
+            self.mark_all()
+        else:
+            self.write(np.full((self.height, self.width), col, dtype=np.uint8))
+
+    def pset(self, x, y, col):
+        self.draw(x - 1, y - 1, 3, 3, lambda image: image.pset(x, y, col))
+
+    def line(self, x1, y1, x2, y2, col):
+        self.draw(
+            min(x1, x2) - 1,
+            min(y1, y2) - 1,
+            abs(x2 - x1) + 3,
+            abs(y2 - y1) + 3,
+            lambda image: image.line(x1, y1, x2, y2, col),
+        )
+
+    def rect(self, x, y, w, h, col):
+        self.draw(x - 1, y - 1, w + 2, h + 2, lambda image: image.rect(x, y, w, h, col))
+
+    def rectb(self, x, y, w, h, col):
+        self.draw(x - 1, y - 1, w + 2, h + 2, lambda image: image.rectb(x, y, w, h, col))
+
+    def circ(self, x, y, r, col):
+        self.draw(
+            x - r - 1, y - r - 1, r * 2 + 3, r * 2 + 3, lambda image: image.circ(x, y, r, col)
+        )
+
+    def circb(self, x, y, r, col):
+        self.draw(
+            x - r - 1, y - r - 1, r * 2 + 3, r * 2 + 3, lambda image: image.circb(x, y, r, col)
+        )
+
+    def blt(self, x, y, img, u, v, w, h, colkey=None):
+        self.draw(
+            x - 1,
+            y - 1,
+            abs(w) + 2,
+            abs(h) + 2,
+            lambda image: image.blt(x, y, img, u, v, w, h, colkey),
+        )
+
+    def paint_mask(self, x, y, mask, col):
+        # Paint col wherever a boolean mask is True, with the mask's
+        # top-left corner at x, y
+        h, w = mask.shape
+        box = self.clip_box(x, y, w, h)
+        if box is None:
+            return
+        x1, y1, x2, y2 = box
+        area = self.read((x1, y1, x2 - x1, y2 - y1))
+        area[mask[y1 - y:y2 - y, x1 - x:x2 - x]] = col
+        self.write(area, x1, y1)
+
+    def capsule(self, x1, y1, x2, y2, radius, col):
+        # A thick line with round ends (see stroke_capsule), drawn on just
+        # the pixels around it
+        box = self.clip_box(
+            min(x1, x2) - radius,
+            min(y1, y2) - radius,
+            abs(x2 - x1) + radius * 2 + 1,
+            abs(y2 - y1) + radius * 2 + 1,
+        )
+        if box is None:
+            return
+        left, top, right, bottom = box
+        area = self.read((left, top, right - left, bottom - top))
+        stroke_capsule(area, x1 - left, y1 - top, x2 - left, y2 - top, radius, col)
+        self.write(area, left, top)
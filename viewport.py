@@ -0,0 +1,75 @@
+# Viewport
+# The canvas can be much bigger than the window. The viewport is the part
+# of it that is on screen: the canvas pixel at the top-left corner of the
+# view, and how many screen pixels wide each canvas pixel is (zoom).
+# Tools work in canvas coordinates; only drawing to the screen and
+# reading the mouse go through the viewport.
+import math
+
+# Zoom levels to step through. They all divide the view size, so the view
+# always shows a whole number of canvas pixels.
+ZOOM_LEVELS = [1, 2, 4, 8]
+
+
+class Viewport:
+    def __init__(self, canvas_width, canvas_height, view_width, view_height):
+        self.canvas_width = canvas_width
+        self.canvas_height = canvas_height
+        self.view_width = view_width
+        self.view_height = view_height
+        self.x = 0
+        self.y = 0
+        self.zoom = 1
+
+    def key(self):
+        # Changes whenever a different part of the canvas is on screen
+        return (self.x, self.y, self.zoom)
+
+    def visible(self):
+        # The (x, y, w, h) box of the canvas that is on screen
+        w = min(self.view_width // self.zoom, self.canvas_width - self.x)
+        h = min(self.view_height // self.zoom, self.canvas_height - self.y)
+        return (self.x, self.y, w, h)
+
+    def to_canvas(self, x, y):
+        # The canvas pixel under a screen position
+        return (self.x + x // self.zoom, self.y + y // self.zoom)
+
+    def to_screen(self, x, y):
+        # The screen position of a canvas pixel's top-left corner
+        return ((x - self.x) * self.zoom, (y - self.y) * self.zoom)
+
+    def canvas_rect(self, x, y, w, h):
+        # The box of canvas pixels a box on the screen covers
+        x1 = self.x + math.floor(x / self.zoom)
+        y1 = self.y + math.floor(y / self.zoom)
+        x2 = self.x + math.ceil((x + w) / self.zoom)
+        y2 = self.y + math.ceil((y + h) / self.zoom)
+        return (x1, y1, x2 - x1, y2 - y1)
+
+    def pan(self, dx, dy):
+        # Move the view by dx, dy canvas pixels, staying on the canvas
+        max_x = max(0, self.canvas_width - self.view_width // self.zoom)
+        max_y = max(0, self.canvas_height - self.view_height // self.zoom)
+        self.x = min(max(self.x + dx, 0), max_x)
+        self.y = min(max(self.y + dy, 0), max_y)
+
+    def keep(self, canvas_x, canvas_y, x, y):
+        # Scroll so the canvas pixel canvas_x, canvas_y is under screen
+        # position x, y (as close as the canvas edges allow)
+        self.x = canvas_x - x // self.zoom
+        self.y = canvas_y - y // self.zoom
+        self.pan(0, 0)
+
+    def zoom_at(self, x, y, zoom):
+        # Change the zoom, keeping the canvas pixel under screen
+        # position x, y where it is
+        canvas_x, canvas_y = self.to_canvas(x, y)
+        self.zoom = zoom
+        self.keep(canvas_x, canvas_y, x, y)
+
+    def step_zoom(self, x, y, steps):
+        # Go steps zoom levels in (or out, when negative)
+        level = ZOOM_LEVELS.index(self.zoom) + steps
+        level = min(max(level, 0), len(ZOOM_LEVELS) - 1)
+        self.zoom_at(x, y, ZOOM_LEVELS[level])